@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Compares bibtexparser's homogeneize_latex_encoding() with paperpal's.
+
+Both encode every entry of a synthetic bibliography; the results must be
+identical:
+
+    PYTHONPATH=. python benchmarks/latex_encoding_benchmark.py --sizes 10000
+"""
+
+import argparse
+import copy
+import timeit
+
+import bibtexparser
+
+from bibtexparser.bparser import BibTexParser
+from bibtexparser.customization import homogeneize_latex_encoding
+
+from paperpal.latex_encoding import homogenise_latex_encoding
+from paperpal.test.fixtures import synthetic_bibliography
+
+
+def best_of(repeat, function):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def encode_all(customization, entries):
+    return [customization(entry) for entry in copy.deepcopy(entries)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>14} {:>8}'.format(
+        'entries', 'bibtexparser', 'paperpal', 'speedup'))
+    for size in args.sizes:
+        entries = bibtexparser.loads(synthetic_bibliography(size),
+                                     parser=BibTexParser()).entries
+        assert (encode_all(homogeneize_latex_encoding, entries) ==
+                encode_all(homogenise_latex_encoding, entries))
+
+        # Copying the entries is part of both timings.
+        before = best_of(args.repeat, lambda: encode_all(
+            homogeneize_latex_encoding, entries))
+        after = best_of(args.repeat, lambda: encode_all(
+            homogenise_latex_encoding, entries))
+        print('{:>10} {:>12.0f}/s {:>12.0f}/s {:>7.1f}x'.format(
+            size, size / before, size / after, before / after))
+
+
+if __name__ == '__main__':
+    main()
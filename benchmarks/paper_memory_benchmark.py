@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Measures the memory a listing takes, as dicts and as Paper records.
+
+Each representation is measured in a fresh process, by how much its
+resident set grows while a synthetic listing, as zotero-bridge.js pages it,
+is turned into items (Linux only):
+
+    PYTHONPATH=. python benchmarks/paper_memory_benchmark.py --sizes 100000
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import urllib
+
+from paperpal.paper import Paper
+from paperpal.test.fixtures import synthetic_library
+from paperpal.zotero import PAGE_SIZE, fix_filename
+
+REPRESENTATIONS = ['dict', 'paper']
+
+
+def pages(size):
+    """
+    Returns the listing of a synthetic collection as the JSON pages that
+    zotero-bridge.js would send.
+    """
+    items = [dict(authors=item['authors'], title=item['title'],
+                  cite_key=item['cite_key'],
+                  pdf_filename=None if item['pdf'] is None else
+                  'file://' + urllib.pathname2url(
+                      os.path.join('/zotero/storage', item['pdf'])))
+             for item in synthetic_library(size)['Synthetic']]
+    return [json.dumps(items[start:start + PAGE_SIZE])
+            for start in range(0, size, PAGE_SIZE)]
+
+
+def resident_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(representation, size):
+    """
+    Returns how many bytes the listing takes as the representation.
+    """
+    make = dict(dict=fix_filename, paper=Paper.from_zotero)[representation]
+    listing = pages(size)
+    gc.collect()
+    before = resident_bytes()
+    items = [make(item) for page in listing for item in json.loads(page)]
+    gc.collect()
+    after = resident_bytes()
+    assert len(items) == size
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--child', choices=REPRESENTATIONS,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(measure(args.child, args.sizes[0]))
+        return
+
+    for size in args.sizes:
+        results = {}
+        for representation in REPRESENTATIONS:
+            results[representation] = int(subprocess.check_output([
+                sys.executable, __file__, '--child', representation,
+                '--sizes', str(size)]))
+            print('{:>8} {:>8} items {:>8.1f} MiB {:>6} bytes/item'.format(
+                representation, size, results[representation] / 2.0 ** 20,
+                results[representation] // size))
+        print('{:>8} {:>8} items {:>8.2f}x smaller'.format(
+            'paper', size, float(results['dict']) / results['paper']))
+
+
+if __name__ == '__main__':
+    main()
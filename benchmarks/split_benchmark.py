@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Times converting one long PDF whole against converting it in page ranges.
+
+Unlike suite.py, this needs the real k2pdfopt and qpdf, since what matters
+is how long k2pdfopt takes per page, and what splitting and merging cost:
+
+    PYTHONPATH=. python benchmarks/split_benchmark.py thesis.pdf \\
+        --jobs 4 --split-pages 25 50 100 200
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from paperpal.k2pdfopt_wrapper import k2pdfopt_args
+from paperpal.scheduler import Job, Scheduler, default_jobs
+from paperpal.split_conversion import merge, page_count, page_ranges
+
+
+def convert(pdf, directory, jobs, split_pages=None):
+    """
+    Converts pdf into directory, in ranges of split_pages pages if given,
+    returning the elapsed seconds.
+    """
+    destination = os.path.join(directory, 'converted.pdf')
+    start = time.time()
+    if split_pages is None:
+        Scheduler(jobs=jobs).run([Job('whole', k2pdfopt_args(
+            pdf, destination))])
+    else:
+        ranges = page_ranges(page_count(pdf), split_pages)
+        parts = [os.path.join(directory, 'part{}.pdf'.format(index))
+                 for index in range(len(ranges))]
+        Scheduler(jobs=jobs).run([
+            Job(pages, k2pdfopt_args(pdf, part, pages=pages))
+            for part, pages in zip(parts, ranges)
+        ])
+        merge(parts, destination)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('pdf')
+    parser.add_argument('--jobs', type=int, default=default_jobs())
+    parser.add_argument('--split-pages', type=int, nargs='+',
+                        default=[25, 50, 100, 200])
+    args = parser.parse_args()
+
+    pages = page_count(args.pdf)
+    if pages is None:
+        parser.error('qpdf cannot count the pages of {}'.format(args.pdf))
+
+    directory = tempfile.mkdtemp(prefix='paperpal-benchmark-')
+    try:
+        whole = convert(args.pdf, directory, args.jobs)
+        print('{:>12} {:>8} {:>10.1f}s'.format('whole', pages, whole))
+        for split_pages in args.split_pages:
+            if split_pages >= pages:
+                continue
+            seconds = convert(args.pdf, directory, args.jobs, split_pages)
+            print('{:>12} {:>8} {:>10.1f}s {:>7.2f}x'.format(
+                'split {}'.format(split_pages),
+                len(page_ranges(pages, split_pages)), seconds,
+                whole / seconds))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
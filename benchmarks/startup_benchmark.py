@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Times how long paperpal takes to start, for each subcommand.
+
+Each subcommand is run with --help, which parses the command line but does
+nothing else, and compared with a bare interpreter:
+
+    PYTHONPATH=. python benchmarks/startup_benchmark.py --repeat 20
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SUBCOMMANDS = ['export', 'export-batch', 'copy', 'to-ebook', 'collections',
+               'fix-bibliography', 'watch']
+
+
+def best_of(repeat, args):
+    with open(os.devnull, 'w') as devnull:
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call(args, stdout=devnull)
+            times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    bare = best_of(args.repeat, [sys.executable, '-c', 'pass'])
+    print('{:>18} {:>8.1f} ms'.format('python', bare * 1000))
+    for subcommand in SUBCOMMANDS:
+        seconds = best_of(args.repeat, [sys.executable, '-m', 'paperpal',
+                                        subcommand, '--help'])
+        print('{:>18} {:>8.1f} ms {:>+8.1f} ms'.format(
+            subcommand, seconds * 1000, (seconds - bare) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Times paperpal's commands against a fake Zotero with a synthetic library.
+
+Nothing here needs Zotero or k2pdfopt: a local stand-in for MozRepl serves
+the library, and a fake k2pdfopt merely copies each PDF. Results are saved
+as JSON, and can be compared with an earlier run:
+
+    PYTHONPATH=. python benchmarks/suite.py --output after.json \\
+        --compare before.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+import warnings
+
+from paperpal import __version__
+from paperpal.__main__ import (copy_pdfs, export_bibliography,
+                               pdfs_to_update, to_ebook)
+from paperpal.fix_bibliography import fix_bibliography_file
+from paperpal.test.fake_mozrepl import FakeMozrepl
+from paperpal.test.fixtures import (make_fake_k2pdfopt,
+                                    synthetic_bibliography, synthetic_library)
+from paperpal.zotero import Zotero
+
+COLLECTION = 'Synthetic'
+
+BENCHMARKS = ['list_papers', 'pdfs_to_update', 'copy_pdfs', 'to_ebook',
+              'export_bibliography', 'export_bibliography_clean',
+              'fix_bibliography']
+
+
+class Workspace(object):
+    """
+    A temporary directory with a synthetic library, its PDFs, a bibliography
+    and a fake Zotero serving them.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.directory = tempfile.mkdtemp(prefix='paperpal-benchmark-')
+        self.storage = self.path('storage')
+        os.mkdir(self.storage)
+
+        library = synthetic_library(size, collection=COLLECTION)
+        for item in library[COLLECTION]:
+            if item['pdf'] is not None:
+                with open(os.path.join(self.storage, item['pdf']), 'wb') as pdf:
+                    pdf.write(b'%PDF-1.4\n' + os.urandom(1024))
+
+        self.bibliography = self.path('bibliography.bib')
+        with io.open(self.bibliography, 'w', encoding='UTF-8') as bib:
+            bib.write(synthetic_bibliography(size))
+
+        bin_directory = self.path('bin')
+        os.mkdir(bin_directory)
+        make_fake_k2pdfopt(bin_directory)
+        os.environ['PATH'] = bin_directory + os.pathsep + os.environ['PATH']
+
+        self.server = FakeMozrepl(library, pdf_directory=self.storage)
+        self.zotero = Zotero(repl=self.server.connect())
+
+    def path(self, *paths):
+        return os.path.join(self.directory, *paths)
+
+    def fresh_directory(self):
+        return tempfile.mkdtemp(dir=self.directory)
+
+    def close(self):
+        self.zotero.close()
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+
+def run_benchmark(name, workspace):
+    """
+    Runs one benchmark once, returning the elapsed seconds.
+    """
+    zotero = workspace.zotero
+    destination = workspace.fresh_directory()
+
+    def list_papers():
+        zotero.list_papers(COLLECTION)
+
+    def to_update():
+        for _ in pdfs_to_update(COLLECTION, destination, zotero=zotero):
+            pass
+
+    def copy():
+        copy_pdfs(COLLECTION, destination, zotero=zotero)
+
+    def convert():
+        to_ebook(COLLECTION, destination, zotero=zotero)
+
+    def export():
+        export_bibliography(COLLECTION, os.path.join(destination, 'out.bib'),
+                            zotero=zotero)
+
+    def export_clean():
+        export_bibliography(COLLECTION, os.path.join(destination, 'out.bib'),
+                            fix_bib=True, zotero=zotero)
+
+    def fix():
+        with open(workspace.bibliography, 'rb') as bibtex_file, \
+                open(os.path.join(destination, 'out.bib'), 'wb') as output:
+            fix_bibliography_file(bibtex_file, output)
+
+    function = dict(list_papers=list_papers, pdfs_to_update=to_update,
+                    copy_pdfs=copy, to_ebook=convert,
+                    export_bibliography=export,
+                    export_bibliography_clean=export_clean,
+                    fix_bibliography=fix)[name]
+
+    with warnings.catch_warnings():
+        # Some synthetic items deliberately lack a cite key or a PDF.
+        warnings.simplefilter('ignore')
+        return timeit.timeit(function, number=1)
+
+
+def compare(results, baseline):
+    """
+    Yields lines comparing results with a baseline run.
+    """
+    before = dict(((r['benchmark'], r['size']), r['seconds'])
+                  for r in baseline['results'])
+    for result in results:
+        key = (result['benchmark'], result['size'])
+        if key in before:
+            yield '{:>26} {:>8} {:>10.3f}s -> {:>8.3f}s {:>7.2f}x'.format(
+                result['benchmark'], result['size'], before[key],
+                result['seconds'], before[key] / result['seconds'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='keep the best of this many runs (default: 3)')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=BENCHMARKS, metavar='BENCHMARK',
+                        help='run only these benchmarks')
+    parser.add_argument('--output', metavar='FILE',
+                        help='save results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with results saved by an earlier run')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        workspace = Workspace(size)
+        try:
+            for name in args.only:
+                seconds = min(run_benchmark(name, workspace)
+                              for _ in range(args.repeat))
+                results.append(dict(benchmark=name, size=size,
+                                    seconds=seconds,
+                                    items_per_second=size / seconds))
+                print('{:>26} {:>8} items {:>10.3f}s {:>12.0f} items/s'.format(
+                    name, size, seconds, size / seconds))
+                sys.stdout.flush()
+        finally:
+            workspace.close()
+
+    report = dict(paperpal=__version__,
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  date=datetime.datetime.utcnow().isoformat() + 'Z',
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            for line in compare(results, json.load(baseline_file)):
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Times listing a collection straight from zotero.sqlite.
+
+With --repl, also lists the same collection through a running Zotero, and
+through a copy of that Zotero's database, for a side-by-side comparison:
+
+    python benchmarks/zotero_sqlite_benchmark.py --repl PartyCrasher \\
+        --zotero-database ~/Zotero/zotero.sqlite
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from paperpal.test.fixtures import make_zotero_database, synthetic_library
+from paperpal.zotero import Zotero
+from paperpal.zotero_sqlite import ZoteroDatabase
+
+
+def best_of(repeat, function):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def list_from_database(filename, collection):
+    with ZoteroDatabase(filename) as database:
+        return database.list_papers(collection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--repl', metavar='COLLECTION')
+    parser.add_argument('--zotero-database', metavar='FILE')
+    args = parser.parse_args()
+
+    if args.repl:
+        zotero = Zotero()
+        print('{:>10} {:>12.4f}s'.format(
+            'repl', best_of(args.repeat,
+                            lambda: zotero.list_papers(args.repl))))
+        if args.zotero_database:
+            print('{:>10} {:>12.4f}s'.format(
+                'sqlite', best_of(args.repeat, lambda: list_from_database(
+                    args.zotero_database, args.repl))))
+        return
+
+    directory = tempfile.mkdtemp(prefix='paperpal-benchmark-')
+    try:
+        for size in args.sizes:
+            filename = os.path.join(directory, 'zotero-{}.sqlite'.format(size))
+            make_zotero_database(filename, synthetic_library(size))
+            seconds = best_of(args.repeat, lambda: list_from_database(
+                filename, 'Synthetic'))
+            print('{:>10} items {:>12.4f}s {:>12.0f} items/s'.format(
+                size, seconds, size / seconds))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
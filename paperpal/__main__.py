@@ -16,17 +16,58 @@
 # limitations under the License.
 
 import argparse
+import atexit
+import io
 import os
-import shutil
 import sys
+import threading
+import time
 import warnings
-import codecs
 
 from paperpal import __version__ as version
-from paperpal.k2pdfopt_wrapper import k2pdfopt
-from paperpal.modification_time import modification_time
-from paperpal.zotero import Zotero
-from paperpal.fix_bibliography import fix_bibliography
+from paperpal.atomic_file import atomic_output
+from paperpal.copy_engine import MODES, Copy, CopyEngine, format_throughput
+from paperpal.directory_index import DirectoryIndex
+from paperpal.incremental_export import (DEFAULT_FULL_EVERY, checkpoint_for,
+                                         export_incrementally)
+from paperpal.journal import DEFAULT_RETRIES, Journal
+from paperpal.k2pdfopt_wrapper import k2pdfopt_args, k2pdfopt_version
+from paperpal.manifest import Manifest
+from paperpal.pipeline import DEFAULT_QUEUE_SIZE, background, parallel_map
+from paperpal import profiling
+from paperpal.profiling import count, span
+from paperpal.scheduler import Job, Scheduler, default_jobs, format_summary
+from paperpal.split_conversion import (DEFAULT_SPLIT_PAGES, SplitConversion,
+                                       find_qpdf, merge, page_count,
+                                       page_ranges)
+from paperpal.watch import (DEFAULT_DEBOUNCE, DEFAULT_INTERVAL,
+                            storage_watcher, watch)
+from paperpal.zotero import NAME_TO_TRANSLATOR_ID, ZoteroError, session
+
+# Subsystems only some subcommands need, such as fix_bibliography (and
+# bibtexparser), zotero_sqlite or the caches (and sqlite3), are imported
+# where they are used, as are slow standard modules like tempfile, so that
+# every start does not pay for them (see test/startup_test.py).
+
+
+def parse_export(spec):
+    """
+    Splits COLLECTION:TRANSLATOR:FILE at the name of the translator, so that
+    the collection or file may contain colons.
+
+    >>> parse_export('Thesis/Chapter 3:better-biblatex:chapter3.bib')
+    ('Thesis/Chapter 3', 'better-biblatex', 'chapter3.bib')
+    >>> parse_export('Thesis: Part 1:bibtex:part1.bib')
+    ('Thesis: Part 1', 'bibtex', 'part1.bib')
+    """
+    parts = spec.split(':')
+    for index in range(1, len(parts) - 1):
+        if parts[index] in NAME_TO_TRANSLATOR_ID:
+            return (':'.join(parts[:index]), parts[index],
+                    ':'.join(parts[index + 1:]))
+    raise argparse.ArgumentTypeError(
+        '{!r} is not COLLECTION:TRANSLATOR:FILE, with TRANSLATOR one of '
+        '{}'.format(spec, ', '.join(sorted(NAME_TO_TRANSLATOR_ID))))
 
 
 parser = argparse.ArgumentParser(description="utilities for a streamlined "
@@ -44,7 +85,8 @@ export_parser = subparsers.add_parser('export',
                                       help='exports a collection as a BibTeX '
                                            'bibliography')
 export_parser.add_argument('collection',
-                           help='name of the collection to export')
+                           help='name or path (e.g., "Thesis/Chapter 3") of '
+                                'the collection to export')
 export_parser.add_argument('destination',
                            nargs='?',
                            default='bibliography.bib',
@@ -56,6 +98,25 @@ export_parser.add_argument('-c', '--clean',
                            'each entry with a date also has a year field. '
                            'Same as running `paperpal fix-bibliography` on '
                            'the output')
+export_parser.add_argument('-j', '--jobs',
+                           type=int, default=1,
+                           help='with --clean, number of processes fixing '
+                                'entries (default: 1)')
+export_parser.add_argument('--no-cache',
+                           action='store_false', dest='cache',
+                           help='with --clean, fix every entry, even those '
+                                'fixed on a previous run')
+export_parser.add_argument('--incremental',
+                           action='store_true',
+                           help='have Zotero export only the items that '
+                                'changed since the last export, and splice '
+                                'them into the entries kept beside the '
+                                'destination')
+export_parser.add_argument('--full-every',
+                           type=int, default=DEFAULT_FULL_EVERY, metavar='N',
+                           help='with --incremental, export every item '
+                                'again after N exports (default: '
+                                '%(default)s)')
 export_parser.set_defaults(translator='bibtex')
 translator_group = export_parser.add_mutually_exclusive_group()
 translator_group.add_argument('--bibtex',
@@ -76,6 +137,32 @@ translator_group.add_argument('--better-biblatex',
                               dest='translator',
                               help='use Better BibLaTeX as the translator')
 
+# export-batch options.
+batch_parser = subparsers.add_parser('export-batch',
+                                     help='exports several collections, in '
+                                          'several formats, at once')
+batch_parser.add_argument('exports',
+                          nargs='*', type=parse_export,
+                          metavar='COLLECTION:TRANSLATOR:FILE',
+                          help='a collection to export with a translator '
+                               '(e.g., "Thesis:better-biblatex:thesis.bib")')
+batch_parser.add_argument('-f', '--from',
+                          metavar='FILE', dest='manifest',
+                          help='also export everything listed in FILE, one '
+                               'COLLECTION:TRANSLATOR:FILE per line; '
+                               'relative paths are relative to FILE')
+batch_parser.add_argument('-c', '--clean',
+                          action='store_true',
+                          help='fix every output, as export --clean does')
+batch_parser.add_argument('-j', '--jobs',
+                          type=int, default=1,
+                          help='with --clean, number of processes fixing '
+                               'entries (default: 1)')
+batch_parser.add_argument('--no-cache',
+                          action='store_false', dest='cache',
+                          help='with --clean, fix every entry, even those '
+                               'fixed on a previous run')
+
 # copy options.
 copy_parser = subparsers.add_parser('copy',
                                     help='copies PDFs from the collection '
@@ -84,6 +171,34 @@ copy_parser.add_argument('collection',
                          help='name of the collection')
 copy_parser.add_argument('directory',
                          help='destination of copied PDFs')
+copy_parser.add_argument('--no-cache',
+                         action='store_false', dest='cache',
+                         help='always ask Zotero for the entire collection, '
+                              'instead of reusing an unchanged listing')
+copy_parser.add_argument('--zotero-database',
+                         metavar='FILE', dest='database',
+                         help='read a copy of zotero.sqlite directly, instead '
+                              'of asking a running Zotero')
+copy_parser.add_argument('--prune',
+                         action='store_true',
+                         help='delete copies of items no longer in the '
+                              'collection')
+copy_parser.add_argument('--link',
+                         choices=MODES, default='auto',
+                         help='hard: hard link (edits to a copy change '
+                              "Zotero's PDF); reflink: copy-on-write clone; "
+                              'copy: an ordinary copy; auto: reflink where '
+                              'possible, otherwise copy (default: auto). '
+                              'With hard or reflink, a PDF that cannot be '
+                              'linked that way is not copied')
+copy_parser.add_argument('-j', '--jobs',
+                         type=int, default=4,
+                         help='number of files to copy at once (default: 4)')
+copy_parser.add_argument('--queue-size',
+                         type=int, default=DEFAULT_QUEUE_SIZE, metavar='N',
+                         help='how many items each stage of listing, '
+                              'checking and copying may run ahead of the '
+                              'next (default: %(default)s)')
 
 # to-ebook options.
 ebook_parser = subparsers.add_parser('to-ebook',
@@ -93,12 +208,73 @@ ebook_parser.add_argument('collection',
                           help='name of the collection')
 ebook_parser.add_argument('directory',
                           help='destination of translated PDFs')
+ebook_parser.add_argument('-j', '--jobs',
+                          type=int, default=default_jobs(),
+                          help='number of conversions to run at once '
+                               '(default: number of CPUs)')
+ebook_parser.add_argument('--timeout',
+                          type=float, default=None,
+                          help='give up on a conversion after this many '
+                               'seconds (default: no timeout)')
+ebook_parser.add_argument('--no-cache',
+                          action='store_false', dest='cache',
+                          help='always ask Zotero for the entire collection, '
+                               'instead of reusing an unchanged listing')
+ebook_parser.add_argument('--zotero-database',
+                          metavar='FILE', dest='database',
+                          help='read a copy of zotero.sqlite directly, instead '
+                               'of asking a running Zotero')
+ebook_parser.add_argument('--prune',
+                          action='store_true',
+                          help='delete conversions of items no longer in the '
+                               'collection')
+ebook_parser.add_argument('--no-store',
+                          action='store_false', dest='store',
+                          help='always run k2pdfopt, instead of reusing the '
+                               'same conversion made for another directory')
+ebook_parser.add_argument('--store-size',
+                          type=int, default=1024, metavar='MIB',
+                          help='keep up to this many MiB of conversions for '
+                               'reuse (default: 1024)')
+ebook_parser.add_argument('--store-links',
+                          action='store_true',
+                          help='hard link conversions out of the store, '
+                               'instead of copying them (an e-reader that '
+                               'edits its file then edits every copy)')
+ebook_parser.add_argument('--queue-size',
+                          type=int, default=DEFAULT_QUEUE_SIZE, metavar='N',
+                          help='how many items each stage of listing, '
+                               'checking and converting may run ahead of '
+                               'the next (default: %(default)s)')
+ebook_parser.add_argument('--split-pages',
+                          type=int, default=DEFAULT_SPLIT_PAGES, metavar='N',
+                          help='convert PDFs longer than N pages N pages at '
+                               'a time, in parallel, if qpdf is installed; '
+                               '0 never splits (default: %(default)s)')
+ebook_parser.add_argument('--resume',
+                          action='store_true',
+                          help='continue an interrupted run: skip the '
+                               'conversions it finished, and retry those '
+                               'that failed')
+ebook_parser.add_argument('--retries',
+                          type=int, default=DEFAULT_RETRIES, metavar='N',
+                          help='with --resume, retry a failed conversion up '
+                               'to this many times (default: %(default)s)')
 ebook_parser.add_argument('args',
                           metavar='...',
                           nargs=argparse.REMAINDER,
                           help='remaining arguments are passed to k2pdfopt '
                                'unchanged')
 
+# collections options.
+collections_parser = subparsers.add_parser('collections',
+                                           help='lists every collection, '
+                                                'with its number of items')
+collections_parser.add_argument('--zotero-database',
+                                metavar='FILE', dest='database',
+                                help='read a copy of zotero.sqlite directly, '
+                                     'instead of asking a running Zotero')
+
 # copy options.
 fix_parser = subparsers.add_parser('fix-bibliography',
                                    help='Fixes an existing .bib file for '
@@ -110,33 +286,578 @@ fix_parser.add_argument('destination',
                         default='bibliography.bib',
                         help='name of exported file '
                         '(default "bibliography.bib")')
+fix_parser.add_argument('-j', '--jobs',
+                        type=int, default=1,
+                        help='number of processes fixing entries '
+                             '(default: 1)')
+fix_parser.add_argument('--no-cache',
+                        action='store_false', dest='cache',
+                        help='fix every entry, even those fixed on a '
+                             'previous run')
+
+# watch options.
+watch_parser = subparsers.add_parser('watch',
+                                     help='keeps a bibliography, copies '
+                                          'and conversions up to date with '
+                                          'a collection as it changes')
+watch_parser.add_argument('collection',
+                          help='name of the collection')
+watch_parser.add_argument('--bibliography',
+                          metavar='FILE',
+                          help='export the collection to this file')
+watch_parser.add_argument('-c', '--clean',
+                          action='store_true',
+                          help='clean the exported bibliography, as `export '
+                               '--clean` does')
+watch_parser.add_argument('--translator',
+                          choices=sorted(NAME_TO_TRANSLATOR_ID),
+                          default='bibtex',
+                          help='translator of the exported bibliography '
+                               '(default: bibtex)')
+watch_parser.add_argument('--copy',
+                          metavar='DIRECTORY',
+                          help='copy PDFs to this directory')
+watch_parser.add_argument('--link',
+                          choices=MODES, default='auto',
+                          help='how to copy PDFs, as for `copy --link` '
+                               '(default: auto)')
+watch_parser.add_argument('--to-ebook',
+                          metavar='DIRECTORY', dest='ebook',
+                          help='convert PDFs with k2pdfopt to this directory')
+watch_parser.add_argument('-j', '--jobs',
+                          type=int, default=default_jobs(),
+                          help='number of conversions to run at once '
+                               '(default: number of CPUs)')
+watch_parser.add_argument('--prune',
+                          action='store_true',
+                          help='delete copies and conversions of items no '
+                               'longer in the collection')
+watch_parser.add_argument('--interval',
+                          type=float, default=DEFAULT_INTERVAL,
+                          metavar='SECONDS',
+                          help='how often to ask Zotero whether the '
+                               'collection changed (default: %(default)s)')
+watch_parser.add_argument('--debounce',
+                          type=float, default=DEFAULT_DEBOUNCE,
+                          metavar='SECONDS',
+                          help='wait until nothing changed for this long '
+                               'before updating (default: %(default)s)')
+watch_parser.add_argument('--no-cache',
+                          action='store_false', dest='cache',
+                          help='always ask Zotero for the entire collection, '
+                               'instead of reusing an unchanged listing')
+watch_parser.add_argument('--no-store',
+                          action='store_false', dest='store',
+                          help='with --to-ebook, always run k2pdfopt, as '
+                               '`to-ebook --no-store` does')
+watch_parser.add_argument('--store-size',
+                          type=int, default=1024, metavar='MIB',
+                          help='with --to-ebook, keep up to this many MiB '
+                               'of conversions for reuse (default: 1024)')
+watch_parser.add_argument('--store-links',
+                          action='store_true',
+                          help='with --to-ebook, hard link conversions out '
+                               'of the store, as `to-ebook --store-links` '
+                               'does')
+watch_parser.add_argument('--queue-size',
+                          type=int, default=DEFAULT_QUEUE_SIZE, metavar='N',
+                          help='how many items each stage of listing, '
+                               'checking and copying may run ahead of the '
+                               'next (default: %(default)s)')
+watch_parser.add_argument('args',
+                          metavar='...',
+                          nargs=argparse.REMAINDER,
+                          help='remaining arguments are passed to k2pdfopt '
+                               'unchanged')
+
+# Options of every subcommand.
+for subparser in subparsers.choices.values():
+    subparser.add_argument('--profile',
+                           action='store_true',
+                           help='when done, print how long each phase took, '
+                                'and counts of items, bytes and cache hits')
+    subparser.add_argument('--trace',
+                           metavar='FILE',
+                           help='write every timing and count to FILE as '
+                                'JSON lines, in the Trace Event Format')
+
+
+def export_bibliography(collection, destination, fix_bib=False, jobs=1,
+                        cache=None, zotero=None, incremental=False,
+                        full_every=DEFAULT_FULL_EVERY, translator=None):
+    """
+    Exports the collection to destination, replacing it all at once, and
+    only if its contents would change. With incremental, Zotero exports
+    only the items that changed since the last export.
+    """
+    zotero = zotero if zotero is not None else session()
+
+    def export_to(filename):
+        if not incremental:
+            zotero.export_bibliography_to(collection, filename,
+                                          translator=translator)
+            return
+        exported, total = export_incrementally(
+            zotero, collection, filename, checkpoint_for(destination),
+            translator=translator, full_every=full_every)
+        if total is not None:
+            sys.stderr.write('{} of {} items exported\n'.format(exported,
+                                                               total))
+
+    with atomic_output(destination, skip_identical=True) as temporary:
+        if not fix_bib:
+            # Zotero writes the file itself; Python never sees the contents.
+            export_to(temporary)
+            return
+
+        import tempfile
+        from paperpal.fix_bibliography import fix_bibliography_file
+        with tempfile.NamedTemporaryFile() as exported:
+            export_to(exported.name)
+            with open(temporary, 'wb') as output_file:
+                fix_bibliography_file(exported, output_file, processes=jobs,
+                                      cache=cache)
+    report_entry_cache(cache)
+
+
+def export_bibliographies(exports, fix_bib=False, jobs=1, cache=None,
+                          zotero=None):
+    """
+    Exports every (collection, translator, destination) in one call to
+    Zotero, replacing each destination as export_bibliography() does.
+    Reports how long each export took; returns a non-zero exit status if any
+    did not succeed.
+    """
+    zotero = zotero if zotero is not None else session()
+    errors = [None] * len(exports)
+    staged = []
+    failures = 0
+    try:
+        # Zotero writes each export beside its destination, so that a
+        # destination that cannot be written fails before anything else.
+        for index, (_, _, destination) in enumerate(exports):
+            try:
+                staged.append(stage_export(destination))
+            except EnvironmentError as error:
+                staged.append(None)
+                errors[index] = error
+
+        pending = [index for index, filename in enumerate(staged)
+                   if filename is not None]
+        results = dict(zip(pending, zotero.export_bibliographies_to([
+            (exports[index][0], staged[index], exports[index][1])
+            for index in pending
+        ])))
+
+        for index, (collection, translator, destination) in \
+                enumerate(exports):
+            error, seconds = results.get(index, (errors[index], 0))
+            if error is None:
+                try:
+                    replace_with_export(staged[index], destination,
+                                        fix_bib=fix_bib, jobs=jobs,
+                                        cache=cache)
+                except Exception as failure:
+                    # Reported like any other failure; the rest go on.
+                    error = failure
+            if error is None:
+                status = '{:.2f}s'.format(seconds)
+            else:
+                status = 'failed: {}'.format(error)
+                failures += 1
+            sys.stderr.write(u'{} ({}) -> {}: {}\n'.format(
+                collection, translator, destination, status))
+    finally:
+        # Whatever was not exported is removed.
+        for filename in staged:
+            if filename is not None and os.path.exists(filename):
+                os.remove(filename)
+    report_entry_cache(cache)
+    return 1 if failures else 0
+
+
+def stage_export(destination):
+    """
+    Returns the name of a new, empty file in destination's directory for
+    Zotero to export to.
+    """
+    import tempfile
+    directory, basename = os.path.split(os.path.abspath(destination))
+    descriptor, filename = tempfile.mkstemp(dir=directory,
+                                            prefix='.' + basename + '.',
+                                            suffix='.export')
+    os.close(descriptor)
+    return filename
+
+
+def replace_with_export(exported, destination, fix_bib=False, jobs=1,
+                        cache=None):
+    """
+    Replaces destination with what Zotero exported (fixed with fix_bib), as
+    export_bibliography() does.
+    """
+    with atomic_output(destination, skip_identical=True) as temporary:
+        if not fix_bib:
+            os.rename(exported, temporary)
+            return
+
+        from paperpal.fix_bibliography import fix_bibliography_file
+        with open(exported, 'rb') as exported_file, \
+                open(temporary, 'wb') as output_file:
+            fix_bibliography_file(exported_file, output_file,
+                                  processes=jobs, cache=cache)
 
 
-def export_bibliography(collection, destination, fix_bib=False,
-                        *args, **kwargs):
-    bib_string = Zotero().export_bibliography(collection, *args, **kwargs)
-                  
-    if fix_bib:
-        bib_string = fix_bibliography(bib_string)
+def read_exports(filename):
+    """
+    Returns the exports listed in a file, one COLLECTION:TRANSLATOR:FILE per
+    line, skipping blank lines and comments (#).
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    exports = []
+    with io.open(filename, encoding='UTF-8') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            collection, translator, destination = parse_export(line)
+            exports.append((collection, translator,
+                            os.path.join(directory, destination)))
+    return exports
+
+
+def copy_pdfs(collection, directory, cache=None, zotero=None, prune=False,
+              link='auto', jobs=4, only_in=None,
+              queue_size=DEFAULT_QUEUE_SIZE, pdf_directories=None):
+    """
+    Copies every new or changed PDF to directory, as seen by the manifest in
+    directory, up to `jobs` files at once, linking them as `link` says. With
+    prune, deletes copies of items no longer in the collection. Returns a
+    non-zero exit status if any copy did not succeed.
+    """
+    manifest = Manifest(directory, copies=True)
+    engine = CopyEngine(link, threads=jobs)
+    listed = []
+
+    def copies():
+        pdfs = pdfs_to_update(collection, directory, cache=cache,
+                              zotero=zotero, manifest=manifest,
+                              args_for=lambda *_: COPY_ARGS,
+                              only_in=only_in, queue_size=queue_size,
+                              pdf_directories=pdf_directories)
+        for source, destination, info in pdfs:
+            yield Copy(source, destination, info['cite_key'])
+        listed.append(True)
 
-    bib_unicode = bib_string.decode('UTF-8')
-    with codecs.open(destination, encoding='UTF-8', mode='w') as output_file:
-        output_file.write(bib_unicode)
+    start = time.time()
+    try:
+        copied = engine.run(copies())
+        for copy in copied:
+            if copy.error is not None:
+                warnings.warn(u'Could not copy {}: {}'.format(copy.name,
+                                                              copy.error))
+            elif copy.method is not None:
+                manifest.commit(copy.name)
 
+        # Only a complete listing tells which items left the collection.
+        if prune and listed:
+            report_pruned(manifest.prune())
+    finally:
+        manifest.save()
 
-def copy_pdfs(collection, directory):
-    for source, destination, _ in pdfs_to_update(collection, directory):
-        shutil.copy(source, destination)
+    sys.stderr.write(format_throughput(copied, time.time() - start) + '\n')
+    return 0 if all(copy.method for copy in copied) else 1
+
+
+def to_ebook(collection, directory, *extra_args, **kwargs):
+    """
+    Converts every out-of-date PDF with k2pdfopt, running up to `jobs`
+    conversions at once. Returns a non-zero exit status if any conversion did
+    not succeed.
+
+    Each conversion is written to a temporary file, renamed over its output
+    only once k2pdfopt succeeds, and recorded in a Journal. With resume=True,
+    the conversions an interrupted run finished are skipped without looking
+    at them again, and those that failed are retried, up to `retries` times.
+
+    PDFs longer than `split_pages` pages are converted that many pages at a
+    time, in separate jobs, and merged once all have finished.
+    """
+    scheduler = Scheduler(jobs=kwargs.get('jobs'),
+                          timeout=kwargs.get('timeout'))
+    manifest = Manifest(directory)
+    store = kwargs.get('store')
+    retries = kwargs.get('retries', DEFAULT_RETRIES)
+    split_pages = kwargs.get('split_pages', DEFAULT_SPLIT_PAGES)
+    journal = Journal(directory, resume=kwargs.get('resume', False))
+    # Only conversions kept for reuse are told apart by k2pdfopt's version.
+    engine = k2pdfopt_version() if store is not None else None
+    if store is not None:
+        from paperpal.conversion_store import conversion_key
+    lock = threading.Lock()
+    keys = {}
+    destinations = {}
+    splits = {}
+    converted = set()
+    reused = []
+    listed = []
 
+    done = set(journal.completed)
+    for cite_key, entry in journal.completed.items():
+        manifest.restore(cite_key, entry)
+    for cite_key, failures in sorted(journal.failures.items()):
+        if failures > retries:
+            warnings.warn('Gave up on {} after {} failed conversions'.format(
+                cite_key, failures))
+            done.add(cite_key)
 
-def to_ebook(collection, directory, *k2pdfopt_args):
-    pdfs = pdfs_to_update(collection, directory)
-    for source, destination, info in pdfs:
-        k2pdfopt(source,
-                 destination,
-                 author=authors_to_string(*info['authors']),
-                 title=info['title'],
-                 *k2pdfopt_args)
+    def conversion(source, destination, info, **kwargs):
+        return k2pdfopt_args(source,
+                             destination,
+                             author=authors_to_string(*info['authors']),
+                             title=info['title'],
+                             *extra_args, **kwargs)
+
+    # Splitting only helps if the ranges can run at once.
+    qpdf = find_qpdf() if split_pages and scheduler.jobs > 1 else None
+
+    def ranges(source):
+        pages = page_count(source, executable=qpdf)
+        if pages is None or pages <= split_pages:
+            return None
+        count('conversions.split')
+        return page_ranges(pages, split_pages)
+
+    def to_convert():
+        pdfs = pdfs_to_update(collection, directory,
+                              cache=kwargs.get('cache'),
+                              zotero=kwargs.get('zotero'),
+                              manifest=manifest,
+                              # Everything but '-o destination source'.
+                              args_for=lambda *pdf: conversion(*pdf)[:-3],
+                              only_in=kwargs.get('only_in'),
+                              done=done,
+                              queue_size=kwargs.get('queue_size',
+                                                    DEFAULT_QUEUE_SIZE),
+                              pdf_directories=kwargs.get('pdf_directories'))
+        for source, destination, info in pdfs:
+            cite_key = info['cite_key']
+            if store is not None and engine is not None:
+                keys[cite_key] = conversion_key(
+                    manifest.staged_digest(cite_key),
+                    conversion(source, destination, info)[:-3], engine)
+                if store.fetch(keys[cite_key], destination):
+                    with lock:
+                        entry = manifest.commit(cite_key)
+                    journal.record(cite_key, 'ok', entry)
+                    reused.append(cite_key)
+                    count('conversions.reused')
+                    continue
+            yield source, destination, info
+        listed.append(True)
+
+    def conversions():
+        pdfs = to_convert()
+        if qpdf is None:
+            counted = ((pdf, None) for pdf in pdfs)
+        else:
+            # Pages are counted in several threads, not one PDF at a time
+            # as jobs are queued.
+            counted = parallel_map(lambda pdf: (pdf, ranges(pdf[0])), pdfs,
+                                   chunk_size=1,
+                                   queue_size=kwargs.get('queue_size',
+                                                         DEFAULT_QUEUE_SIZE))
+        for (source, destination, info), pages in counted:
+            cite_key = info['cite_key']
+            destinations[cite_key] = destination
+            temporary = partial_output(destination)
+            remove_quietly(temporary)
+            if pages is None:
+                yield Job(cite_key, conversion(source, temporary, info))
+                continue
+
+            parts = [partial_output(destination, part=index + 1)
+                     for index in range(len(pages))]
+            splits[cite_key] = SplitConversion(parts)
+            for part, page_range in zip(parts, pages):
+                yield Job(cite_key, conversion(source, part, info,
+                                               pages=page_range))
+
+    def finish(job):
+        # Called in the worker thread, so a crash later in the batch does
+        # not lose this conversion.
+        destination = destinations[job.name]
+        temporary = partial_output(destination)
+        split = splits.get(job.name)
+        try:
+            if split is not None:
+                status = split.finish(job)
+                if status is None:
+                    # Other parts are still being converted.
+                    return
+                try:
+                    if status == 'ok':
+                        merge(split.parts, temporary, executable=qpdf)
+                finally:
+                    for part in split.parts:
+                        remove_quietly(part)
+                job.status = status
+            if job.status != 'ok':
+                remove_quietly(temporary)
+                journal.record(job.name, job.status)
+                return
+            os.rename(temporary, destination)
+        except OSError:
+            remove_quietly(temporary)
+            journal.record(job.name, 'failed')
+            raise
+        with lock:
+            entry = manifest.commit(job.name)
+            converted.add(job.name)
+        journal.record(job.name, 'ok', entry)
+
+    try:
+        try:
+            jobs = scheduler.run(conversions(), on_finish=finish)
+        finally:
+            # Parts of conversions cut short never get merged.
+            for split in splits.values():
+                for part in split.parts:
+                    remove_quietly(part)
+        for cite_key in converted:
+            if cite_key in keys:
+                store.add(keys[cite_key], destinations[cite_key])
+
+        # Only a complete listing tells which items left the collection.
+        if kwargs.get('prune') and listed:
+            report_pruned(manifest.prune())
+    finally:
+        manifest.save()
+
+    sys.stderr.write(format_summary(jobs) + '\n')
+    if reused:
+        sys.stderr.write('{} reused from the conversion store\n'.format(
+            len(reused)))
+    if listed and all(job.status == 'ok' for job in jobs):
+        journal.remove()
+    else:
+        journal.close()
+        sys.stderr.write('run again with --resume to retry the rest\n')
+    return 0 if all(job.status == 'ok' for job in jobs) else 1
+
+
+def partial_output(destination, part=None):
+    """
+    Where k2pdfopt writes destination (or one part of it) until it
+    succeeds, hidden so that nothing mistakes it for a finished conversion.
+
+    >>> partial_output('/tmp/ebook/lerch2013.pdf')
+    '/tmp/ebook/.lerch2013.paperpal-partial.pdf'
+    >>> partial_output('/tmp/ebook/lerch2013.pdf', part=2)
+    '/tmp/ebook/.lerch2013.paperpal-partial-2.pdf'
+    """
+    directory, name = os.path.split(destination)
+    stem, extension = os.path.splitext(name)
+    suffix = '' if part is None else '-{}'.format(part)
+    return os.path.join(directory, '.' + stem + '.paperpal-partial' +
+                        suffix + extension)
+
+
+def remove_quietly(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def conversion_store(options):
+    if not options.store:
+        return None
+    from paperpal.conversion_store import ConversionStore
+    return ConversionStore(max_bytes=options.store_size * 1024 * 1024,
+                           link=options.store_links)
+
+
+def report_pruned(filenames):
+    for filename in filenames:
+        sys.stderr.write('removed {}\n'.format(filename))
+
+
+def watch_collection(options, zotero=None):
+    """
+    Keeps the outputs asked for in options up to date until interrupted.
+    Changes to PDFs alone are only copied or converted, and only for the
+    PDFs that changed.
+    """
+    zotero = zotero if zotero is not None else session()
+    cache = listing_cache(options)
+    entries = entry_cache(options) if options.clean else None
+    store = conversion_store(options) if options.ebook is not None else None
+    tasks = []
+
+    def export(directories):
+        if directories is None:
+            export_bibliography(options.collection, options.bibliography,
+                                fix_bib=options.clean, cache=entries,
+                                zotero=zotero, translator=options.translator)
+
+    # Copies and conversions return the PDF directories they listed, for
+    # the watcher to watch.
+    def copy(directories):
+        listed = set()
+        copy_pdfs(options.collection, options.copy, cache=cache,
+                  zotero=zotero, prune=options.prune, link=options.link,
+                  only_in=directories, queue_size=options.queue_size,
+                  pdf_directories=listed)
+        return listed
+
+    def convert(directories):
+        listed = set()
+        to_ebook(options.collection, options.ebook, jobs=options.jobs,
+                 cache=cache, zotero=zotero, prune=options.prune,
+                 store=store, only_in=directories,
+                 queue_size=options.queue_size, pdf_directories=listed,
+                 *options.args)
+        return listed
+
+    for output, task in ((options.bibliography, export),
+                         (options.copy, copy), (options.ebook, convert)):
+        if output is not None:
+            tasks.append(task)
+    if not tasks:
+        watch_parser.error('nothing to do: give at least one of '
+                           '--bibliography, --copy and --to-ebook')
+
+    # Only copies and conversions depend on the PDFs themselves.
+    watcher = storage_watcher() if tasks != [export] else None
+    try:
+        watch(options.collection, tasks, zotero, watcher,
+              interval=options.interval, debounce=options.debounce)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+def list_collections(zotero=None):
+    zotero = zotero if zotero is not None else session()
+    for collection in zotero.list_collections():
+        sys.stdout.write(format_collection(collection).encode('UTF-8') + '\n')
+
+
+def format_collection(collection):
+    """
+    >>> format_collection({'path': ('Thesis', 'Chapter 3'), 'items': 12})
+    u'  Chapter 3 (12)'
+    """
+    depth = len(collection['path']) - 1
+    return u'{}{} ({})'.format(u'  ' * depth, collection['path'][-1],
+                               collection['items'])
+
+
+# What the manifest records as the "conversion" of a copied PDF.
+COPY_ARGS = ['copy']
 
 
 def author_to_string(author):
@@ -176,62 +897,189 @@ def authors_to_string(*authors):
     return ', '.join(author_to_string(auth) for auth in authors)
 
 
-def pdfs_to_update(collection, destination_directory, with_info=False):
+def pdfs_to_update(collection, destination_directory, with_info=False,
+                   cache=None, zotero=None, manifest=None, args_for=None,
+                   only_in=None, done=None, queue_size=DEFAULT_QUEUE_SIZE,
+                   pdf_directories=None):
     """
     Yields a tuple of PDFs that should be updated. The tuple is the original
-    pdf, and the new PDF path. If with_info is requested,
+    pdf, the new PDF path, and the item's info.
+
+    With a Manifest, a PDF is updated when its contents or the arguments
+    returned by args_for(pdf, new_pdf, info) changed; otherwise, when the
+    original is newer than the copy.
+
+    Given a set of directories as only_in, PDFs elsewhere are assumed to be
+    unchanged, and are not even looked at. Neither are the PDFs of the cite
+    keys in done (e.g., finished by an earlier, interrupted run). The
+    directory of every PDF in the collection is added to the set given as
+    pdf_directories, if any (e.g., for watch to watch).
+
+    The collection is listed in the background, and PDFs are looked at in
+    several threads, each stage staying up to queue_size items ahead of the
+    next; PDFs are still yielded in the order of the collection. The
+    destination directory is listed once, instead of looking for each copy.
     """
-    pdfs = Zotero().list_papers(collection)
+    zotero = zotero if zotero is not None else session()
+    index = DirectoryIndex(destination_directory)
+    pdfs = background(zotero.iter_papers(collection, cache=cache),
+                      queue_size=queue_size)
 
     def destination(*paths):
         return os.path.join(destination_directory, *paths)
 
-    for item in pdfs:
+    def check(item):
+        with span('check', cite_key=item['cite_key']):
+            return check_item(item)
+
+    def check_item(item):
         cite_key = item['cite_key']
         pdf_path = item['pdf_filename']
+        if pdf_directories is not None and pdf_path is not None:
+            pdf_directories.add(os.path.dirname(pdf_path))
 
         if cite_key is None:
-            warnings.warn('Please generate a cite key for '
-                          '{author} "{title}" {year}'.format(**item))
-            continue
+            warnings.warn(u'Please generate a cite key for '
+                          u'{} "{}"'.format(authors_to_string(*item['authors']),
+                                            item['title']))
+            count('items.skipped.no_cite_key')
+            return None
+        if manifest is not None:
+            # Still in the collection, even if its PDF is missing.
+            manifest.seen.add(cite_key)
+        if done is not None and cite_key in done:
+            count('items.skipped.done')
+            return None
         if pdf_path is None:
             warnings.warn('No PDF found for {cite_key}'.format(**item))
-            continue
+            count('items.skipped.no_pdf')
+            return None
+        if only_in is not None and os.path.dirname(pdf_path) not in only_in:
+            return None
 
         new_pdf = destination(cite_key + '.pdf')
-        if not os.path.exists(pdf_path):
+        try:
+            with span('stat.source'):
+                source_stat = os.stat(pdf_path)
+        except OSError:
             warnings.warn("I can't make sense of this path: "
                           '{!r}. Skipping...'.format(pdf_path))
-            continue
+            count('items.skipped.missing_pdf')
+            return None
+
+        if manifest is not None:
+            stale = manifest.is_stale(cite_key, pdf_path, new_pdf,
+                                      args_for(pdf_path, new_pdf, item),
+                                      source_stat=source_stat, index=index)
+        else:
+            stale = source_stat.st_mtime > index.modification_time(new_pdf)
+        count('items.stale' if stale else 'items.up_to_date')
+        return (pdf_path, new_pdf, item) if stale else None
+
+    for update in parallel_map(check, pdfs, queue_size=queue_size):
+        if update is not None:
+            yield update
+
+
+def fix_bibliography_wrapper(source, destination, jobs=1, cache=None):
+    from paperpal.fix_bibliography import fix_bibliography_file
+    with open(source, 'rb') as bibtex_file, \
+            atomic_output(destination, skip_identical=True) as temporary, \
+            open(temporary, 'wb') as output_file:
+        fix_bibliography_file(bibtex_file, output_file, processes=jobs,
+                              cache=cache)
+    report_entry_cache(cache)
 
-        if modification_time(pdf_path) > modification_time(new_pdf):
-            yield pdf_path, new_pdf, item
 
+def report_entry_cache(cache):
+    if cache is not None:
+        sys.stderr.write('{misses} entries fixed, '
+                         '{hits} reused from cache\n'.format(**cache.stats()))
 
-def fix_bibliography_wrapper(source, destination):
-    with codecs.open(source, encoding="UTF-8") as bibtex_file:
-        result = fix_bibliography(bibtex_file.read())
 
-    with codecs.open(destination, encoding='UTF-8', mode='w') as output_file:
-        output_file.write(result)
+def listing_cache(options):
+    from paperpal.cache import ListingCache
+    return ListingCache() if options.cache else None
+
+
+def entry_cache(options):
+    from paperpal.cache import EntryCache
+    return EntryCache() if options.cache else None
+
+
+def zotero_backend(options):
+    if options.database:
+        from paperpal.zotero_sqlite import ZoteroDatabase
+        database = ZoteroDatabase(options.database)
+        atexit.register(database.close)
+        return database
+    return session()
 
 
 def main():
     options = parser.parse_args()
+    if not (options.profile or options.trace):
+        return run_command(options)
+
+    profiling.enable(trace=options.trace)
+    try:
+        with span('command', name=options.command):
+            return run_command(options)
+    finally:
+        if options.profile:
+            sys.stderr.write(profiling.summary() + '\n')
+        profiling.disable()
+
 
+def run_command(options):
     if options.command == 'export':
         return export_bibliography(options.collection,
                                    options.destination,
                                    fix_bib=options.clean,
+                                   jobs=options.jobs,
+                                   cache=(entry_cache(options)
+                                          if options.clean else None),
+                                   incremental=options.incremental,
+                                   full_every=options.full_every,
                                    translator=options.translator)
+    elif options.command == 'export-batch':
+        exports = list(options.exports)
+        if options.manifest:
+            exports.extend(read_exports(options.manifest))
+        if not exports:
+            parser.error('export-batch needs COLLECTION:TRANSLATOR:FILE '
+                         'arguments or --from FILE')
+        return export_bibliographies(exports, fix_bib=options.clean,
+                                     jobs=options.jobs,
+                                     cache=(entry_cache(options)
+                                            if options.clean else None))
     elif options.command == 'copy':
-        return copy_pdfs(options.collection, options.directory)
+        return copy_pdfs(options.collection, options.directory,
+                         cache=listing_cache(options),
+                         zotero=zotero_backend(options),
+                         prune=options.prune,
+                         link=options.link, jobs=options.jobs,
+                         queue_size=options.queue_size)
     elif options.command == 'to-ebook':
         return to_ebook(options.collection, options.directory,
+                        jobs=options.jobs, timeout=options.timeout,
+                        cache=listing_cache(options),
+                        zotero=zotero_backend(options),
+                        prune=options.prune,
+                        store=conversion_store(options),
+                        queue_size=options.queue_size,
+                        resume=options.resume, retries=options.retries,
+                        split_pages=options.split_pages,
                         *options.args)
+    elif options.command == 'collections':
+        return list_collections(zotero=zotero_backend(options))
+    elif options.command == 'watch':
+        return watch_collection(options)
     elif options.command == 'fix-bibliography':
         return fix_bibliography_wrapper(options.bibliography,
-                                        options.destination)
+                                        options.destination,
+                                        jobs=options.jobs,
+                                        cache=entry_cache(options))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replaces files all at once, so that nobody ever sees a half-written file.
+"""
+
+import os
+
+from contextlib import contextmanager
+
+__all__ = ['atomic_output']
+
+
+def _current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Reading the umask means setting it, for a moment, to 0; a file another
+# thread made in that moment would be world-writable. So it is read once,
+# on import, before paperpal starts any threads.
+_UMASK = _current_umask()
+
+
+@contextmanager
+def atomic_output(destination, skip_identical=False):
+    """
+    Yields the name of an empty temporary file in the same directory as
+    destination. Once the block finishes, the temporary file is renamed to
+    destination; if the block raises, it is deleted instead.
+
+    With skip_identical, a destination whose contents are byte-for-byte the
+    same is left untouched (keeping its modification time).
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> destination = os.path.join(directory, 'bibliography.bib')
+    >>> with atomic_output(destination) as temporary:
+    ...     with open(temporary, 'w') as output_file:
+    ...         output_file.write('@book{}')
+    >>> open(destination).read()
+    '@book{}'
+    >>> os.listdir(directory)
+    ['bibliography.bib']
+    """
+    import tempfile
+    directory, basename = os.path.split(os.path.abspath(destination))
+    descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                             prefix='.' + basename + '.',
+                                             suffix='.tmp')
+    os.close(descriptor)
+    # mkstemp() makes files only the owner may read.
+    os.chmod(temporary, _mode_for(destination))
+
+    try:
+        yield temporary
+        if skip_identical and _same_contents(temporary, destination):
+            os.remove(temporary)
+        else:
+            os.rename(temporary, destination)
+    except BaseException:
+        _remove(temporary)
+        raise
+
+
+def _mode_for(destination):
+    try:
+        return os.stat(destination).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+def _same_contents(first, second):
+    import filecmp
+    try:
+        return filecmp.cmp(first, second, shallow=False)
+    except OSError:
+        return False
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local caches: collection listings, so that unchanged collections need not
+be listed by Zotero again, and fixed bibliography entries, so that unchanged
+entries need not be fixed again.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+from .paper import Paper
+from .profiling import count
+
+__all__ = ['EntryCache', 'ListingCache', 'cache_directory']
+
+# Roughly how many bytes of listings to keep before evicting the least
+# recently used collections.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Likewise, for fixed bibliography entries.
+DEFAULT_MAX_ENTRY_BYTES = 32 * 1024 * 1024
+
+# Seconds to wait for another process to unlock a cache.
+LOCK_TIMEOUT = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    name        TEXT PRIMARY KEY,
+    version     TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    last_used   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS papers (
+    collection      TEXT NOT NULL,
+    position        INTEGER NOT NULL,
+    authors         TEXT NOT NULL,
+    title           TEXT,
+    cite_key        TEXT,
+    pdf_filename    TEXT,
+    PRIMARY KEY (collection, position)
+);
+"""
+
+ENTRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key         TEXT PRIMARY KEY,
+    value       TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    last_used   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_by_last_used ON entries (last_used);
+"""
+
+
+def cache_directory(*paths):
+    """
+    Returns a path within paperpal's cache directory, creating the directory
+    if necessary. Honours $XDG_CACHE_HOME.
+    """
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    directory = os.path.join(base, 'paperpal')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, *paths)
+
+
+class ListingCache(object):
+    """
+    Collection listings (as returned by Zotero.list_papers), keyed by the
+    backend that listed them (whose versions and titles may differ from
+    another's) and collection name, and valid only for the version they
+    were stored with.
+
+    >>> cache = ListingCache(':memory:')
+    >>> paper = {'authors': [{'first': 'J.', 'last': 'Lerch'}],
+    ...          'title': 'Finding Duplicates', 'cite_key': 'lerch2013',
+    ...          'pdf_filename': None}
+    >>> cache.put('PartyCrasher', '1:2:3', [paper])
+    >>> cache.get('PartyCrasher', '1:2:3') == [paper]
+    True
+    >>> cache.get('PartyCrasher', '2:4:5') is None
+    True
+    >>> cache.get('PartyCrasher', '1:2:3', backend='sqlite') is None
+    True
+    """
+
+    def __init__(self, filename=None, max_bytes=DEFAULT_MAX_BYTES,
+                 timeout=LOCK_TIMEOUT):
+        if filename is None:
+            filename = cache_directory('listings.sqlite3')
+        self.max_bytes = max_bytes
+        # Listings are read and stored by whichever thread lists the
+        # collection (see pipeline.background), one thread at a time.
+        self.connection = sqlite3.connect(filename, timeout=timeout,
+                                          check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def get(self, collection, version, backend=None):
+        """
+        Returns the cached listing, or None if it is missing or stale.
+        """
+        papers = self._iter_cached(_listing_key(backend, collection),
+                                   version)
+        return None if papers is None else list(papers)
+
+    def iter_fetch(self, collection, version, iter_papers, backend=None):
+        """
+        Returns an iterator over the cached listing or, if it is missing or
+        stale, over iter_papers(), caching each item as it passes through.
+        """
+        key = _listing_key(backend, collection)
+        papers = self._iter_cached(key, version)
+        if papers is None:
+            count('listing_cache.misses')
+            papers = self._iter_and_store(key, version, iter_papers())
+        else:
+            count('listing_cache.hits')
+        return papers
+
+    def put(self, collection, version, papers, backend=None):
+        """
+        Replaces the listing of the collection, and evicts old listings if
+        the cache has grown too large.
+        """
+        for _ in self._iter_and_store(_listing_key(backend, collection),
+                                      version, papers):
+            pass
+
+    def _iter_cached(self, collection, version):
+        try:
+            return self._read_cached(collection, version)
+        except sqlite3.OperationalError:
+            # Another process kept the cache locked; treat it as a miss.
+            count('listing_cache.locked')
+            return None
+
+    def _read_cached(self, collection, version):
+        with self.connection:
+            row = self.connection.execute(
+                'SELECT version FROM collections WHERE name = ?',
+                (collection,)
+            ).fetchone()
+            if row is None or row[0] != version:
+                return None
+
+            self.connection.execute(
+                'UPDATE collections SET last_used = ? WHERE name = ?',
+                (time.time(), collection)
+            )
+
+        rows = self.connection.execute(
+            'SELECT authors, title, cite_key, pdf_filename FROM papers '
+            'WHERE collection = ? ORDER BY position',
+            (collection,)
+        ).fetchall()
+        return (Paper(json.loads(authors), title, cite_key, pdf_filename)
+                for authors, title, cite_key, pdf_filename in rows)
+
+    def _iter_and_store(self, collection, version, papers):
+        # Rows are gathered while the listing streams in, and written in one
+        # short transaction once it is complete: a listing interrupted
+        # halfway is never cached, and other processes are not locked out
+        # of the cache while Zotero lists the collection.
+        rows = []
+        size = 0
+        for position, paper in enumerate(papers):
+            row = (collection, position, json.dumps(paper['authors']),
+                   paper['title'], paper['cite_key'], paper['pdf_filename'])
+            size += sum(len(value) for value in row[2:] if value)
+            rows.append(row)
+            yield paper
+
+        try:
+            with self.connection:
+                self._delete(collection)
+                self.connection.executemany(
+                    'INSERT INTO papers VALUES (?, ?, ?, ?, ?, ?)', rows
+                )
+                self.connection.execute(
+                    'INSERT INTO collections (name, version, size, '
+                    'last_used) VALUES (?, ?, ?, ?)',
+                    (collection, version, size, time.time())
+                )
+                self._evict()
+        except sqlite3.OperationalError:
+            # Another process kept the cache locked; list again next time.
+            count('listing_cache.locked')
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM papers')
+            self.connection.execute('DELETE FROM collections')
+
+    def _delete(self, collection):
+        self.connection.execute('DELETE FROM papers WHERE collection = ?',
+                                (collection,))
+        self.connection.execute('DELETE FROM collections WHERE name = ?',
+                                (collection,))
+
+    def _evict(self):
+        # Walk from most to least recently used, keeping listings until the
+        # budget runs out. The newest listing is always kept.
+        rows = self.connection.execute(
+            'SELECT name, size FROM collections ORDER BY last_used DESC'
+        ).fetchall()
+        total = 0
+        for index, (name, size) in enumerate(rows):
+            total += size
+            if index > 0 and total > self.max_bytes:
+                self._delete(name)
+
+
+def _listing_key(backend, collection):
+    """
+    >>> _listing_key('sqlite', u'Thesis')
+    '["sqlite", "Thesis"]'
+    """
+    return json.dumps([backend, collection])
+
+
+class EntryCache(object):
+    """
+    Arbitrary JSON values keyed by opaque strings (such as hashes of
+    bibliography records), evicting the least recently used values once the
+    cache grows too large. Counts hits and misses.
+
+    >>> cache = EntryCache(':memory:')
+    >>> cache.put_many([('0beec7b5', [['lerch2013'], '@inproceedings{...}'])])
+    >>> cache.get_many(['0beec7b5', '62cdb702'])
+    {u'0beec7b5': [[u'lerch2013'], u'@inproceedings{...}']}
+    >>> cache.stats()
+    {'hits': 1, 'misses': 1}
+    """
+
+    # SQLite allows no more than 999 parameters per statement.
+    CHUNK_SIZE = 500
+
+    def __init__(self, filename=None, max_bytes=DEFAULT_MAX_ENTRY_BYTES):
+        if filename is None:
+            filename = cache_directory('entries.sqlite3')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(ENTRY_SCHEMA)
+        # Kept up to date by put_many(), rather than added up every time.
+        self.size = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary of the keys that are cached, with their values.
+        """
+        keys = list(keys)
+        found = {}
+        with self.connection:
+            for start in range(0, len(keys), self.CHUNK_SIZE):
+                chunk = keys[start:start + self.CHUNK_SIZE]
+                placeholders = ', '.join('?' * len(chunk))
+                found.update(self.connection.execute(
+                    'SELECT key, value FROM entries '
+                    'WHERE key IN ({})'.format(placeholders), chunk
+                ))
+                self.connection.execute(
+                    'UPDATE entries SET last_used = ? '
+                    'WHERE key IN ({})'.format(placeholders),
+                    [time.time()] + chunk
+                )
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        count('entry_cache.hits', len(found))
+        count('entry_cache.misses', len(keys) - len(found))
+        return dict((key, json.loads(value)) for key, value in found.items())
+
+    def put_many(self, items):
+        """
+        Stores (key, value) pairs, all in one transaction, then evicts old
+        values if the cache has grown too large.
+        """
+        now = time.time()
+        # The last value given for a key is the one stored.
+        values = dict((key, json.dumps(value)) for key, value in items)
+        keys = list(values)
+        with self.connection:
+            # Values about to be replaced no longer count.
+            for start in range(0, len(keys), self.CHUNK_SIZE):
+                chunk = keys[start:start + self.CHUNK_SIZE]
+                self.size -= self.connection.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM entries '
+                    'WHERE key IN ({})'.format(', '.join('?' * len(chunk))),
+                    chunk
+                ).fetchone()[0]
+            rows = [(key, value, len(key) + len(value), now)
+                    for key, value in values.items()]
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', rows
+            )
+            self.size += sum(size for _, _, size, _ in rows)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM entries')
+        self.size = 0
+
+    def _evict(self):
+        # Walk from most to least recently used, keeping values until the
+        # budget runs out.
+        rows = self.connection.execute(
+            'SELECT size FROM entries ORDER BY last_used DESC'
+        ).fetchall()
+        kept = total = 0
+        for size, in rows:
+            if total + size > self.max_bytes:
+                break
+            kept += 1
+            total += size
+        self.connection.execute(
+            'DELETE FROM entries WHERE key IN ('
+            '    SELECT key FROM entries ORDER BY last_used DESC'
+            '    LIMIT -1 OFFSET ?)', (kept,)
+        )
+        self.size = total
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Converted PDFs, stored by what they were made from, so that converting the
+same PDF the same way for another destination is just a copy (or a link).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from .cache import cache_directory
+
+__all__ = ['ConversionStore', 'conversion_key', 'place']
+
+# Roughly how many bytes of conversions to keep before evicting the least
+# recently used.
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    key         TEXT PRIMARY KEY,
+    size        INTEGER NOT NULL,
+    last_used   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversions_by_last_used
+    ON conversions (last_used);
+"""
+
+
+def conversion_key(source_digest, args, converter_version):
+    """
+    Returns the key of converting a source (given by its SHA-1) with args
+    (without the source and output filenames) using a particular converter.
+
+    >>> key = conversion_key('0beec7b5', ['k2pdfopt', '-dev', 'kpw'], 'v2.42')
+    >>> key == conversion_key('0beec7b5', [u'k2pdfopt', u'-dev', u'kpw'],
+    ...                       'v2.42')
+    True
+    >>> key == conversion_key('0beec7b5', ['k2pdfopt', '-dev', 'kpw'], 'v2.43')
+    False
+    """
+    args = [arg.decode('UTF-8') if isinstance(arg, bytes) else arg
+            for arg in args]
+    return hashlib.sha1(json.dumps([source_digest, args,
+                                    converter_version])).hexdigest()
+
+
+def place(source, destination, link=False):
+    """
+    Replaces destination with a copy of source, cloned copy-on-write where
+    the file system can. With link, destination is instead hard linked to
+    source where possible, so that editing either edits both.
+    """
+    from .copy_engine import CopyEngine
+    if link:
+        try:
+            return CopyEngine('hard').copy(source, destination)
+        except (IOError, OSError):
+            # E.g., they are on different file systems.
+            pass
+    return CopyEngine('auto').copy(source, destination)
+
+
+class ConversionStore(object):
+    """
+    A directory of conversions, keyed by conversion_key(), evicting the least
+    recently used beyond max_bytes. Conversions are copied in and out of the
+    store, unless link is true, which hard links them instead: cheaper, but
+    an e-reader that edits its file in place then edits every other.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> store = ConversionStore(directory)
+    >>> output = os.path.join(directory, 'lerch2013.pdf')
+    >>> open(output, 'w').write('%PDF-1.4 for Kindle')
+    >>> store.add('4cd4be8e', output)
+    >>> other = os.path.join(directory, 'lerch2013-copy.pdf')
+    >>> store.fetch('4cd4be8e', other)
+    True
+    >>> open(other).read()
+    '%PDF-1.4 for Kindle'
+    >>> store.fetch('5dd5cf9f', other)
+    False
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES,
+                 link=False):
+        if directory is None:
+            directory = cache_directory('conversions')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.link = link
+        self.connection = sqlite3.connect(
+            os.path.join(directory, 'index.sqlite3'))
+        self.connection.executescript(SCHEMA)
+
+    def fetch(self, key, destination):
+        """
+        Places the stored conversion at destination, returning False if
+        there is none.
+        """
+        with self.connection:
+            updated = self.connection.execute(
+                'UPDATE conversions SET last_used = ? WHERE key = ?',
+                (time.time(), key)
+            ).rowcount
+        if not updated:
+            return False
+
+        try:
+            place(self._path(key), destination, link=self.link)
+        except (IOError, OSError):
+            # Someone removed it from the store.
+            self._forget(key)
+            return False
+        return True
+
+    def add(self, key, output):
+        """
+        Stores a finished conversion, then evicts old conversions if the
+        store has grown too large.
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        place(output, path, link=self.link)
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO conversions VALUES (?, ?, ?)',
+                (key, os.path.getsize(path), time.time())
+            )
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pdf')
+
+    def _forget(self, key):
+        with self.connection:
+            self.connection.execute('DELETE FROM conversions WHERE key = ?',
+                                    (key,))
+
+    def _evict(self):
+        # Walk from most to least recently used, keeping conversions until
+        # the budget runs out. The newest conversion is always kept.
+        rows = self.connection.execute(
+            'SELECT key, size FROM conversions ORDER BY last_used DESC'
+        ).fetchall()
+        total = 0
+        for index, (key, size) in enumerate(rows):
+            total += size
+            if index > 0 and total > self.max_bytes:
+                self.connection.execute(
+                    'DELETE FROM conversions WHERE key = ?', (key,))
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Copies many files at once, by linking them when allowed and possible, and
+otherwise by having the kernel copy them, in a few threads.
+"""
+
+import errno
+import os
+import stat
+import sys
+import threading
+
+from .profiling import count, span
+
+__all__ = ['CopyEngine', 'Copy', 'MODES', 'format_throughput']
+
+# hard:     hard link (the copy *is* the original: edits change both);
+# reflink:  copy-on-write clone (Btrfs, XFS, APFS-like file systems);
+# copy:     an ordinary copy, done by the kernel where possible;
+# auto:     reflink where the file system supports it, otherwise copy.
+# A copy made as hard or reflink fails where the file system cannot do it.
+MODES = ('auto', 'reflink', 'hard', 'copy')
+
+DEFAULT_THREADS = 4
+
+# How often (in seconds) blocking waits wake up to check for Ctrl-C.
+POLL_INTERVAL = 0.05
+
+# _IOW(0x94, 9, int) from <linux/fs.h>.
+FICLONE = 0x40049409
+
+# The file system cannot do what was asked; try the next method.
+UNSUPPORTED = frozenset([errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP,
+                         errno.ENOTTY, errno.EINVAL, errno.ENOSYS,
+                         errno.EMLINK])
+
+CHUNK_SIZE = 1 << 20
+
+
+class Copy(object):
+    """
+    One file to copy, and, once copied, how (or why not).
+    """
+
+    def __init__(self, source, destination, name=None):
+        self.source = source
+        self.destination = destination
+        self.name = name
+        self.method = None
+        self.size = 0
+        self.error = None
+
+    def __repr__(self):
+        return 'Copy({!r}, method={!r})'.format(self.name, self.method)
+
+
+class CopyEngine(object):
+    """
+    Copies files using the given mode, in up to `threads` threads.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> source = os.path.join(directory, 'Lerch 2013.pdf')
+    >>> open(source, 'w').write('%PDF-1.4')
+    >>> copies = CopyEngine('copy').run([
+    ...     Copy(source, os.path.join(directory, 'lerch2013.pdf'))])
+    >>> [(c.method, c.size, c.error) for c in copies]
+    [('copy', 8, None)]
+    """
+
+    def __init__(self, mode='auto', threads=DEFAULT_THREADS):
+        if mode not in MODES:
+            raise ValueError('Unknown copy mode: {!r}'.format(mode))
+        self.mode = mode
+        self.threads = threads
+        # (method, source device, destination device) known not to work.
+        self._unsupported = set()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        # The exc_info of an unexpected error in a worker, raised by run().
+        self._failure = None
+
+    def run(self, copies):
+        """
+        Copies each Copy from an iterable (which may be a lazy generator),
+        returning them, in order, with their method, size and error filled
+        in. On KeyboardInterrupt, pending copies are skipped, and are
+        returned with neither method nor error. An unexpected error (i.e.,
+        not an IOError or OSError) in copying skips them likewise, and is
+        raised here.
+        """
+        from Queue import Queue
+        queue = Queue(maxsize=2 * self.threads)
+        finished = []
+        self._failure = None
+        workers = [threading.Thread(target=self._work, args=(queue,))
+                   for _ in range(self.threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for copy in copies:
+                finished.append(copy)
+                if not self._put(queue, copy):
+                    break
+            for _ in workers:
+                self._put(queue, None)
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            self._cancelled.set()
+            for worker in workers:
+                worker.join()
+        if self._failure is not None:
+            error, self._failure = self._failure, None
+            raise error[0], error[1], error[2]
+        return finished
+
+    def copy(self, source, destination):
+        """
+        Replaces destination with source all at once, returning the method
+        that worked.
+        """
+        devices = (os.stat(source).st_dev,
+                   os.stat(os.path.dirname(os.path.abspath(destination)))
+                   .st_dev)
+        methods = self._methods()
+        for method in methods:
+            last = method == methods[-1]
+            if not last and (method,) + devices in self._unsupported:
+                continue
+            try:
+                METHODS[method](source, destination)
+            except (IOError, OSError) as error:
+                if error.errno not in UNSUPPORTED or last:
+                    raise
+                with self._lock:
+                    self._unsupported.add((method,) + devices)
+            else:
+                return method
+        raise AssertionError('copy never fails as unsupported')
+
+    def _methods(self):
+        if self.mode == 'auto':
+            return ('reflink', 'copy')
+        # Asked for explicitly, so not quietly replaced with another.
+        return (self.mode,)
+
+    def _put(self, queue, item):
+        """
+        Puts item in queue, unless cancelled first. Returns whether it did.
+        """
+        from Queue import Full
+        while not self._cancelled.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+            except Full:
+                continue
+            return True
+        return False
+
+    def _work(self, queue):
+        from Queue import Empty
+        while not self._cancelled.is_set():
+            try:
+                copy = queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            if copy is None:
+                return
+            try:
+                with span('copy', name=copy.name):
+                    copy.method = self.copy(copy.source, copy.destination)
+                copy.size = os.path.getsize(copy.destination)
+            except (IOError, OSError) as error:
+                copy.error = error
+                count('copies.failed')
+            except Exception as error:
+                # A bug, not a failed copy: stop everything, and let run()
+                # raise it, rather than leave it waiting on a dead worker.
+                copy.error = error
+                with self._lock:
+                    if self._failure is None:
+                        self._failure = sys.exc_info()
+                self._cancelled.set()
+                return
+            else:
+                count('copies.' + copy.method)
+                count('bytes.copied', copy.size)
+
+
+def format_throughput(copies, seconds):
+    """
+    >>> a, b, c = Copy('a', 'A'), Copy('b', 'B'), Copy('c', 'C')
+    >>> a.method, a.size = 'reflink', 3 * 1024 * 1024
+    >>> b.method, b.size = 'copy', 1024 * 1024
+    >>> c.error = IOError(28, 'No space left on device')
+    >>> print(format_throughput([a, b, c], 2.0))
+    3 files: 1 reflink, 1 copy, 1 failed; 4.0 MiB in 2.0s (2.0 MiB/s)
+    """
+    counts = [(method, sum(1 for copy in copies if copy.method == method))
+              for method in ('reflink', 'hard', 'copy')]
+    counts.append(('failed', sum(1 for copy in copies if copy.error)))
+    counts.append(('cancelled', sum(1 for copy in copies
+                                    if copy.method is None and
+                                    copy.error is None)))
+    total = sum(copy.size for copy in copies) / (1024.0 * 1024.0)
+    return '{} files: {}; {:.1f} MiB in {:.1f}s ({:.1f} MiB/s)'.format(
+        len(copies),
+        ', '.join('{} {}'.format(count, method)
+                  for method, count in counts if count) or 'nothing to do',
+        total, seconds, total / seconds if seconds else 0)
+
+
+def _hard_link(source, destination):
+    _replace(destination, lambda temporary: os.link(source, temporary),
+             create=False)
+
+
+def _reflink(source, destination):
+    import fcntl
+
+    def clone(temporary):
+        with open(source, 'rb') as input_file, \
+                open(temporary, 'wb') as output_file:
+            fcntl.ioctl(output_file.fileno(), FICLONE, input_file.fileno())
+    _replace(destination, clone, mode=os.stat(source).st_mode)
+
+
+def _copy(source, destination):
+    def copy(temporary):
+        with open(source, 'rb') as input_file, \
+                open(temporary, 'wb') as output_file:
+            _copy_contents(input_file, output_file)
+    _replace(destination, copy, mode=os.stat(source).st_mode)
+
+
+METHODS = {'hard': _hard_link, 'reflink': _reflink, 'copy': _copy}
+
+
+def _replace(destination, make, create=True, mode=None):
+    """
+    Makes a temporary file next to destination with make(temporary), then
+    renames it to destination.
+    """
+    import tempfile
+    directory, basename = os.path.split(os.path.abspath(destination))
+    descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                             prefix='.' + basename + '.',
+                                             suffix='.tmp')
+    os.close(descriptor)
+    try:
+        if not create:
+            os.remove(temporary)
+        make(temporary)
+        if mode is not None:
+            os.chmod(temporary, stat.S_IMODE(mode))
+        os.rename(temporary, destination)
+    except BaseException:
+        # Python 2 would re-raise the error of os.remove() with a bare raise.
+        error = sys.exc_info()
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise error[0], error[1], error[2]
+
+
+def _load_sendfile():
+    # sendfile(2) copies between files inside the kernel on Linux; elsewhere
+    # it only sends to sockets.
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendfile = libc.sendfile
+    except (OSError, AttributeError):
+        return None
+    sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                         ctypes.c_void_p, ctypes.c_size_t]
+    sendfile.restype = ctypes.c_ssize_t
+    return sendfile
+
+
+# Loaded with the first copy, since finding libc runs ldconfig.
+_sendfile = None
+_sendfile_loaded = False
+
+
+def _copy_contents(input_file, output_file):
+    global _sendfile, _sendfile_loaded
+    if not _sendfile_loaded:
+        _sendfile, _sendfile_loaded = _load_sendfile(), True
+    if _sendfile is not None:
+        while True:
+            sent = _sendfile(output_file.fileno(), input_file.fileno(),
+                             None, CHUNK_SIZE * 64)
+            if sent == 0:
+                return
+            if sent < 0:
+                import ctypes
+                code = ctypes.get_errno()
+                if code == errno.EINTR:
+                    continue
+                if code in (errno.EINVAL, errno.ENOSYS) and \
+                        output_file.tell() == 0:
+                    break
+                raise OSError(code, os.strerror(code))
+    import shutil
+    shutil.copyfileobj(input_file, output_file, CHUNK_SIZE)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+What is in a directory, as listed once, so that asking whether thousands of
+outputs exist (e.g., on NFS) does not cost a syscall or two each.
+"""
+
+import os
+
+from .modification_time import NEGATIVE_INFINITY
+from .profiling import count, span
+
+__all__ = ['DirectoryIndex']
+
+
+class DirectoryIndex(object):
+    """
+    The names in a directory, listed when created, and the stat of each,
+    taken the first time it is asked for. Paths elsewhere are stat()ed
+    every time.
+
+    Nothing written to the directory afterwards is noticed, so an index
+    lasts for one run (which writes each output after looking at it).
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> open(os.path.join(directory, 'lerch2013.pdf'), 'w').write('%PDF')
+    >>> index = DirectoryIndex(directory)
+    >>> index.stat(os.path.join(directory, 'lerch2013.pdf')).st_size
+    4
+    >>> index.exists(os.path.join(directory, 'alipour2013.pdf'))
+    False
+    >>> index.modification_time(os.path.join(directory, 'alipour2013.pdf'))
+    -inf
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        with span('directory_index.list'):
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                # Not made yet: nothing is in it.
+                names = []
+        self._names = frozenset(names)
+        self._stats = {}
+
+    def stat(self, path):
+        """
+        Returns the stat of path, or None if it does not exist.
+        """
+        directory, name = os.path.split(os.path.abspath(path))
+        if directory != self.directory:
+            return _stat(path)
+        if name not in self._names:
+            count('directory_index.absent')
+            return None
+        if name not in self._stats:
+            self._stats[name] = _stat(path)
+        return self._stats[name]
+
+    def exists(self, path):
+        """
+        Returns whether path exists, without a syscall if it is in the
+        directory.
+        """
+        directory, name = os.path.split(os.path.abspath(path))
+        if directory != self.directory:
+            return os.path.exists(path)
+        return name in self._names
+
+    def modification_time(self, path):
+        """
+        Like modification_time.modification_time(), from the index.
+        """
+        stat = self.stat(path)
+        return NEGATIVE_INFINITY if stat is None else stat.st_mtime
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
@@ -1,15 +1,38 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import collections
+import hashlib
+import json
+import multiprocessing
 import re
+import shutil
+import tempfile
 
 import bibtexparser
 
+from bibtexparser.bibdatabase import BibDatabase
 from bibtexparser.bparser import BibTexParser
-from bibtexparser.customization import homogeneize_latex_encoding
+from bibtexparser.bwriter import BibTexWriter
 
+from . import __version__
+from .latex_encoding import homogenise_latex_encoding
+from .profiling import count, span
 
-__all__ = ['fix_bibliography']
+
+__all__ = ['fix_bibliography', 'fix_bibliography_file']
+
+# How many records each worker process handles at a time.
+BATCH_SIZE = 256
+
+BYTE_ORDER_MARK = u'\ufeff'
+
+# Everything besides the record itself that determines how it is fixed;
+# cached entries fixed under different options are never reused.
+FIX_OPTIONS = ('paperpal', __version__,
+               'bibtexparser', bibtexparser.__version__,
+               'homogeneize_latex_encoding', 'year-from-date', 'drop-url',
+               'drop-doi')
 
 
 def fix_bibliography(bibtex_string):
@@ -21,7 +44,7 @@ def fix_bibliography(bibtex_string):
     # Make a parser that will ASCIIify everything:
     # See: https://bibtexparser.readthedocs.io/en/v0.6.2/tutorial.html#accents-and-weird-characters
     parser = BibTexParser()
-    parser.customization = homogeneize_latex_encoding
+    parser.customization = homogenise_latex_encoding
 
     bibtex = bibtexparser.loads(bibtex_string, parser=parser)
 
@@ -32,6 +55,197 @@ def fix_bibliography(bibtex_string):
     return bibtexparser.dumps(bibtex).encode("UTF-8")
 
 
+def fix_bibliography_file(input_file, output_file, processes=1, cache=None):
+    """
+    Like fix_bibliography(), with identical output, but reads and fixes one
+    entry at a time, optionally spreading the work over several processes.
+
+    input_file must yield lines of UTF-8; output_file receives UTF-8.
+    Fixed entries are spooled to a temporary file, and only their keys are
+    kept in memory, because entries are written sorted by key after the
+    @comment, @preamble and @string records.
+
+    With an EntryCache, records fixed on a previous run are taken from the
+    cache, and only new or edited records are fixed.
+    """
+    # Tracks @comment, @preamble and @string records for the header.
+    header_parser = BibTexParser()
+    batches = _batches(_iter_records(input_file), header_parser)
+    if cache is None:
+        results = _map_batches(batches, processes)
+    else:
+        results = _map_cached(batches, processes, cache)
+    keys = []
+
+    with tempfile.TemporaryFile() as spool:
+        for fixed in results:
+            count('bibliography.records', len(fixed))
+            for sort_key, text in _flatten(fixed):
+                encoded = text.encode('UTF-8')
+                keys.append((sort_key, len(keys), spool.tell(), len(encoded)))
+                spool.write(encoded)
+
+        header_writer = BibTexWriter()
+        header_writer.contents = ['comments', 'preambles', 'strings']
+        output_file.write(
+            header_writer.write(header_parser.bib_database).encode('UTF-8')
+        )
+
+        # The same (stable) order as BibTexWriter.order_entries_by = ('ID',)
+        keys.sort()
+        if [index for _, index, _, _ in keys] == range(len(keys)):
+            spool.seek(0)
+            shutil.copyfileobj(spool, output_file)
+        else:
+            for _, _, offset, length in keys:
+                spool.seek(offset)
+                output_file.write(spool.read(length))
+
+
+def _iter_records(lines):
+    """
+    Splits a BibTeX file into records exactly like BibTexParser does: a
+    record starts at every line beginning with '@'.
+    """
+    record = u''
+    for number, line in enumerate(lines):
+        line = line.decode('UTF-8')
+        if number == 0 and line.startswith(BYTE_ORDER_MARK):
+            line = line[len(BYTE_ORDER_MARK):]
+        if line.strip().startswith(u'@'):
+            line = line.lstrip()
+            if record:
+                yield record
+            record = u''
+        record += line
+
+    if record:
+        yield record
+
+
+def _batches(records, header_parser):
+    """
+    Groups records into batches, each with a copy of the @string
+    definitions in effect where the batch starts. A batch ends at every
+    @string record, so the copy holds for each of its records.
+    """
+    batch = []
+    strings = dict(header_parser.bib_database.strings)
+    for record in records:
+        batch.append(record)
+        match = re.match(u'@(comment|preamble|string)', record, re.IGNORECASE)
+        if match:
+            header_parser.parse(record)
+        if (len(batch) >= BATCH_SIZE or
+                match and match.group(1).lower() == u'string'):
+            yield strings, batch
+            batch = []
+            strings = dict(header_parser.bib_database.strings)
+    if batch:
+        yield strings, batch
+
+
+def _map_batches(batches, processes):
+    """
+    Fixes each batch, yielding results in order, with at most a few
+    batches in flight per process.
+    """
+    if processes <= 1:
+        for batch in batches:
+            with span('fix_bibliography.fix_batch', records=len(batch[1])):
+                fixed = _fix_batch(batch)
+            yield fixed
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_fix_batch, (batch,)))
+            if len(pending) >= 2 * processes:
+                with span('fix_bibliography.wait'):
+                    fixed = pending.popleft().get()
+                yield fixed
+        while pending:
+            with span('fix_bibliography.wait'):
+                fixed = pending.popleft().get()
+            yield fixed
+    finally:
+        pool.terminate()
+
+
+def _map_cached(batches, processes, cache):
+    """
+    Like _map_batches(), but only fixes the records missing from the cache,
+    and stores them once they are fixed.
+    """
+    lookups = collections.deque()
+
+    def misses():
+        for strings, records in batches:
+            keys = [_record_key(strings, record) for record in records]
+            found = cache.get_many(keys)
+            lookups.append((keys, found))
+            yield strings, [record for key, record in zip(keys, records)
+                            if key not in found]
+
+    for fixed in _map_batches(misses(), processes):
+        keys, found = lookups.popleft()
+        fixed = iter(fixed)
+        results = []
+        new = []
+        for key in keys:
+            if key in found:
+                results.append([(tuple(sort_key), text)
+                                for sort_key, text in found[key]])
+            else:
+                results.append(next(fixed))
+                new.append((key, results[-1]))
+        cache.put_many(new)
+        yield results
+
+
+def _record_key(strings, record):
+    """
+    Hashes a record, along with the @string definitions it may refer to and
+    the options it is fixed with.
+    """
+    digest = hashlib.sha1(json.dumps([FIX_OPTIONS, sorted(strings.items()),
+                                      record]))
+    return digest.hexdigest()
+
+
+def _flatten(fixed):
+    for entries in fixed:
+        for entry in entries:
+            yield entry
+
+
+def _fix_batch(batch):
+    """
+    Returns, for every record in a batch, its entries as (sort key, BibTeX)
+    pairs.
+    """
+    strings, records = batch
+    parser = BibTexParser()
+    parser.customization = homogenise_latex_encoding
+    parser.bib_database.strings.update(strings)
+
+    writer = BibTexWriter()
+    writer.contents = ['entries']
+    fixed = []
+    for record in records:
+        entries = []
+        for entry in parser.parse(record).entries:
+            fix_entry(entry)
+            single = BibDatabase()
+            single.entries = [entry]
+            entries.append((BibDatabase.entry_sort_key(entry, ('ID',)),
+                            writer.write(single)))
+        fixed.append(entries)
+    return fixed
+
+
 def fix_entry(entry):
     # Add the year from the date.
     if 'date' in entry:
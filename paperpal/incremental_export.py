@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Exports a bibliography by having Zotero export only the items that changed
+since the last export, and splicing them into the entries kept from it.
+"""
+
+import io
+import json
+import os
+import re
+
+from .atomic_file import atomic_output
+from .profiling import count, span
+from .zotero import ZoteroError
+
+__all__ = ['export_incrementally', 'checkpoint_for', 'split_entries',
+           'DEFAULT_FULL_EVERY']
+
+CHECKPOINT_SUFFIX = '.paperpal-checkpoint.json'
+
+# Incremental exports between full ones, which catch anything the item
+# versions missed (e.g., a translator that now writes entries differently).
+DEFAULT_FULL_EVERY = 20
+
+# Bump when the format of a checkpoint changes; older ones are ignored.
+FORMAT = 1
+
+# The start of an entry: an @ at the start of a line (or after a BOM).
+ENTRY_START = re.compile(u'^\ufeff?@', re.MULTILINE)
+CITE_KEY = re.compile(u'@[^{(]*[{(]\\s*([^,\\s]*)')
+
+
+def checkpoint_for(destination):
+    """
+    Returns the filename of the checkpoint kept beside destination.
+
+    >>> checkpoint_for('thesis/bibliography.bib')
+    'thesis/.bibliography.bib.paperpal-checkpoint.json'
+    """
+    directory, basename = os.path.split(destination)
+    return os.path.join(directory, '.' + basename + CHECKPOINT_SUFFIX)
+
+
+def split_entries(text):
+    """
+    Splits an exported bibliography into what comes before its first entry,
+    the separator between entries, the entries, and what comes after the
+    last one, so that joining them again gives back the text exactly.
+
+    >>> split_entries(u'@book{a,\\n}\\n\\n@misc{b,\\n}\\n')
+    (u'', u'\\n\\n', [u'@book{a,\\n}', u'@misc{b,\\n}'], u'\\n')
+
+    The separator is None with fewer than two entries. Returns None if the
+    entries are not all separated alike.
+    """
+    starts = [match.end() - 1 for match in ENTRY_START.finditer(text)]
+    if not starts:
+        return text, None, [], u''
+
+    chunks = [text[start:end]
+              for start, end in zip(starts, starts[1:] + [len(text)])]
+    entries = [chunk.rstrip() for chunk in chunks]
+    separators = set(chunk[len(entry):]
+                     for chunk, entry in zip(chunks[:-1], entries))
+    if len(separators) > 1:
+        return None
+    separator = separators.pop() if separators else None
+    return (text[:starts[0]], separator, entries,
+            chunks[-1][len(entries[-1]):])
+
+
+def cite_key(entry):
+    """
+    Returns the cite key of an entry.
+
+    >>> cite_key(u'@inproceedings{lerch2013,\\n  title = {Finding}\\n}')
+    u'lerch2013'
+    """
+    match = CITE_KEY.match(entry)
+    return match.group(1) if match else None
+
+
+def export_incrementally(zotero, collection, filename, checkpoint,
+                         translator=None, full_every=DEFAULT_FULL_EVERY):
+    """
+    Writes the collection's bibliography to filename, byte for byte what a
+    full export would write, having Zotero export only the items that
+    changed since the export recorded in checkpoint. Every full_every
+    exports, or whenever splicing cannot be trusted, the whole collection
+    is exported instead; each item is then exported alone as well, to tell
+    which entry is whose. Returns how many items were exported, and how
+    many there are.
+    """
+    try:
+        versions = zotero.item_versions(collection)
+    except ZoteroError as error:
+        if error.reason[0] != 'unsupported':
+            raise
+        versions = None
+
+    source = json.dumps([collection, translator])
+    state = _load(checkpoint)
+    if (versions is not None and state is not None and
+            state['source'] == source and
+            state['exports_since_full'] + 1 < full_every):
+        items, exported = _splice(zotero, versions, state, translator)
+        if items is not None:
+            state.update(items=items,
+                         exports_since_full=state['exports_since_full'] + 1)
+            _write(filename, state)
+            _save(checkpoint, state)
+            count('export.items', exported)
+            return exported, len(versions)
+
+    with span('export.full'):
+        zotero.export_bibliography_to(collection, filename,
+                                      translator=translator)
+    total = len(versions) if versions is not None else None
+    count('export.items', total or 0)
+
+    parts = _read(filename)
+    if parts is None or versions is None or len(parts[2]) != total:
+        # Entries cannot be matched with items; export in full next time.
+        _remove(checkpoint)
+        return total, total
+
+    prefix, separator, entries, suffix = parts
+    if not _in_export_order(zotero, versions, entries, translator,
+                            dict(prefix=prefix, suffix=suffix)):
+        _remove(checkpoint)
+        return total, total
+
+    _save(checkpoint, dict(
+        source=source, exports_since_full=0,
+        prefix=prefix, separator=separator, suffix=suffix,
+        items=[[id, version, entry]
+               for (id, version), entry in zip(versions, entries)]
+    ))
+    return total, total
+
+
+def _in_export_order(zotero, versions, entries, translator, state):
+    """
+    Whether the nth entry of a full export is the nth item's, as told by
+    exporting each item alone and comparing their cite keys.
+    """
+    ids = [id for id, _ in versions]
+    with span('export.verify'):
+        fresh = _export_items(zotero, ids, translator, state)
+    return fresh is not None and all(
+        cite_key(fresh[id]) == cite_key(entry)
+        for id, entry in zip(ids, entries))
+
+
+def _splice(zotero, versions, state, translator):
+    """
+    Returns [id, version, entry] for every item, and how many were exported
+    anew; or None, 0 if the result might not match a full export.
+    """
+    known = dict((id, (version, entry))
+                 for id, version, entry in state['items'])
+    changed = [id for id, version in versions
+               if known.get(id, (None, None))[0] != version]
+
+    fresh = _export_items(zotero, changed, translator, state)
+    if fresh is None:
+        return None, 0
+
+    items = [[id, version, fresh[id] if id in fresh else known[id][1]]
+             for id, version in versions]
+    if len(items) > 1 and state['separator'] is None:
+        return None, 0
+
+    # Translators give each duplicate cite key a suffix ("lerch2013a")
+    # in the order the items are exported. Splicing cannot redo that: give
+    # up if a key is duplicated, or if one that went away may have been
+    # what another was disambiguated from.
+    keys = [cite_key(entry) for _, _, entry in items]
+    if None in keys or len(set(keys)) != len(keys):
+        return None, 0
+    current = set(keys)
+    gone = set(cite_key(entry) for _, entry in known.values()) - current
+    gone.discard(None)
+    if any(key.startswith(stem) and key[len(stem):].isalpha()
+           for stem in gone for key in current):
+        return None, 0
+    return items, len(fresh)
+
+
+def _export_items(zotero, ids, translator, state):
+    """
+    Returns the entry of each item, exported alone, or None if any cannot
+    be spliced into the checkpoint's bibliography.
+    """
+    if not ids:
+        return {}
+
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix='paperpal-export-')
+    try:
+        filenames = [os.path.join(directory, '{}.bib'.format(index))
+                     for index in range(len(ids))]
+        with span('export.items'):
+            reasons = zotero.export_items_to(zip(ids, filenames),
+                                             translator=translator)
+        if any(reason is not None for reason in reasons):
+            # E.g., an item was deleted since its version was taken.
+            return None
+
+        entries = {}
+        for id, filename in zip(ids, filenames):
+            parts = _read(filename)
+            if (parts is None or len(parts[2]) != 1 or
+                    parts[0] != state['prefix'] or
+                    parts[3] != state['suffix']):
+                return None
+            entries[id] = parts[2][0]
+        return entries
+    finally:
+        shutil.rmtree(directory)
+
+
+def _read(filename):
+    try:
+        with io.open(filename, encoding='UTF-8', newline='') as exported:
+            return split_entries(exported.read())
+    except (IOError, UnicodeDecodeError):
+        return None
+
+
+def _write(filename, state):
+    with io.open(filename, 'w', encoding='UTF-8', newline='') as output:
+        output.write(state['prefix'])
+        output.write((state['separator'] or u'').join(
+            entry for _, _, entry in state['items']))
+        output.write(state['suffix'])
+
+
+def _load(checkpoint):
+    try:
+        with open(checkpoint) as checkpoint_file:
+            state = json.load(checkpoint_file)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('format') != FORMAT:
+        return None
+    return state
+
+
+def _save(checkpoint, state):
+    state['format'] = FORMAT
+    with atomic_output(checkpoint) as temporary:
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump(state, checkpoint_file)
+
+
+def _remove(checkpoint):
+    try:
+        os.remove(checkpoint)
+    except OSError:
+        # Already gone.
+        pass
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Records each job of a batch as soon as it finishes, so that a batch that
+was interrupted (even by a crash) can be resumed where it stopped.
+"""
+
+import json
+import os
+import threading
+
+__all__ = ['Journal', 'JOURNAL_NAME', 'DEFAULT_RETRIES']
+
+JOURNAL_NAME = '.paperpal-journal.jsonl'
+
+# How many more times a resumed batch tries a job that failed.
+DEFAULT_RETRIES = 2
+
+
+class Journal(object):
+    """
+    One line of JSON per finished job, in a destination directory. A new
+    journal starts a new batch; resume=True continues the last one, with
+    what it recorded in completed and failures.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> journal = Journal(directory)
+    >>> journal.record('lerch2013', 'ok', {'sha1': '4cd4be8e'})
+    >>> journal.record('alipour2013', 'failed')
+    >>> journal.close()
+    >>> journal = Journal(directory, resume=True)
+    >>> journal.completed
+    {u'lerch2013': {u'sha1': u'4cd4be8e'}}
+    >>> journal.failures
+    {u'alipour2013': 1}
+    """
+
+    def __init__(self, directory, resume=False):
+        self.filename = os.path.join(directory, JOURNAL_NAME)
+        # Cite key -> the manifest entry of its output.
+        self.completed = {}
+        # Cite key -> how many times it failed (or timed out).
+        self.failures = {}
+        if resume:
+            self._load()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(self.filename, 'a' if resume else 'w')
+        self._lock = threading.Lock()
+
+    def record(self, cite_key, status, entry=None):
+        """
+        Appends a finished job, and makes sure it is on disk before
+        returning. Cancelled jobs are not recorded, as they never ran to
+        completion.
+        """
+        if status == 'cancelled':
+            return
+        line = json.dumps(dict(cite_key=cite_key, status=status, entry=entry),
+                          sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """
+        Ends the batch, for there is nothing left to resume.
+        """
+        self.close()
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def _load(self):
+        try:
+            journal_file = open(self.filename)
+        except IOError:
+            return
+        with journal_file:
+            for line in journal_file:
+                try:
+                    job = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash.
+                    continue
+                cite_key = job['cite_key']
+                if job['status'] == 'ok':
+                    self.completed[cite_key] = job['entry']
+                    self.failures.pop(cite_key, None)
+                else:
+                    self.completed.pop(cite_key, None)
+                    self.failures[cite_key] = (
+                        self.failures.get(cite_key, 0) + 1)
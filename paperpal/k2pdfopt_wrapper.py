@@ -15,12 +15,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
+from .profiling import span
 
-__all__ = ['k2pdfopt']
+__all__ = ['k2pdfopt', 'k2pdfopt_args', 'k2pdfopt_version']
+
+_versions = {}
 
 
 def k2pdfopt(filename, destination, *extra_args, **kwargs):
+    import subprocess
+    return subprocess.call(k2pdfopt_args(filename, destination,
+                                         *extra_args, **kwargs))
+
+
+def k2pdfopt_args(filename, destination, *extra_args, **kwargs):
+    """
+    Returns the full argument vector for converting filename to destination.
+
+    >>> k2pdfopt_args('in.pdf', 'out.pdf', '-c', title='Title')[-6:]
+    ['-title', 'Title', '-c', '-o', 'out.pdf', 'in.pdf']
+
+    Given pages (e.g., '1-100'), only those pages are converted:
+
+    >>> k2pdfopt_args('in.pdf', 'out.pdf', pages='1-100')[-5:-3]
+    ['-p', '1-100']
+
+    Unicode arguments (e.g., names from Zotero) are encoded as UTF-8:
+
+    >>> k2pdfopt_args('in.pdf', 'out.pdf', author=u'Vasi\u0107')[-5:-3]
+    ['-author', 'Vasi\\xc4\\x87']
+    """
     args = ['k2pdfopt',
             '-ui-', '-x',
             '-mode', '2col',
@@ -30,8 +54,31 @@ def k2pdfopt(filename, destination, *extra_args, **kwargs):
         args += ['-author', kwargs['author']]
     if 'title' in kwargs:
         args += ['-title', kwargs['title']]
+    if 'pages' in kwargs:
+        args += ['-p', kwargs['pages']]
 
     args += extra_args
     args += ['-o', destination, filename]
 
-    return subprocess.call(args)
+    return [arg.encode('UTF-8') if isinstance(arg, unicode) else arg
+            for arg in args]
+
+
+def k2pdfopt_version(executable='k2pdfopt'):
+    """
+    Returns an identifier of the installed k2pdfopt (the SHA-1 of its
+    executable, which tells apart versions and builds alike), or None if it
+    is not installed.
+    """
+    from distutils.spawn import find_executable
+    path = find_executable(executable)
+    if path is None:
+        return None
+    if path not in _versions:
+        import hashlib
+        digest = hashlib.sha1()
+        with span('k2pdfopt.version'), open(path, 'rb') as program:
+            for chunk in iter(lambda: program.read(1 << 20), b''):
+                digest.update(chunk)
+        _versions[path] = digest.hexdigest()
+    return _versions[path]
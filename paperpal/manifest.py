@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Remembers what was written to a destination directory, and from what, so
+that only outputs whose source or conversion changed are made again.
+"""
+
+import json
+import os
+
+from .atomic_file import atomic_output
+from .profiling import count, span
+
+__all__ = ['Manifest', 'MANIFEST_NAME', 'file_digest']
+
+MANIFEST_NAME = '.paperpal-manifest.json'
+
+# Bump when the format of an entry changes; older manifests are ignored.
+FORMAT = 1
+
+
+class Manifest(object):
+    """
+    For each cite key: the output filename, and the source path, size,
+    modification time and SHA-1 it was made from, with the arguments of the
+    conversion (e.g., k2pdfopt's).
+
+    A source is unchanged if its stat matches what was recorded; only if it
+    does not (e.g., Zotero sync touched it) is it hashed to find out. With
+    copies, outputs are byte-for-byte copies of their sources, so sources
+    are never hashed when copied (which would read them twice): a touched
+    source is compared with its copy instead.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> source = os.path.join(directory, 'Lerch 2013.pdf')
+    >>> open(source, 'w').write('%PDF-1.4')
+    >>> output = os.path.join(directory, 'lerch2013.pdf')
+    >>> manifest = Manifest(directory)
+    >>> manifest.is_stale('lerch2013', source, output, ['copy'])
+    True
+    >>> open(output, 'w').write('%PDF-1.4')
+    >>> entry = manifest.commit('lerch2013')
+    >>> manifest.is_stale('lerch2013', source, output, ['copy'])
+    False
+    >>> manifest.is_stale('lerch2013', source, output, ['k2pdfopt', '-c'])
+    True
+    """
+
+    def __init__(self, directory, copies=False):
+        self.directory = directory
+        self.copies = copies
+        self.filename = os.path.join(directory, MANIFEST_NAME)
+        self.entries = self._load()
+        # Cite keys seen in the collection during this run.
+        self.seen = set()
+        # Entries of outputs being made, committed once they are done.
+        self._staged = {}
+        self._changed = False
+
+    def is_stale(self, cite_key, source, output, args, source_stat=None,
+                 index=None):
+        """
+        Returns True if output must be made again from source with args.
+        If so, the new entry is staged until commit(cite_key).
+
+        Without an entry (e.g., outputs made before there was a manifest),
+        falls back to comparing modification times.
+
+        The stat of source may be given if already known, and outputs are
+        looked up in a DirectoryIndex, if given.
+
+        Safe to call from several threads at once, for different cite keys:
+        each call only ever changes the entries of its own cite key.
+        """
+        self.seen.add(cite_key)
+        # Compare as JSON gives them back.
+        source, output, args = _text(source), _text(output), map(_text, args)
+        stat = source_stat if source_stat is not None else os.stat(source)
+        entry = self.entries.get(cite_key)
+
+        if index is None:
+            exists = os.path.exists(output)
+        else:
+            exists = index.exists(output)
+        if not exists:
+            return self._stage(cite_key, source, output, args, stat)
+
+        if entry is None:
+            output_mtime = (os.stat(output).st_mtime if index is None
+                            else index.modification_time(output))
+            if stat.st_mtime > output_mtime:
+                return self._stage(cite_key, source, output, args, stat)
+            # Adopt the existing output.
+            self._stage(cite_key, source, output, args, stat)
+            self.commit(cite_key)
+            return False
+
+        if (entry['args'] != args or entry['output'] != output or
+                entry['size'] != stat.st_size):
+            return self._stage(cite_key, source, output, args, stat)
+
+        if entry['source'] == source and entry['mtime'] == stat.st_mtime:
+            return False
+
+        # Same size, but moved or touched: has the content changed?
+        if entry['sha1'] is None:
+            if not _same_contents(source, output):
+                return self._stage(cite_key, source, output, args, stat)
+        else:
+            digest = file_digest(source)
+            if digest != entry['sha1']:
+                return self._stage(cite_key, source, output, args, stat,
+                                   digest)
+
+        entry.update(source=source, mtime=stat.st_mtime)
+        self._changed = True
+        return False
+
+    def staged_digest(self, cite_key):
+        """
+        Returns the SHA-1 of the source staged for cite_key.
+        """
+        entry = self._staged[cite_key]
+        if entry['sha1'] is None:
+            entry['sha1'] = file_digest(entry['source'])
+        return entry['sha1']
+
+    def commit(self, cite_key):
+        """
+        Records that the output staged for cite_key has been made, and
+        returns its entry.
+        """
+        entry = self.entries[cite_key] = self._staged.pop(cite_key)
+        self._changed = True
+        return entry
+
+    def restore(self, cite_key, entry):
+        """
+        Records an entry committed by an earlier run that could not save it
+        (e.g., one replayed from a Journal).
+        """
+        self.entries[cite_key] = entry
+        self._changed = True
+
+    def prune(self):
+        """
+        Deletes the outputs of cite keys that were not seen during this run,
+        returning their filenames. Only outputs in the manifest are deleted.
+        """
+        removed = []
+        for cite_key in sorted(set(self.entries) - self.seen):
+            output = self.entries.pop(cite_key)['output']
+            try:
+                os.remove(output)
+            except OSError:
+                # Already gone.
+                pass
+            else:
+                removed.append(output)
+            self._changed = True
+        return removed
+
+    def save(self):
+        if not self._changed:
+            return
+        with atomic_output(self.filename) as temporary:
+            with open(temporary, 'w') as manifest_file:
+                json.dump({'format': FORMAT, 'entries': self.entries},
+                          manifest_file, indent=1, sort_keys=True)
+        self._changed = False
+
+    def _stage(self, cite_key, source, output, args, stat, digest=None):
+        if digest is None and not self.copies:
+            digest = file_digest(source)
+        self._staged[cite_key] = dict(
+            source=source, output=output, args=args,
+            size=stat.st_size, mtime=stat.st_mtime, sha1=digest
+        )
+        return True
+
+    def _load(self):
+        try:
+            with open(self.filename) as manifest_file:
+                contents = json.load(manifest_file)
+        except (IOError, ValueError):
+            return {}
+        if contents.get('format') != FORMAT:
+            return {}
+        return contents['entries']
+
+
+def _same_contents(source, output):
+    import filecmp
+    with span('manifest.compare'):
+        try:
+            return filecmp.cmp(source, output, shallow=False)
+        except OSError:
+            return False
+
+
+def _text(value):
+    return value.decode('UTF-8') if isinstance(value, bytes) else value
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """
+    Returns the hexadecimal SHA-1 of the contents of filename.
+    """
+    import hashlib
+    digest = hashlib.sha1()
+    with span('manifest.hash'), open(filename, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            digest.update(chunk)
+            count('bytes.hashed', len(chunk))
+    return digest.hexdigest()
@@ -17,6 +17,8 @@
 
 import os
 
+from .profiling import span
+
 NEGATIVE_INFINITY = -float('inf')
 
 
@@ -25,6 +27,7 @@ def modification_time(filename):
     Returns modification time of the given filename.
     Returns negative infinity if the file does not exist.
     """
-    if not os.path.exists(filename):
-        return NEGATIVE_INFINITY
-    return os.stat(filename).st_mtime
+    with span('stat.modification_time'):
+        if not os.path.exists(filename):
+            return NEGATIVE_INFINITY
+        return os.stat(filename).st_mtime
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact records of the items in a collection, so that hundreds of
+thousands of them fit in memory at once.
+"""
+
+__all__ = ['Paper', 'url_to_filename']
+
+# Distinct author names (and lists of authors) seen, so that each is kept
+# in memory only once, however many papers share it. Emptied whenever it
+# reaches MAX_INTERNED, so that a long-running process (e.g., watch) does
+# not keep every name it ever listed.
+_interned = {}
+MAX_INTERNED = 1 << 18
+
+
+def url_to_filename(url):
+    """
+    Returns the path of a file:// URL, as Zotero gives attachments.
+
+    >>> url_to_filename('file:///Users/Foo%20Bar/herp.pdf')
+    '/Users/Foo Bar/herp.pdf'
+    """
+    # Only listings from a running Zotero need urllib, which is slow to
+    # import.
+    from urllib import unquote
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return unquote(url)
+
+
+class Paper(object):
+    """
+    One regular item in a collection: its authors, title, cite key and the
+    filename of its PDF (or None).
+
+    Papers are read just like the dicts that used to stand for items, and
+    are equal to them. Authors are kept as shared tuples of interned names,
+    and become dicts only when asked for (without the names they lacked).
+    A PDF given as a URL is turned into a filename the first time it is
+    asked for.
+
+    >>> paper = Paper([{'first': u'Joshua', 'last': u'Lerch'}],
+    ...               u'Finding Duplicates', u'lerch2013',
+    ...               pdf_url='file:///Users/Foo%20Bar/lerch.pdf')
+    >>> paper['pdf_filename']
+    '/Users/Foo Bar/lerch.pdf'
+    >>> paper['authors']
+    [{'last': u'Lerch', 'first': u'Joshua'}]
+    >>> paper == dict(paper)
+    True
+    >>> Paper([{'last': u'ACM'}])['authors']
+    [{'last': u'ACM'}]
+    >>> print('{cite_key}: {title}'.format(**paper))
+    lerch2013: Finding Duplicates
+    """
+
+    __slots__ = ('_authors', 'title', 'cite_key', '_pdf_filename',
+                 '_pdf_url')
+
+    KEYS = ('authors', 'title', 'cite_key', 'pdf_filename')
+
+    def __init__(self, authors=(), title=None, cite_key=None,
+                 pdf_filename=None, pdf_url=None):
+        self._authors = _intern_authors(authors)
+        self.title = title
+        self.cite_key = cite_key
+        self._pdf_filename = pdf_filename
+        self._pdf_url = pdf_url
+
+    @classmethod
+    def from_zotero(cls, item):
+        """
+        Returns the paper for an item listed by zotero-bridge.js, whose PDF
+        is a file:// URL.
+        """
+        return cls(item['authors'], item['title'], item['cite_key'],
+                   pdf_url=item['pdf_filename'])
+
+    @property
+    def authors(self):
+        return [dict((key, name) for key, name in (('first', first),
+                                                   ('last', last))
+                     if name is not None)
+                for first, last in self._authors]
+
+    @property
+    def pdf_filename(self):
+        if self._pdf_url is not None:
+            self._pdf_filename = url_to_filename(self._pdf_url)
+            self._pdf_url = None
+        return self._pdf_filename
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        if key == 'authors':
+            self._authors = _intern_authors(value)
+        elif key == 'pdf_filename':
+            self._pdf_filename, self._pdf_url = value, None
+        else:
+            setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.KEYS else default
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def items(self):
+        return [(key, self[key]) for key in self.KEYS]
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __eq__(self, other):
+        if not isinstance(other, (Paper, dict)):
+            return NotImplemented
+        return dict(self.items()) == dict(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Paper({})'.format(', '.join(
+            '{}={!r}'.format(key, self[key]) for key in self.KEYS))
+
+
+def _intern_authors(authors):
+    # Zotero leaves out the first name of, e.g., an institution.
+    return _intern(tuple(
+        _intern((_intern(author.get('first')), _intern(author.get('last'))))
+        for author in authors
+    ))
+
+
+def _intern(value):
+    # intern() only takes byte strings; names from Zotero are unicode.
+    if len(_interned) >= MAX_INTERNED:
+        _interned.clear()
+    return _interned.setdefault(value, value)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stages of a pipeline connected by bounded queues, so that listing items
+from Zotero, looking at their files, and copying or converting them all
+overlap, without any stage running too far ahead of the next.
+"""
+
+import sys
+import threading
+
+from collections import deque
+from itertools import islice
+
+__all__ = ['background', 'parallel_map', 'DEFAULT_QUEUE_SIZE',
+           'DEFAULT_CHUNK_SIZE']
+
+# How many items may wait between two stages.
+DEFAULT_QUEUE_SIZE = 1000
+
+# How many items are looked at (stat()ed, hashed...) at once.
+DEFAULT_THREADS = 4
+
+# Items are passed between threads in chunks of this many, since passing
+# each on its own costs more than looking at a file whose stat is cached.
+DEFAULT_CHUNK_SIZE = 32
+
+# How often (in seconds) blocking waits wake up to check for Ctrl-C.
+POLL_INTERVAL = 0.05
+
+_END = object()
+
+
+def background(iterable, queue_size=DEFAULT_QUEUE_SIZE,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the items of iterable, iterated by another thread that stays up
+    to about queue_size items ahead. Exceptions are raised where the items
+    are consumed. If the consumer stops early, so does the thread; the
+    iterable is closed.
+
+    >>> list(background(iter(range(5)), queue_size=2, chunk_size=2))
+    [0, 1, 2, 3, 4]
+    """
+    from Queue import Queue
+    queue = Queue(maxsize=max(1, queue_size // chunk_size))
+    stop = threading.Event()
+
+    def feed():
+        iterator = iter(iterable)
+        try:
+            for chunk in _chunks(iterator, chunk_size):
+                if not _put(queue, chunk, stop):
+                    break
+            else:
+                _put(queue, _END, stop)
+        except BaseException:
+            _put(queue, _Failure(), stop)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if stop.is_set() and close is not None:
+                close()
+
+    thread = threading.Thread(target=feed)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk = _get(queue)
+            if chunk is _END:
+                return
+            if isinstance(chunk, _Failure):
+                chunk.reraise()
+            for item in chunk:
+                yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            thread.join(POLL_INTERVAL)
+
+
+def parallel_map(function, iterable, threads=DEFAULT_THREADS,
+                 queue_size=DEFAULT_QUEUE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields function(item) for each item of iterable, in order, calling
+    function in several threads, up to about queue_size items ahead of the
+    consumer. Exceptions are raised in place of their result.
+
+    >>> list(parallel_map(lambda x: x * x, range(6), threads=3, queue_size=2,
+    ...                   chunk_size=1))
+    [0, 1, 4, 9, 16, 25]
+    """
+    from Queue import Empty, Queue
+    queue_size = max(1, queue_size // chunk_size)
+    tasks = Queue(maxsize=queue_size)
+    pending = deque()
+    stop = threading.Event()
+
+    def work():
+        while not stop.is_set():
+            try:
+                task = tasks.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            if task is None:
+                return
+            task.run(function)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    chunks = _chunks(iter(iterable), chunk_size)
+    failure = None
+    try:
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            except Exception:
+                # Finish the items before it first.
+                failure = _Failure()
+                break
+            task = _Task(chunk)
+            pending.append(task)
+            _put(tasks, task, stop)
+            while pending and (len(pending) > queue_size or
+                               pending[0].done.is_set()):
+                for result in pending.popleft().results():
+                    yield result
+        while pending:
+            for result in pending.popleft().results():
+                yield result
+        if failure is not None:
+            failure.reraise()
+    finally:
+        stop.set()
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(POLL_INTERVAL)
+
+
+class _Task(object):
+    """
+    A chunk of items, and, once run, their results (up to the first
+    exception, if any).
+    """
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.done = threading.Event()
+        self.values = []
+        self.failure = None
+
+    def run(self, function):
+        try:
+            for item in self.chunk:
+                self.values.append(function(item))
+        except BaseException:
+            self.failure = _Failure()
+        self.done.set()
+
+    def results(self):
+        while not self.done.wait(POLL_INTERVAL):
+            pass
+        for value in self.values:
+            yield value
+        if self.failure is not None:
+            self.failure.reraise()
+
+
+class _Failure(object):
+    """
+    An exception caught in one thread, to be raised in another.
+    """
+
+    def __init__(self):
+        self.exc_info = sys.exc_info()
+
+    def reraise(self):
+        raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+
+def _chunks(iterator, size):
+    # Items before an exception are yielded before it is raised.
+    while True:
+        chunk, failure = [], None
+        try:
+            chunk.extend(islice(iterator, size))
+        except Exception:
+            failure = _Failure()
+        if chunk:
+            yield chunk
+        if failure is not None:
+            failure.reraise()
+        if len(chunk) < size:
+            return
+
+
+def _put(queue, item, stop):
+    """
+    Puts item in queue, unless stop is set first. Returns whether it did.
+    """
+    from Queue import Full
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+        except Full:
+            continue
+        return True
+    return False
+
+
+def _get(queue):
+    from Queue import Empty
+    while True:
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            continue
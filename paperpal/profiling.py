@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timings and counters of the hot paths, for `--profile` and `--trace`.
+
+Recording is off unless enable() is called, and then costs a function call
+per span or counter. With a trace file, every span and counter is also
+written as a line of JSON in the Trace Event Format; `jq -s . FILE` turns
+the lines into an array that chrome://tracing and Perfetto can open.
+
+>>> enable()
+>>> with span('zotero.repl', action='list'):
+...     count('bytes.copied', 1024)
+>>> print(summary())  # doctest: +ELLIPSIS
+phase                          calls    total s    mean ms     max ms
+zotero.repl                        1      0.000 ...
+<BLANKLINE>
+counter                        value
+bytes.copied                    1024
+>>> disable()
+"""
+
+import json
+import os
+import threading
+import time
+
+__all__ = ['enable', 'disable', 'enabled', 'span', 'count', 'summary']
+
+_recorder = None
+
+
+def enable(trace=None):
+    """
+    Starts recording; with trace, a filename, also writes every event to
+    it as JSON lines.
+    """
+    global _recorder
+    disable()
+    _recorder = _Recorder(trace)
+
+
+def disable():
+    """
+    Stops recording, and closes the trace file, if any.
+    """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+def enabled():
+    return _recorder is not None
+
+
+def span(phase, **args):
+    """
+    Returns a context manager timing its block as one call of phase; args
+    are only written to the trace.
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(_recorder, phase, args)
+
+
+def count(name, amount=1):
+    """
+    Adds amount to the counter called name.
+    """
+    if _recorder is not None:
+        _recorder.count(name, amount)
+
+
+def summary():
+    """
+    Returns a table of every phase (slowest in total first) and counter.
+    """
+    if _recorder is None:
+        return ''
+    return _recorder.summary()
+
+
+class _Recorder(object):
+    def __init__(self, trace=None):
+        self.origin = time.time()
+        self.pid = os.getpid()
+        # name -> [calls, total seconds, maximum seconds]
+        self.phases = {}
+        self.counters = {}
+        self.trace = open(trace, 'w') if trace is not None else None
+        self.lock = threading.Lock()
+
+    def add(self, name, start, elapsed, args):
+        with self.lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += elapsed
+            phase[2] = max(phase[2], elapsed)
+            if self.trace is not None:
+                self._write(dict(name=name, cat=name.split('.')[0], ph='X',
+                                 ts=self._microseconds(start),
+                                 dur=round(elapsed * 1e6, 1), args=args))
+
+    def count(self, name, amount):
+        with self.lock:
+            total = self.counters[name] = self.counters.get(name, 0) + amount
+            if self.trace is not None:
+                self._write(dict(name=name, ph='C',
+                                 ts=self._microseconds(time.time()),
+                                 args={name: total}))
+
+    def summary(self):
+        with self.lock:
+            lines = ['{:<26} {:>9} {:>10} {:>10} {:>10}'.format(
+                'phase', 'calls', 'total s', 'mean ms', 'max ms')]
+            phases = sorted(self.phases.items(),
+                            key=lambda (name, phase): (-phase[1], name))
+            for name, (calls, total, longest) in phases:
+                lines.append('{:<26} {:>9} {:>10.3f} {:>10.2f} {:>10.2f}'
+                             .format(name, calls, total,
+                                     1000 * total / calls, 1000 * longest))
+            if self.counters:
+                lines.extend(['', '{:<26} {:>9}'.format('counter', 'value')])
+                for name, value in sorted(self.counters.items()):
+                    lines.append('{:<26} {:>9}'.format(name, value))
+        return '\n'.join(lines)
+
+    def close(self):
+        with self.lock:
+            if self.trace is not None:
+                self.trace.close()
+                self.trace = None
+
+    def _microseconds(self, moment):
+        return round((moment - self.origin) * 1e6, 1)
+
+    def _write(self, event):
+        event.update(pid=self.pid, tid=threading.current_thread().ident)
+        self.trace.write(json.dumps(event, sort_keys=True) + '\n')
+
+
+class _Span(object):
+    __slots__ = ('recorder', 'name', 'args', 'start')
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add(self.name, self.start, time.time() - self.start,
+                          self.args)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
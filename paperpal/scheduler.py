@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs external commands (i.e., k2pdfopt) in a bounded pool of workers.
+"""
+
+import os
+import sys
+import threading
+import time
+
+from .profiling import span
+
+__all__ = ['Job', 'Scheduler', 'default_jobs', 'format_summary']
+
+# How often (in seconds) blocking waits wake up to check for timeouts and
+# cancellation. Python 2 cannot interrupt a bare Thread.join() with Ctrl-C.
+POLL_INTERVAL = 0.05
+
+OK = 'ok'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+
+
+def default_jobs():
+    """
+    Returns the default number of workers: one per CPU.
+    """
+    # What multiprocessing.cpu_count() asks on most systems, without
+    # importing multiprocessing on every start.
+    try:
+        return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+    except (AttributeError, ValueError, OSError):
+        pass
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class Job(object):
+    """
+    A command to run, and, once it has run, how it went.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.status = None
+        self.returncode = None
+        self.elapsed = None
+
+    def __repr__(self):
+        return 'Job({!r}, status={!r})'.format(self.name, self.status)
+
+
+class Scheduler(object):
+    """
+    Runs jobs concurrently in at most `jobs` processes at once.
+
+    >>> import sys
+    >>> scheduler = Scheduler(jobs=2)
+    >>> ok = Job('ok', [sys.executable, '-c', 'pass'])
+    >>> bad = Job('bad', [sys.executable, '-c', 'exit(3)'])
+    >>> [(job.name, job.status, job.returncode)
+    ...  for job in scheduler.run([ok, bad])]
+    [('ok', 'ok', 0), ('bad', 'failed', 3)]
+    """
+
+    def __init__(self, jobs=None, timeout=None):
+        self.jobs = jobs or default_jobs()
+        self.timeout = timeout
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()
+        # The exc_info of an unexpected error in a worker, raised by run().
+        self._failure = None
+
+    def run(self, jobs, on_finish=None):
+        """
+        Runs every job, returning them, in order, with their status filled
+        in. `jobs` may be any iterable, including a lazy generator.
+
+        on_finish(job), if given, is called as soon as each job has run,
+        from the thread that ran it. If it raises an EnvironmentError, the
+        job has failed. If it raises any other exception, the job has
+        failed, the others are cancelled as if by Ctrl-C, and the exception
+        is raised here.
+
+        On KeyboardInterrupt, every running process is killed, every pending
+        job is marked as cancelled, and the jobs are returned as usual.
+        """
+        from Queue import Queue
+        queue = Queue(maxsize=self.jobs)
+        finished = []
+        self._failure = None
+        workers = [threading.Thread(target=self._work,
+                                    args=(queue, on_finish))
+                   for _ in range(self.jobs)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for job in jobs:
+                finished.append(job)
+                if not self._put(queue, job):
+                    break
+            for _ in workers:
+                self._put(queue, None)
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            self.cancel()
+            for worker in workers:
+                worker.join()
+
+        for job in finished:
+            if job.status is None:
+                job.status = CANCELLED
+        if self._failure is not None:
+            error, self._failure = self._failure, None
+            raise error[0], error[1], error[2]
+        return finished
+
+    def cancel(self):
+        """
+        Kills all running jobs and prevents any more from starting.
+        """
+        self._cancelled.set()
+        with self._lock:
+            for process in self._running:
+                _kill(process)
+
+    def _put(self, queue, item):
+        """
+        Puts item in queue, unless cancelled first. Returns whether it did.
+        """
+        from Queue import Full
+        while not self._cancelled.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+            except Full:
+                continue
+            return True
+        return False
+
+    def _work(self, queue, on_finish):
+        from Queue import Empty
+        while not self._cancelled.is_set():
+            try:
+                job = queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            if job is None:
+                return
+            try:
+                with span('job', name=job.name, program=job.args[0]
+                          if job.args else None):
+                    self._run_job(job)
+                if on_finish is not None:
+                    try:
+                        on_finish(job)
+                    except EnvironmentError:
+                        job.status = FAILED
+            except Exception:
+                # A bug, not a failed job: stop everything, and let run()
+                # raise it, rather than leave it waiting on a dead worker.
+                job.status = FAILED
+                with self._lock:
+                    if self._failure is None:
+                        self._failure = sys.exc_info()
+                self.cancel()
+                return
+
+    def _run_job(self, job):
+        import subprocess
+        start = time.time()
+        try:
+            process = subprocess.Popen(job.args)
+        except (OSError, TypeError, ValueError):
+            # Most likely, the executable is not installed, or an argument
+            # could not be passed to it. Either way, the worker carries on.
+            job.elapsed = time.time() - start
+            job.status = FAILED
+            return
+
+        with self._lock:
+            self._running.add(process)
+            # Ctrl-C may have arrived before we registered the process.
+            if self._cancelled.is_set():
+                _kill(process)
+
+        deadline = start + self.timeout if self.timeout else None
+        timed_out = False
+        # Poll quickly at first, so that short jobs are not held up, then
+        # back off to POLL_INTERVAL.
+        delay = 0.001
+        while process.poll() is None:
+            if deadline is not None and time.time() > deadline:
+                _kill(process)
+                timed_out = True
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_INTERVAL)
+
+        with self._lock:
+            self._running.discard(process)
+
+        job.elapsed = time.time() - start
+        job.returncode = process.returncode
+        if timed_out:
+            job.status = TIMEOUT
+        elif self._cancelled.is_set():
+            job.status = CANCELLED
+        elif process.returncode == 0:
+            job.status = OK
+        else:
+            job.status = FAILED
+
+
+def format_summary(jobs):
+    """
+    Returns a human-readable report with one line per job, and the totals.
+
+    >>> ok, bad = Job('lerch2013', []), Job('alipour2013', [])
+    >>> ok.status, ok.returncode, ok.elapsed = 'ok', 0, 1.5
+    >>> bad.status, bad.returncode, bad.elapsed = 'failed', 1, 0.3
+    >>> print(format_summary([ok, bad]))
+    ok         lerch2013 (exit status 0, 1.5s)
+    failed     alipour2013 (exit status 1, 0.3s)
+    2 jobs: 1 ok, 1 failed
+    """
+    lines = []
+    for job in jobs:
+        if job.returncode is None:
+            lines.append('{:<10} {}'.format(job.status, job.name))
+        else:
+            lines.append('{:<10} {} (exit status {}, {:.1f}s)'.format(
+                job.status, job.name, job.returncode, job.elapsed))
+
+    totals = [(status, sum(1 for job in jobs if job.status == status))
+              for status in (OK, FAILED, TIMEOUT, CANCELLED)]
+    lines.append('{} jobs: {}'.format(len(jobs), ', '.join(
+        '{} {}'.format(count, status) for status, count in totals if count
+    ) or 'nothing to do'))
+    return '\n'.join(lines)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except OSError:
+        # It already exited.
+        pass
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Converts long PDFs a range of pages at a time, in several k2pdfopt
+processes at once, then merges the ranges with qpdf. Without qpdf, PDFs are
+converted whole, as before.
+"""
+
+import threading
+
+from .profiling import span
+from .scheduler import OK
+
+__all__ = ['SplitConversion', 'find_qpdf', 'merge', 'page_count',
+           'page_ranges', 'DEFAULT_SPLIT_PAGES']
+
+# PDFs longer than this are converted this many pages at a time.
+DEFAULT_SPLIT_PAGES = 100
+
+# qpdf exits with 3 when it succeeded, but had something to warn about.
+QPDF_WARNINGS = 3
+
+
+def find_qpdf(executable='qpdf'):
+    """
+    Returns the path of qpdf, or None if it is not installed. Looked up once
+    per run, rather than once per PDF.
+    """
+    from distutils.spawn import find_executable
+    return find_executable(executable)
+
+
+def page_count(filename, executable='qpdf'):
+    """
+    Returns how many pages filename has, or None if qpdf is not installed
+    or cannot read it.
+    """
+    import subprocess
+    with span('qpdf.pages'):
+        try:
+            process = subprocess.Popen([executable, '--show-npages',
+                                        filename],
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+        except OSError:
+            return None
+        output, _ = process.communicate()
+    if process.returncode not in (0, QPDF_WARNINGS):
+        return None
+    try:
+        return int(output)
+    except ValueError:
+        return None
+
+
+def page_ranges(pages, max_pages):
+    """
+    Splits pages 1 to pages into as few ranges of at most max_pages as
+    possible, all about as long, as k2pdfopt's -p option takes them.
+
+    >>> page_ranges(400, 100)
+    ['1-100', '101-200', '201-300', '301-400']
+    >>> page_ranges(250, 100)
+    ['1-83', '84-166', '167-250']
+    >>> page_ranges(80, 100)
+    ['1-80']
+    """
+    count = -(-pages // max_pages)
+    bounds = [pages * index // count for index in range(count + 1)]
+    return ['{}-{}'.format(first + 1, last)
+            for first, last in zip(bounds, bounds[1:])]
+
+
+def merge(parts, destination, executable='qpdf'):
+    """
+    Concatenates the PDFs in parts as destination, keeping the document
+    information (e.g., title and author) of the first. Raises OSError if
+    qpdf fails.
+    """
+    import subprocess
+    args = [executable, parts[0], '--pages'] + list(parts) + ['--',
+                                                               destination]
+    with span('qpdf.merge', parts=len(parts)):
+        returncode = subprocess.call(args)
+    if returncode not in (0, QPDF_WARNINGS):
+        raise OSError('qpdf exited with status {}'.format(returncode))
+
+
+class SplitConversion(object):
+    """
+    The page ranges of one conversion, each converted by its own job to its
+    own part, which are merged once every job has finished.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.status = OK
+        self._pending = len(parts)
+        self._lock = threading.Lock()
+
+    def finish(self, job):
+        """
+        Records that the job converting one part has finished. Returns the
+        status of the whole conversion once the last part has finished, and
+        None before then.
+        """
+        with self._lock:
+            if self.status == OK:
+                self.status = job.status
+            self._pending -= 1
+            if self._pending:
+                return None
+        return self.status
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+
+import pytest
+
+from ..atomic_file import atomic_output
+
+
+def write(filename, contents):
+    with open(filename, 'wb') as output_file:
+        output_file.write(contents)
+
+
+def test_identical_contents_are_left_alone(tmpdir):
+    destination = str(tmpdir.join('bibliography.bib'))
+    write(destination, b'@book{a}')
+    os.utime(destination, (1000000000, 1000000000))
+
+    with atomic_output(destination, skip_identical=True) as temporary:
+        write(temporary, b'@book{a}')
+
+    assert os.stat(destination).st_mtime == 1000000000
+    assert os.listdir(str(tmpdir)) == ['bibliography.bib']
+
+
+def test_changed_contents_are_replaced(tmpdir):
+    destination = str(tmpdir.join('bibliography.bib'))
+    write(destination, b'@book{a}')
+    os.chmod(destination, 0o644)
+
+    with atomic_output(destination, skip_identical=True) as temporary:
+        write(temporary, b'@book{b}')
+
+    assert open(destination, 'rb').read() == b'@book{b}'
+    assert os.stat(destination).st_mode & 0o777 == 0o644
+
+
+def test_failure_keeps_original(tmpdir):
+    destination = str(tmpdir.join('bibliography.bib'))
+    write(destination, b'@book{a}')
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(destination) as temporary:
+            write(temporary, b'@bo')
+            raise RuntimeError('Zotero went away')
+
+    assert open(destination, 'rb').read() == b'@book{a}'
+    assert os.listdir(str(tmpdir)) == ['bibliography.bib']
+
+
+def test_new_files_leave_the_umask_alone(tmpdir, monkeypatch):
+    umask = os.umask(0o022)
+    os.umask(umask)
+
+    def umask_changed(mask):
+        raise AssertionError('another thread may be creating files')
+    monkeypatch.setattr(os, 'umask', umask_changed)
+
+    destination = str(tmpdir.join('bibliography.bib'))
+    with atomic_output(destination) as temporary:
+        write(temporary, b'@book{a}')
+
+    assert os.stat(destination).st_mode & 0o777 == 0o666 & ~umask
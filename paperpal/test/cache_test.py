@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import sqlite3
+
+from ..cache import EntryCache, ListingCache
+
+
+def paper(cite_key):
+    return dict(authors=[{'first': 'A.', 'last': 'Author'}],
+                title='Title of ' + cite_key,
+                cite_key=cite_key,
+                pdf_filename='/storage/' + cite_key + '.pdf')
+
+
+def test_persists(tmpdir):
+    filename = str(tmpdir.join('listings.sqlite3'))
+    ListingCache(filename).put('Thesis', 'v1', [paper('a'), paper('b')])
+
+    papers = ListingCache(filename).get('Thesis', 'v1')
+
+    assert [p['cite_key'] for p in papers] == ['a', 'b']
+
+
+def test_replaces_stale_listing():
+    cache = ListingCache(':memory:')
+    cache.put('Thesis', 'v1', [paper('a')])
+    cache.put('Thesis', 'v2', [paper('b')])
+
+    assert cache.get('Thesis', 'v1') is None
+    assert cache.get('Thesis', 'v2') == [paper('b')]
+
+
+def test_backends_keep_their_own_listings():
+    cache = ListingCache(':memory:')
+    cache.put('Thesis', 'v1', [paper('a')], backend='zotero')
+    cache.put('Thesis', 'v1', [paper('b')], backend='sqlite')
+
+    assert cache.get('Thesis', 'v1', backend='zotero') == [paper('a')]
+    assert cache.get('Thesis', 'v1', backend='sqlite') == [paper('b')]
+
+
+def test_evicts_least_recently_used():
+    cache = ListingCache(':memory:', max_bytes=150)
+    cache.put('Old', 'v1', [paper('old')])
+    cache.put('Recent', 'v1', [paper('recent')])
+    cache.get('Old', 'v1')
+    cache.put('New', 'v1', [paper('new')])
+
+    assert cache.get('Recent', 'v1') is None
+    assert cache.get('Old', 'v1') is not None
+    assert cache.get('New', 'v1') is not None
+
+
+def test_streams_into_cache():
+    cache = ListingCache(':memory:')
+
+    papers = cache.iter_fetch('Thesis', 'v1',
+                              lambda: iter([paper('a'), paper('b')]))
+
+    assert next(papers)['cite_key'] == 'a'
+    assert cache.get('Thesis', 'v1') is None
+    assert [p['cite_key'] for p in papers] == ['b']
+    assert cache.get('Thesis', 'v1') == [paper('a'), paper('b')]
+
+
+def test_interrupted_listing_is_not_cached():
+    cache = ListingCache(':memory:')
+    cache.put('Thesis', 'v1', [paper('a')])
+
+    papers = cache.iter_fetch('Thesis', 'v2',
+                              lambda: iter([paper('b'), paper('c')]))
+    next(papers)
+    papers.close()
+
+    assert cache.get('Thesis', 'v2') is None
+    assert cache.get('Thesis', 'v1') == [paper('a')]
+
+
+def test_locked_cache_is_a_miss(tmpdir):
+    filename = str(tmpdir.join('listings.sqlite3'))
+    cache = ListingCache(filename, timeout=0.05)
+    cache.put('Thesis', 'v1', [paper('a')])
+
+    # Another process is writing to the cache.
+    other = sqlite3.connect(filename)
+    other.execute('BEGIN EXCLUSIVE')
+    papers = cache.iter_fetch('Thesis', 'v1', lambda: iter([paper('b')]))
+    assert [p['cite_key'] for p in papers] == ['b']
+    other.rollback()
+
+    assert cache.get('Thesis', 'v1') == [paper('a')]
+
+
+def test_entry_cache_evicts_least_recently_used():
+    cache = EntryCache(':memory:', max_bytes=60)
+    cache.put_many([('old', 'x' * 20)])
+    cache.put_many([('recent', 'x' * 20)])
+    cache.get_many(['old'])
+    cache.put_many([('new', 'x' * 20)])
+
+    assert sorted(cache.get_many(['old', 'recent', 'new'])) == ['new', 'old']
+
+
+def test_entry_cache_counts_replaced_values_once():
+    cache = EntryCache(':memory:')
+    cache.put_many([('old', 'x' * 20), ('new', 'x' * 20)])
+    size = cache.size
+    for _ in range(5):
+        cache.put_many([('new', 'x' * 20)])
+
+    assert cache.size == size
+
+
+def test_entry_cache_size_is_kept_without_adding_it_up(tmpdir):
+    filename = str(tmpdir.join('entries.sqlite3'))
+    cache = EntryCache(filename, max_bytes=100)
+    cache.put_many([('a', 'x' * 10), ('b', 'x' * 10), ('a', 'x' * 30)])
+    cache.put_many([('b', 'x' * 5), ('c', 'x' * 20)])
+    cache.put_many([('d', 'x' * 40)])
+
+    # What a new cache adds up from what is stored.
+    assert cache.size == EntryCache(filename).size <= 100
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Fixtures for talking to a fake Zotero. A test module may override library
+(the items served) or storage (the directory holding their PDFs).
+"""
+
+import pytest
+
+from ..zotero import Zotero
+from .fake_mozrepl import FakeMozrepl
+from .fixtures import synthetic_library
+
+
+@pytest.fixture
+def library():
+    return synthetic_library(3, collection='Thesis')
+
+
+@pytest.fixture
+def storage(tmpdir_factory):
+    # Apart from tmpdir, whose contents some tests check.
+    return tmpdir_factory.mktemp('storage')
+
+
+@pytest.fixture
+def server(library, storage):
+    """
+    A FakeMozrepl serving library, closed after the test.
+    """
+    with FakeMozrepl(library, pdf_directory=str(storage)) as server:
+        yield server
+
+
+@pytest.fixture
+def zotero(server):
+    """
+    A Zotero session connected to server, closed after the test.
+    """
+    zotero = Zotero(repl=server.connect())
+    yield zotero
+    zotero.close()
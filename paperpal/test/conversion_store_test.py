@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+
+import pytest
+
+from .. import __main__
+from ..conversion_store import ConversionStore
+from .fixtures import make_fake_k2pdfopt, synthetic_library
+
+
+@pytest.fixture
+def library():
+    return synthetic_library(1, collection='Thesis')
+
+
+def convert(directory, name, size):
+    output = str(directory.join(name + '.pdf'))
+    with open(output, 'wb') as output_file:
+        output_file.write(b'x' * size)
+    return output
+
+
+def test_evicts_least_recently_used(tmpdir):
+    store = ConversionStore(str(tmpdir.join('store')), max_bytes=250)
+    store.add('old', convert(tmpdir, 'old', 100))
+    store.add('recent', convert(tmpdir, 'recent', 100))
+    assert store.fetch('old', str(tmpdir.join('reader-old.pdf')))
+    store.add('new', convert(tmpdir, 'new', 100))
+
+    destination = str(tmpdir.join('reader.pdf'))
+    assert not store.fetch('recent', destination)
+    assert store.fetch('old', destination)
+    assert store.fetch('new', destination)
+
+
+def test_missing_file_is_a_miss(tmpdir):
+    store = ConversionStore(str(tmpdir.join('store')))
+    store.add('lerch2013', convert(tmpdir, 'lerch2013', 10))
+    os.remove(store._path('lerch2013'))
+
+    assert not store.fetch('lerch2013', str(tmpdir.join('reader.pdf')))
+    assert not os.path.exists(str(tmpdir.join('reader.pdf')))
+
+
+def test_readers_get_their_own_copies(tmpdir):
+    store = ConversionStore(str(tmpdir.join('store')))
+    store.add('lerch2013', convert(tmpdir, 'lerch2013', 10))
+    # Left over from an older paperpal that was interrupted.
+    tmpdir.join('kindle.pdf.paperpal-link').write('stale')
+
+    assert store.fetch('lerch2013', str(tmpdir.join('kindle.pdf')))
+    assert store.fetch('lerch2013', str(tmpdir.join('kobo.pdf')))
+    tmpdir.join('kindle.pdf').write('annotated', mode='a')
+    assert tmpdir.join('kobo.pdf').read() == 'x' * 10
+    assert open(store._path('lerch2013')).read() == 'x' * 10
+
+
+def test_linking_out_of_the_store(tmpdir):
+    store = ConversionStore(str(tmpdir.join('store')), link=True)
+    store.add('lerch2013', convert(tmpdir, 'lerch2013', 10))
+
+    assert store.fetch('lerch2013', str(tmpdir.join('kindle.pdf')))
+    assert os.path.samefile(str(tmpdir.join('kindle.pdf')),
+                            store._path('lerch2013'))
+
+
+def test_without_a_store_k2pdfopt_is_not_asked_its_version(tmpdir,
+                                                           monkeypatch,
+                                                           library, storage,
+                                                           zotero):
+    make_fake_k2pdfopt(str(tmpdir.mkdir('bin')))
+    monkeypatch.setenv('PATH', str(tmpdir.join('bin')) + os.pathsep +
+                       os.environ['PATH'])
+    monkeypatch.setattr(__main__, 'k2pdfopt_version', None)
+    storage.join(library['Thesis'][0]['pdf']).write('%PDF-1.4')
+
+    assert __main__.to_ebook('Thesis', str(tmpdir.mkdir('ebook')),
+                             zotero=zotero, store=None) == 0
+
+    assert tmpdir.join('ebook', 'paper0.pdf').read() == '%PDF-1.4'
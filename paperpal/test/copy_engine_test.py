@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import errno
+import os
+
+import pytest
+
+from .. import copy_engine
+from ..copy_engine import Copy, CopyEngine
+
+
+def write(filename, contents):
+    with open(filename, 'wb') as output_file:
+        output_file.write(contents)
+
+
+def test_unsupported_clones_fall_back_to_copying(tmpdir, monkeypatch):
+    def unsupported(source, destination):
+        attempts.append(destination)
+        raise IOError(errno.EOPNOTSUPP, 'Operation not supported')
+    attempts = []
+    monkeypatch.setitem(copy_engine.METHODS, 'reflink', unsupported)
+
+    copies = []
+    for index in range(10):
+        source = str(tmpdir.join('paper{}.pdf'.format(index)))
+        write(source, b'%PDF-1.4 ' + str(index))
+        destination = str(tmpdir.join('copy{}.pdf'.format(index)))
+        copies.append(Copy(source, destination, name=index))
+    copies = CopyEngine('auto', threads=3).run(iter(copies))
+
+    assert [copy.method for copy in copies] == ['copy'] * 10
+    assert open(copies[7].destination, 'rb').read() == b'%PDF-1.4 7'
+    # The file system is only probed until it is known not to clone.
+    assert len(attempts) <= 3
+    assert not [name for name in os.listdir(str(tmpdir))
+                if name.endswith('.tmp')]
+
+
+def test_failed_copy_leaves_old_destination(tmpdir, monkeypatch):
+    def full(input_file, output_file):
+        raise IOError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(copy_engine, '_copy_contents', full)
+
+    source = str(tmpdir.join('paper.pdf'))
+    destination = str(tmpdir.join('lerch2013.pdf'))
+    write(source, b'%PDF-1.4 new')
+    write(destination, b'%PDF-1.4 old')
+
+    copy, = CopyEngine('auto').run([Copy(source, destination)])
+    assert copy.method is None
+    assert copy.error.errno == errno.ENOSPC
+    assert open(destination, 'rb').read() == b'%PDF-1.4 old'
+    assert sorted(os.listdir(str(tmpdir))) == ['lerch2013.pdf', 'paper.pdf']
+
+
+def test_explicit_links_do_not_fall_back(tmpdir, monkeypatch):
+    def cross_device(source, destination):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setattr(os, 'link', cross_device)
+
+    source = str(tmpdir.join('paper.pdf'))
+    write(source, b'%PDF-1.4')
+    copies = [Copy(source, str(tmpdir.join('copy{}.pdf'.format(index))))
+              for index in range(3)]
+    copies = CopyEngine('hard').run(copies)
+
+    assert [copy.method for copy in copies] == [None] * 3
+    assert [copy.error.errno for copy in copies] == [errno.EXDEV] * 3
+    assert sorted(os.listdir(str(tmpdir))) == ['paper.pdf']
+
+
+def test_unexpected_error_is_raised(tmpdir, monkeypatch):
+    def broken(source, destination):
+        raise TypeError('a bug')
+    monkeypatch.setitem(copy_engine.METHODS, 'copy', broken)
+
+    source = str(tmpdir.join('paper.pdf'))
+    write(source, b'%PDF-1.4')
+    copies = (Copy(source, str(tmpdir.join('copy{}.pdf'.format(index))))
+              for index in range(50))
+    with pytest.raises(TypeError):
+        CopyEngine('copy', threads=2).run(copies)
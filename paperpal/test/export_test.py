@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+from ..__main__ import export_bibliographies, read_exports
+
+
+def test_batch_exports_in_one_call(tmpdir, server, zotero):
+    tmpdir.join('exports.txt').write(
+        '# Venue\n'
+        'Thesis:bibtex:thesis.bib\n'
+        '\n'
+        'Thesis:better-biblatex:out/thesis-biblatex.bib\n'
+        'Missing:bibtex:missing.bib\n')
+    tmpdir.mkdir('out')
+    exports = read_exports(str(tmpdir.join('exports.txt')))
+
+    status = export_bibliographies(exports, zotero=zotero)
+
+    assert status == 1
+    assert server.calls.count('exportBibliographies') == 1
+    assert 'exportBibliography' not in server.calls
+    # One failure does not stop the others; it leaves nothing behind.
+    assert '@inproceedings{paper2' in tmpdir.join('thesis.bib').read()
+    assert tmpdir.join('out', 'thesis-biblatex.bib').check()
+    assert sorted(tmpdir.listdir(lambda path: path.basename != 'out')) == [
+        tmpdir.join('exports.txt'), tmpdir.join('thesis.bib')]
+
+
+def test_unwritable_destination_fails_alone(tmpdir, zotero):
+    exports = [('Thesis', 'bibtex', str(tmpdir.join('a.bib'))),
+               ('Thesis', 'bibtex', str(tmpdir.join('nodir', 'b.bib'))),
+               ('Thesis', 'biblatex', str(tmpdir.join('c.bib')))]
+
+    status = export_bibliographies(exports, zotero=zotero)
+
+    assert status == 1
+    assert sorted(path.basename for path in tmpdir.listdir()) == [
+        'a.bib', 'c.bib']
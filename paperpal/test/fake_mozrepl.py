@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+A stand-in for Zotero's MozRepl that speaks just enough of the protocol for
+the mozrepl package and answers the actions of zotero-bridge.js from a
+synthetic library (see fixtures.synthetic_library()).
+
+    >>> from .fixtures import synthetic_library
+    >>> from ..zotero import Zotero
+    >>> with FakeMozrepl(synthetic_library(3)) as server:
+    ...     zotero = Zotero(repl=server.connect())
+    ...     [paper['cite_key'] for paper in zotero.list_papers('Synthetic')]
+    [u'paper0', u'paper1', u'paper2']
+"""
+
+import base64
+import codecs
+import hashlib
+import json
+import os
+import re
+import SocketServer
+import threading
+import urllib
+import urlparse
+
+import mozrepl
+
+from .fixtures import synthetic_entry
+
+__all__ = ['FakeMozrepl']
+
+PROMPT = 'repl> '
+
+# Every command the mozrepl package sends ends with its exception handler.
+END_OF_COMMAND = 'return buffer; }()) };'
+
+INSTALLED_VERSION = re.compile(r'\*/ "([0-9a-f]+)" /\* \*/\)\);')
+CALL = re.compile(r'bridge\.version !== "([0-9a-f]+)".*'
+                  r'bridge\.call\(("[^"]*"), (.*)\);\n\}\(Components',
+                  re.DOTALL)
+SUBSCRIPT = re.compile(r'loadSubScript\("([^"]+)"')
+
+
+def item_id(n, item):
+    """
+    Returns the ID of the nth item of a collection: its 'id', if it has one,
+    or else its position from 1.
+    """
+    return item.get('id', n + 1)
+
+
+class FakeMozrepl(object):
+    """
+    Serves a library on a local port until closed.
+
+    library is a dict of collection name to items (with title, authors,
+    cite_key and pdf); PDFs are reported as files in pdf_directory.
+    """
+
+    def __init__(self, library, pdf_directory='/nonexistent'):
+        self.library = library
+        self.pdf_directory = pdf_directory
+        self.installed_version = None
+        self.calls = []
+        self.exported_items = []
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                fake._handle(self.request)
+
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def connect(self):
+        return mozrepl.Mozrepl(port=self.port)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _handle(self, connection):
+        connection.sendall(PROMPT)
+        command = ''
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                return
+            command += data
+            if not command.rstrip().endswith(END_OF_COMMAND):
+                continue
+
+            response = self._evaluate(command)
+            command = ''
+            if response is None:
+                connection.sendall(PROMPT)
+            else:
+                connection.sendall('"{}"\n{}'.format(
+                    base64.b64encode(json.dumps(response)), PROMPT))
+
+    def _evaluate(self, command):
+        """
+        Returns what the mozrepl package expects for a command: None for its
+        own housekeeping, or the typed result of a script.
+        """
+        match = SUBSCRIPT.search(command)
+        if match is None:
+            return None
+
+        path = urllib.url2pathname(urlparse.urlparse(match.group(1)).path)
+        with codecs.open(path, encoding='UTF-8') as script:
+            code = script.read()
+
+        with self._lock:
+            return {'type': 'string', 'value': self._run(code)}
+
+    def _run(self, code):
+        if 'Zotero.paperpalBridge = {' in code:
+            self.installed_version = INSTALLED_VERSION.search(code).group(1)
+            return self.installed_version
+
+        version, action, options = CALL.search(code).groups()
+        if version != self.installed_version:
+            return json.dumps(['not_installed', None])
+
+        action = json.loads(action)
+        options = json.loads(options)
+        self.calls.append(action)
+        handler = getattr(self, '_action_' + action, None)
+        if handler is None:
+            return json.dumps(['error', ['unknown_action', action]])
+        return json.dumps(handler(options))
+
+    def _items(self, options):
+        return self.library.get(options['collection'])
+
+    def _action_collections(self, options):
+        return ['ok', [{'path': [name], 'items': len(items)}
+                       for name, items in sorted(self.library.items())]]
+
+    def _action_version(self, options):
+        items = self._items(options)
+        if items is None:
+            return ['error', ['unknown_collection', options['collection']]]
+        return ['ok', '{}:{}'.format(len(items), id(items))]
+
+    def _action_list(self, options):
+        items = self._items(options)
+        if items is None:
+            return ['error', ['unknown_collection', options['collection']]]
+
+        start = int(options['cursor'] or 0)
+        end = start + (options['limit'] or len(items))
+        page = [dict(authors=item['authors'], title=item['title'],
+                     cite_key=item['cite_key'],
+                     pdf_filename=self._pdf_url(item['pdf']))
+                for item in items[start:end]]
+        return ['ok', {'items': page,
+                       'cursor': str(end) if end < len(items) else None,
+                       'timings': {'total': 0}}]
+
+    def _action_exportBibliography(self, options):
+        items = self._items(options)
+        if items is None:
+            return ['error', ['unknown_collection', options['collection']]]
+
+        with codecs.open(options['filename'], 'w',
+                         encoding='UTF-8') as bibliography:
+            for n, item in enumerate(items):
+                bibliography.write(self._entry(item_id(n, item), item))
+        return ['ok', options['filename']]
+
+    def _action_itemVersions(self, options):
+        items = self._items(options)
+        if items is None:
+            return ['error', ['unknown_collection', options['collection']]]
+        # An item's version is a digest of everything about it. Like
+        # Zotero, list them by ID, not in the order they are exported.
+        return ['ok', sorted([item_id(n, item),
+                              hashlib.sha1(json.dumps(item, sort_keys=True))
+                              .hexdigest()]
+                             for n, item in enumerate(items))]
+
+    def _action_exportItems(self, options):
+        self.exported_items.extend(job['item'] for job in options['exports'])
+        by_id = dict((item_id(n, item), item)
+                     for items in self.library.values()
+                     for n, item in enumerate(items))
+        results = []
+        for job in options['exports']:
+            if job['item'] not in by_id:
+                results.append(['unknown_item', job['item']])
+                continue
+            with codecs.open(job['filename'], 'w',
+                             encoding='UTF-8') as bibliography:
+                bibliography.write(self._entry(job['item'],
+                                               by_id[job['item']]))
+            results.append(None)
+        return ['ok', results]
+
+    def _action_exportBibliographies(self, options):
+        results = []
+        for job in options['exports']:
+            status, reason = self._action_exportBibliography(job)
+            results.append(dict(status=status, milliseconds=0,
+                                reason=None if status == 'ok' else reason))
+        return ['ok', results]
+
+    def _entry(self, id, item):
+        return synthetic_entry(id, item['cite_key'] or u'item{}'.format(id),
+                               item['title'],
+                               [(author['first'], author['last'])
+                                for author in item['authors']])
+
+    def _pdf_url(self, pdf):
+        if pdf is None:
+            return None
+        return 'file://' + urllib.pathname2url(
+            os.path.join(self.pdf_directory, pdf.encode('UTF-8')))
+
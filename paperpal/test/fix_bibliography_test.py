@@ -1,9 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import io
+
 import bibtexparser
 
-from ..fix_bibliography import fix_bibliography
+from bibtexparser.bparser import BibTexParser
+from bibtexparser.customization import homogeneize_latex_encoding
+
+from ..cache import EntryCache
+from ..fix_bibliography import (fix_bibliography, fix_bibliography_file,
+                                fix_entry)
 
 
 bad_bib = ur"""
@@ -39,3 +46,61 @@ def test_fix_bibiliography():
     assert entry['author'].startswith(r"Vasi{\' c}"), "Did not handle Unicode escape"
     assert 'url' not in entry, "Did not delete URL"
     assert 'year' in entry and entry['year'] == '2009', "Did not handle year"
+
+
+def reference_fix(bibtex_string):
+    """
+    fix_bibliography() as it was before it was sped up, with bibtexparser's
+    own customization doing the LaTeX encoding.
+    """
+    parser = BibTexParser()
+    parser.customization = homogeneize_latex_encoding
+    bibtex = bibtexparser.loads(bibtex_string, parser=parser)
+    for entry in bibtex.entries:
+        fix_entry(entry)
+    return bibtexparser.dumps(bibtex).encode('UTF-8')
+
+
+def mixed_bibliography():
+    return (u'@comment{Exported by Zotero}\n'
+           u'@string{acm = "{ACM}"}\n' +
+           bad_bib.replace(u'vasic2009', u'zed2009') +
+           u'@preamble{"\\newcommand{\\noop}[1]{}"}\n' +
+           bad_bib +
+           u'@article{Alpha2001,\n  title = {Über Straße},\n'
+           u'  publisher = acm,\n  date = {June 2001}\n}\n' +
+           bad_bib.replace(u'vasic2009', u'middle2012'))
+
+
+def test_fix_bibliography_file_is_identical():
+    bib = mixed_bibliography()
+    expected = reference_fix(bib)
+    assert fix_bibliography(bib) == expected
+
+    for processes in (1, 2):
+        output = io.BytesIO()
+        fix_bibliography_file(io.BytesIO(bib.encode('UTF-8')), output,
+                              processes=processes)
+        assert output.getvalue() == expected
+
+
+def test_fix_bibliography_file_reuses_cached_entries():
+    bib = mixed_bibliography()
+    cache = EntryCache(':memory:')
+
+    def fix(bib):
+        output = io.BytesIO()
+        fix_bibliography_file(io.BytesIO(bib.encode('UTF-8')), output,
+                              cache=cache)
+        return output.getvalue()
+
+    assert fix(bib) == reference_fix(bib)
+    assert cache.stats() == {'hits': 0, 'misses': 7}
+
+    assert fix(bib) == reference_fix(bib)
+    assert cache.stats() == {'hits': 7, 'misses': 7}
+
+    # Only the edited entry is fixed again.
+    edited = bib.replace(u'June 2001', u'June 2002')
+    assert fix(edited) == reference_fix(edited)
+    assert cache.stats() == {'hits': 13, 'misses': 8}
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Builds small (or not so small) stand-ins for Zotero's data.
+"""
+
+import itertools
+import os
+import sqlite3
+import stat
+import sys
+
+# The subset of Zotero 4's schema that paperpal reads.
+ZOTERO_SCHEMA = """
+CREATE TABLE itemTypes (itemTypeID INTEGER PRIMARY KEY, typeName TEXT);
+CREATE TABLE items (
+    itemID INTEGER PRIMARY KEY, itemTypeID INT, dateAdded TEXT,
+    dateModified TEXT, clientDateModified TEXT, libraryID INT, key TEXT
+);
+CREATE TABLE fields (fieldID INTEGER PRIMARY KEY, fieldName TEXT);
+CREATE TABLE itemDataValues (valueID INTEGER PRIMARY KEY, value);
+CREATE TABLE itemData (
+    itemID INT, fieldID INT, valueID INT, PRIMARY KEY (itemID, fieldID)
+);
+CREATE TABLE creatorData (
+    creatorDataID INTEGER PRIMARY KEY, firstName TEXT, lastName TEXT
+);
+CREATE TABLE creators (creatorID INTEGER PRIMARY KEY, creatorDataID INT);
+CREATE TABLE itemCreators (
+    itemID INT, creatorID INT, creatorTypeID INT, orderIndex INT,
+    PRIMARY KEY (itemID, creatorID, creatorTypeID, orderIndex)
+);
+CREATE TABLE collections (
+    collectionID INTEGER PRIMARY KEY, collectionName TEXT,
+    parentCollectionID INT, key TEXT
+);
+CREATE TABLE collectionItems (
+    collectionID INT, itemID INT, orderIndex INT DEFAULT 0,
+    PRIMARY KEY (collectionID, itemID)
+);
+CREATE TABLE itemAttachments (
+    itemID INTEGER PRIMARY KEY, sourceItemID INT, linkMode INT,
+    mimeType TEXT, charsetID INT, path TEXT
+);
+CREATE INDEX itemAttachments_sourceItemID ON itemAttachments(sourceItemID);
+CREATE TABLE deletedItems (itemID INTEGER PRIMARY KEY, dateDeleted TEXT);
+CREATE TABLE baseFieldsMap (
+    itemTypeID INT, baseFieldID INT, fieldID INT,
+    PRIMARY KEY (itemTypeID, baseFieldID, fieldID)
+);
+INSERT INTO itemTypes VALUES (1, 'note'), (2, 'book'), (4, 'journalArticle'),
+                             (7, 'case'), (14, 'attachment');
+INSERT INTO fields VALUES (1, 'title'), (22, 'extra'), (58, 'caseName');
+INSERT INTO baseFieldsMap VALUES (7, 1, 58);
+"""
+
+AUTHORS = [(u'J.', u'Lerch'), (u'M.', u'Mezini'), (u'Nedeljko', u'Vasić'),
+           (u'S.', u'Miyamoto'), (u'K.', u'Kondo')]
+
+
+def synthetic_library(size, collection='Synthetic'):
+    """
+    Returns a library with one collection of `size` regular items, most of
+    which have a cite key and a stored PDF.
+    """
+    items = []
+    for n in range(size):
+        items.append(dict(
+            title=u'Synthetic paper number {}'.format(n),
+            authors=[dict(first=first, last=last)
+                     for first, last in AUTHORS[:1 + n % len(AUTHORS)]],
+            cite_key=None if n % 50 == 7 else u'paper{}'.format(n),
+            pdf=None if n % 20 == 3 else u'Paper {}.pdf'.format(n),
+        ))
+    return {collection: items}
+
+
+TITLES = [u'Making {{Cluster Applications Energy}}-aware',
+          u'Finding Duplicates in {{Crash Reports}}: Über Straße',
+          u'Cost of \\emph{Software} Evolution, 50% Faster',
+          u'Naturalness of Software',
+          u'An {{Empirical Study}} of the {{Reliability}} of {{UNIX}} '
+          u'Utilities']
+
+
+def synthetic_bibliography(size):
+    """
+    Returns a BibLaTeX file (as unicode) of `size` entries resembling what
+    Zotero exports, with accented names, braces and URLs, in no particular
+    order.
+    """
+    return u''.join(
+        synthetic_entry(n, u'paper{}'.format((n * 7919) % size),
+                        TITLES[n % len(TITLES)],
+                        AUTHORS[:1 + n % len(AUTHORS)])
+        for n in range(size)
+    )
+
+
+def synthetic_entry(n, key, title, authors):
+    """
+    Returns the nth entry of a synthetic bibliography, with its key, title
+    and authors (as (first, last) pairs), followed by a blank line.
+    """
+    return (
+        u'@inproceedings{{{key},\n'
+        u'  location = {{{{New York, NY, USA}}}},\n'
+        u'  title = {{{title}}},\n'
+        u'  url = {{http://doi.acm.org/10.1145/{n}}},\n'
+        u'  doi = {{10.1145/{n}}},\n'
+        u'  abstract = {{Power consumption has become a critical issue '
+        u'in large scale clusters, {abstract}.}},\n'
+        u'  booktitle = {{Proceedings of the {{Workshop}} on '
+        u'{{Automated Control}}}},\n'
+        u'  publisher = {{{{ACM}}}},\n'
+        u'  author = {{{authors}}},\n'
+        u'  date = {{{year}-05-20}},\n'
+        u'  pages = {{37--42}}\n'
+        u'}}\n\n'.format(key=key, title=title, n=n,
+                         abstract=TITLES[n % len(TITLES)],
+                         authors=u' and '.join(u'{}, {}'.format(last, first)
+                                               for first, last in authors),
+                         year=1990 + n % 30)
+    )
+
+
+def make_zotero_database(filename, library):
+    """
+    Writes a Zotero 4 database containing the given library: a dict of
+    collection path to a list of dicts with title, authors, cite_key and pdf
+    (the name of a PDF in storage, or None). Optionally, an item may be a
+    'case' (titled by its caseName), be in the trash ('trashed'), or have a
+    PDF in the trash before its own ('trashed_pdf').
+    """
+    connection = sqlite3.connect(filename)
+    connection.executescript(ZOTERO_SCHEMA)
+    ids = itertools.count(1)
+
+    def add_value(item_id, field_id, value):
+        value_id = next(ids)
+        connection.execute('INSERT INTO itemDataValues VALUES (?, ?)',
+                           (value_id, value))
+        connection.execute('INSERT INTO itemData VALUES (?, ?, ?)',
+                           (item_id, field_id, value_id))
+
+    def add_pdf(item_id, pdf):
+        attachment_id = next(ids)
+        connection.execute(
+            'INSERT INTO items VALUES (?, 14, ?, ?, ?, 0, ?)',
+            (attachment_id, '2016-05-20 05:50:14',
+             '2016-05-20 05:50:14', '2016-05-20 05:50:14',
+             'ATCH{:04d}'.format(attachment_id))
+        )
+        connection.execute(
+            'INSERT INTO itemAttachments VALUES (?, ?, 0, ?, NULL, ?)',
+            (attachment_id, item_id, 'application/pdf', u'storage:' + pdf)
+        )
+        return attachment_id
+
+    def trash(item_id):
+        connection.execute('INSERT INTO deletedItems VALUES (?, ?)',
+                           (item_id, '2016-05-21 05:50:14'))
+
+    collection_ids = {}
+
+    def add_collection(path):
+        # Nested collections are written as paths, e.g., "Thesis/Chapter 3".
+        if path not in collection_ids:
+            parent, _, name = path.rpartition(u'/')
+            parent_id = add_collection(parent) if parent else None
+            collection_id = collection_ids[path] = next(ids)
+            connection.execute(
+                'INSERT INTO collections VALUES (?, ?, ?, ?)',
+                (collection_id, name, parent_id,
+                 'COLL{:04d}'.format(collection_id))
+            )
+        return collection_ids[path]
+
+    for path, items in sorted(library.items()):
+        collection_id = add_collection(path)
+        for index, item in enumerate(items):
+            item_id = next(ids)
+            connection.execute(
+                'INSERT INTO items VALUES (?, ?, ?, ?, ?, 0, ?)',
+                (item_id, 7 if item.get('case') else 4,
+                 '2016-05-20 05:50:14', '2016-05-20 05:50:14',
+                 '2016-05-20 05:50:14', 'ITEM{:04d}'.format(item_id))
+            )
+            connection.execute('INSERT INTO collectionItems VALUES (?, ?, ?)',
+                               (collection_id, item_id, index))
+            add_value(item_id, 58 if item.get('case') else 1, item['title'])
+            if item.get('trashed'):
+                trash(item_id)
+            if item.get('cite_key'):
+                add_value(item_id, 22, u'bibtex: ' + item['cite_key'])
+
+            for order, author in enumerate(item['authors']):
+                creator_id = next(ids)
+                connection.execute(
+                    'INSERT INTO creatorData VALUES (?, ?, ?)',
+                    (creator_id, author['first'], author['last'])
+                )
+                connection.execute('INSERT INTO creators VALUES (?, ?)',
+                                   (creator_id, creator_id))
+                connection.execute(
+                    'INSERT INTO itemCreators VALUES (?, ?, 1, ?)',
+                    (item_id, creator_id, order)
+                )
+
+            if item.get('trashed_pdf'):
+                trash(add_pdf(item_id, item['trashed_pdf']))
+            if item.get('pdf'):
+                add_pdf(item_id, item['pdf'])
+
+    connection.commit()
+    connection.close()
+
+
+FAKE_K2PDFOPT = """#!{python}
+# Stands in for k2pdfopt: copies the input PDF to the -o destination,
+# noting the pages it was asked for with -p, if any.
+import shutil
+import sys
+import time
+
+time.sleep({seconds!r})
+arguments = sys.argv[1:]
+destination = arguments[arguments.index('-o') + 1]
+shutil.copyfile(arguments[-1], destination)
+if '-p' in arguments:
+    with open(destination, 'a') as output:
+        output.write(' [p {{}}]'.format(arguments[arguments.index('-p') + 1]))
+"""
+
+FAKE_QPDF = """#!{python}
+# Stands in for qpdf: a PDF has as many pages as it says ("pages=400"),
+# and merging PDFs concatenates them.
+import re
+import sys
+
+arguments = sys.argv[1:]
+if arguments[0] == '--show-npages':
+    match = re.search(r'pages=(\\d+)', open(arguments[1]).read())
+    print(match.group(1) if match else 1)
+    sys.exit(0)
+parts = arguments[arguments.index('--pages') + 1:arguments.index('--')]
+with open(arguments[-1], 'w') as output:
+    for part in parts:
+        output.write(open(part).read())
+"""
+
+
+def make_fake_k2pdfopt(directory, seconds=0):
+    """
+    Writes an executable named k2pdfopt to directory, which takes `seconds`
+    to "convert" a PDF. Put directory first in $PATH to use it.
+    """
+    filename = os.path.join(directory, 'k2pdfopt')
+    with open(filename, 'w') as script:
+        script.write(FAKE_K2PDFOPT.format(python=sys.executable,
+                                          seconds=seconds))
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
+    return filename
+
+
+def make_fake_qpdf(directory):
+    """
+    Writes an executable named qpdf to directory, which counts pages and
+    merges PDFs just well enough for paperpal.split_conversion.
+    """
+    filename = os.path.join(directory, 'qpdf')
+    with open(filename, 'w') as script:
+        script.write(FAKE_QPDF.format(python=sys.executable))
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
+    return filename
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import pytest
+
+from ..__main__ import export_bibliography
+from ..zotero import Zotero
+from .fixtures import synthetic_library
+
+
+@pytest.fixture
+def library():
+    library = synthetic_library(30, collection='Thesis')
+    for n, item in enumerate(library['Thesis']):
+        item['id'] = 100 + n
+    return library
+
+
+def export(zotero, destination, **kwargs):
+    assert export_bibliography('Thesis', str(destination), zotero=zotero,
+                               **kwargs) is None
+    return destination.read()
+
+
+def test_incremental_export_matches_full_export(tmpdir, library, server,
+                                                zotero):
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+    # Each item is exported alone, to tell which entry is whose.
+    assert server.exported_items == range(100, 130)
+    del server.exported_items[:]
+
+    items = library['Thesis']
+    items[4]['title'] = u'Naturalness of Software, Revisited'
+    del items[11]
+    items.append(dict(id=500, title=u'Übersetzung', authors=[],
+                      cite_key=u'new2016', pdf=None))
+
+    incremental = export(zotero, tmpdir.join('thesis.bib'),
+                         incremental=True)
+    assert server.exported_items == [104, 500]
+    assert incremental == export(zotero, tmpdir.join('full.bib'))
+    assert u'Revisited' in incremental.decode('UTF-8')
+    assert 'paper11,' not in incremental
+
+
+def test_full_export_every_so_often(tmpdir, server, zotero):
+    for _ in range(3):
+        export(zotero, tmpdir.join('thesis.bib'), incremental=True,
+               full_every=2)
+    assert server.calls.count('exportBibliography') == 2
+    # Only to tell which entry of each full export is whose.
+    assert server.calls.count('exportItems') == 2
+
+
+def test_duplicate_cite_keys_need_a_full_export(tmpdir, library, server,
+                                                zotero):
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+    del server.exported_items[:]
+
+    library['Thesis'][2]['cite_key'] = u'paper1'
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+    assert server.exported_items[0] == 102
+    assert server.calls.count('exportBibliography') == 2
+
+
+def test_deleting_what_a_key_was_disambiguated_from(tmpdir, library, server,
+                                                    zotero):
+    library['Thesis'][3]['cite_key'] = u'paper2a'
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+
+    del library['Thesis'][2]
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+    assert server.calls.count('exportBibliography') == 2
+
+
+def test_item_deleted_while_exporting(tmpdir, library, monkeypatch, server,
+                                      zotero):
+    item_versions = Zotero.item_versions
+
+    def item_versions_then_delete(zotero, collection):
+        versions = item_versions(zotero, collection)
+        # Someone deletes an item just after its version was taken.
+        del library['Thesis'][6]
+        return versions
+
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+    del server.exported_items[:]
+
+    library['Thesis'][5]['title'] = u'Edited'
+    library['Thesis'][6]['title'] = u'Edited, then deleted'
+    monkeypatch.setattr(Zotero, 'item_versions',
+                        item_versions_then_delete)
+    incremental = export(zotero, tmpdir.join('thesis.bib'),
+                         incremental=True)
+    monkeypatch.undo()
+
+    assert server.exported_items == [105, 106]
+    assert incremental == export(zotero, tmpdir.join('full.bib'))
+    assert 'paper6,' not in incremental
+
+
+def test_exported_in_another_order_than_listed(tmpdir, library, server,
+                                               zotero):
+    library['Thesis'].reverse()
+    export(zotero, tmpdir.join('thesis.bib'), incremental=True)
+    assert not tmpdir.join('.thesis.bib.paperpal-checkpoint.json').check()
+
+    # Had entries been matched with items by position, this would
+    # splice the edited entry in place of another.
+    library['Thesis'][4]['title'] = u'Edited'
+    incremental = export(zotero, tmpdir.join('thesis.bib'),
+                         incremental=True)
+    assert server.calls.count('exportBibliography') == 2
+    assert incremental == export(zotero, tmpdir.join('full.bib'))
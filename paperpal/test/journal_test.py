@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+import stat
+import sys
+
+import pytest
+
+from ..__main__ import to_ebook
+from ..journal import JOURNAL_NAME, Journal
+
+# Like fixtures.FAKE_K2PDFOPT, but logs each conversion, and dies halfway
+# through writing PDFs that say they are broken.
+FLAKY_K2PDFOPT = """#!{python}
+import sys
+
+arguments = sys.argv[1:]
+if '-o' not in arguments:
+    sys.exit(1)
+with open({log!r}, 'a') as log:
+    log.write(arguments[-1] + '\\n')
+pdf = open(arguments[-1], 'rb').read()
+with open(arguments[arguments.index('-o') + 1], 'wb') as output:
+    output.write(pdf[:4])
+    if 'broken' in pdf:
+        sys.exit(1)
+    output.write(pdf[4:])
+"""
+
+
+@pytest.fixture
+def flaky_k2pdfopt(tmpdir, monkeypatch):
+    bin_directory = tmpdir.mkdir('bin')
+    filename = str(bin_directory.join('k2pdfopt'))
+    log = tmpdir.join('conversions.log')
+    with open(filename, 'w') as script:
+        script.write(FLAKY_K2PDFOPT.format(python=sys.executable,
+                                           log=str(log)))
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', str(bin_directory) + os.pathsep +
+                       os.environ['PATH'])
+    log.write('')
+    return log
+
+
+def test_torn_lines_are_ignored(tmpdir):
+    journal = Journal(str(tmpdir))
+    journal.record('lerch2013', 'ok', {'sha1': '4cd4be8e'})
+    journal.record('alipour2013', 'timeout')
+    journal.record('alipour2013', 'failed')
+    journal.close()
+    tmpdir.join(JOURNAL_NAME).write('{"cite_key": "camp', mode='a')
+
+    journal = Journal(str(tmpdir), resume=True)
+
+    assert journal.completed == {'lerch2013': {'sha1': '4cd4be8e'}}
+    assert journal.failures == {'alipour2013': 2}
+
+
+def test_failed_conversions_leave_nothing_and_resume(tmpdir, flaky_k2pdfopt,
+                                                     library, storage,
+                                                     zotero):
+    broken = library['Thesis'][1]
+    for item in library['Thesis']:
+        if item['pdf'] is not None:
+            content = '%PDF-1.4 broken' if item is broken else '%PDF-1.4'
+            storage.join(item['pdf']).write(content)
+    output = tmpdir.mkdir('ebook')
+
+    assert to_ebook('Thesis', str(output), zotero=zotero, jobs=1) == 1
+
+    # Nothing half-written is left to be mistaken for a conversion.
+    assert sorted(output.listdir(lambda path: path.ext == '.pdf')) == [
+        output.join(item['cite_key'] + '.pdf')
+        for item in sorted(library['Thesis'],
+                           key=lambda item: item['cite_key'])
+        if item['pdf'] is not None and item is not broken]
+    assert output.join(JOURNAL_NAME).check()
+
+    storage.join(broken['pdf']).write('%PDF-1.4 fixed')
+    flaky_k2pdfopt.write('')
+    assert to_ebook('Thesis', str(output), zotero=zotero, jobs=1,
+                    resume=True) == 0
+
+    # Only the failed conversion ran again.
+    assert flaky_k2pdfopt.read().splitlines() == [
+        str(storage.join(broken['pdf']))]
+    assert output.join(broken['cite_key'] + '.pdf').read() == '%PDF-1.4 fixed'
+    assert not output.join(JOURNAL_NAME).check()
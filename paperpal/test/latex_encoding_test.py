@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import copy
+
+import pytest
+
+from bibtexparser.customization import homogeneize_latex_encoding
+
+from ..latex_encoding import homogenise_latex_encoding
+
+
+@pytest.mark.parametrize('value', [
+    u'Plain ASCII title',
+    u'Vasić, Nedeljko and Kostić, Dejan',
+    u"Vasi\\'{c}, Nedeljko and Vasi\\'c, N.",
+    u'{{Crash Reports}}: Über Straße — 50% & more',
+    # Decodes to a backslash, which then starts another sequence.
+    u'\\textbackslash \\#{Vasi\\textbackslash \'{c}}',
+    u'\\lbrace \\`e\\rbrace \\c{c} rock \'n roll',
+    u'{}\\',
+])
+def test_same_as_bibtexparser(value):
+    record = {'ID': u'key2009', 'ENTRYTYPE': u'article',
+              'title': value, 'author': value}
+
+    expected = homogeneize_latex_encoding(copy.deepcopy(record))
+    assert homogenise_latex_encoding(copy.deepcopy(record)) == expected
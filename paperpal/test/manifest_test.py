@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+
+from .. import manifest as manifest_module
+from ..manifest import Manifest
+
+
+def write(filename, contents):
+    with open(filename, 'wb') as output_file:
+        output_file.write(contents)
+
+
+def make(manifest, cite_key, source, output, args=('copy',)):
+    """
+    Makes the output if the manifest says it is stale; returns whether it did.
+    """
+    if not manifest.is_stale(cite_key, source, output, args):
+        return False
+    write(output, open(source, 'rb').read())
+    manifest.commit(cite_key)
+    return True
+
+
+def test_touched_source_is_hashed_not_copied(tmpdir):
+    source = str(tmpdir.join('Lerch 2013.pdf'))
+    output = str(tmpdir.mkdir('out').join('lerch2013.pdf'))
+    write(source, b'%PDF-1.4 crash reports')
+
+    manifest = Manifest(str(tmpdir.join('out')))
+    assert make(manifest, 'lerch2013', source, output)
+    manifest.save()
+
+    # Zotero sync touches the file without changing it...
+    os.utime(source, (2000000000, 2000000000))
+    manifest = Manifest(str(tmpdir.join('out')))
+    assert not make(manifest, 'lerch2013', source, output)
+
+    # ...and later changes it for real.
+    write(source, b'%PDF-1.4 crash REPORTS')
+    assert make(manifest, 'lerch2013', source, output)
+
+
+def test_copies_are_compared_not_hashed(tmpdir, monkeypatch):
+    def no_hashing(filename):
+        raise AssertionError('hashed ' + filename)
+    monkeypatch.setattr(manifest_module, 'file_digest', no_hashing)
+    source = str(tmpdir.join('Lerch 2013.pdf'))
+    output = str(tmpdir.mkdir('out').join('lerch2013.pdf'))
+    write(source, b'%PDF-1.4 crash reports')
+
+    manifest = Manifest(str(tmpdir.join('out')), copies=True)
+    assert make(manifest, 'lerch2013', source, output)
+    manifest.save()
+
+    os.utime(source, (2000000000, 2000000000))
+    manifest = Manifest(str(tmpdir.join('out')), copies=True)
+    assert not make(manifest, 'lerch2013', source, output)
+
+    write(source, b'%PDF-1.4 crash REPORTS')
+    assert make(manifest, 'lerch2013', source, output)
+    assert open(output, 'rb').read() == b'%PDF-1.4 crash REPORTS'
+
+
+def test_changed_arguments_make_the_output_again(tmpdir):
+    source = str(tmpdir.join('Lerch 2013.pdf'))
+    output = str(tmpdir.join('lerch2013.pdf'))
+    write(source, b'%PDF-1.4')
+    manifest = Manifest(str(tmpdir))
+
+    assert make(manifest, 'lerch2013', source, output, [u'-title', u'Über'])
+    assert not make(manifest, 'lerch2013', source, output,
+                    [b'-title', u'Über'.encode('UTF-8')])
+    assert make(manifest, 'lerch2013', source, output, [u'-title', u'Uber'])
+
+
+def test_prune_removes_only_unseen_outputs(tmpdir):
+    source = str(tmpdir.join('paper.pdf'))
+    write(source, b'%PDF-1.4')
+    out = tmpdir.mkdir('out')
+    manifest = Manifest(str(out))
+    make(manifest, 'old2013', source, str(out.join('old2013.pdf')))
+    make(manifest, 'kept2014', source, str(out.join('kept2014.pdf')))
+    write(str(out.join('notes.txt')), b'mine')
+    manifest.save()
+
+    manifest = Manifest(str(out))
+    make(manifest, 'kept2014', source, str(out.join('kept2014.pdf')))
+
+    assert manifest.prune() == [str(out.join('old2013.pdf'))]
+    assert sorted(os.listdir(str(out))) == ['.paperpal-manifest.json',
+                                            'kept2014.pdf', 'notes.txt']
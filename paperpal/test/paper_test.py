@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+from .. import paper
+from ..paper import Paper
+
+
+def test_authors_without_every_name():
+    authors = [{'last': u'ACM'}, {'first': u'Devender'}, {}]
+
+    assert Paper(authors)['authors'] == authors
+    assert Paper(authors) == dict(Paper(authors))
+
+
+def test_interned_names_are_bounded(monkeypatch):
+    monkeypatch.setattr(paper, 'MAX_INTERNED', 10)
+
+    papers = [Paper([{'first': u'Joshua', 'last': u'Lerch{}'.format(n)}])
+              for n in range(100)]
+
+    assert len(paper._interned) <= 10
+    assert papers[3]['authors'] == [{'first': u'Joshua', 'last': u'Lerch3'}]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import threading
+
+import pytest
+
+from ..pipeline import background, parallel_map
+
+
+def test_errors_are_raised_after_the_items_before_them():
+    def listing():
+        yield 1
+        yield 2
+        raise IOError('Zotero went away')
+
+    results = []
+    with pytest.raises(IOError):
+        for result in parallel_map(lambda x: x * 10, background(listing())):
+            results.append(result)
+    assert results == [10, 20]
+
+
+def test_stopping_early_stops_the_listing():
+    closed = threading.Event()
+
+    def listing():
+        try:
+            for n in range(100000):
+                yield n
+        finally:
+            closed.set()
+
+    threads = threading.active_count()
+    items = background(listing(), queue_size=10, chunk_size=2)
+    assert next(items) == 0
+    items.close()
+    assert closed.is_set()
+    assert threading.active_count() == threads
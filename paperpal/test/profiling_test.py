@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import json
+import threading
+
+from .. import profiling
+from ..profiling import count, span
+
+
+def test_trace_has_one_event_per_line_from_every_thread(tmpdir):
+    trace = str(tmpdir.join('trace.jsonl'))
+    profiling.enable(trace=trace)
+    try:
+        def copy(name):
+            with span('copy', name=name):
+                count('bytes.copied', 100)
+        threads = [threading.Thread(target=copy, args=('paper{}'.format(n),))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        profiling.disable()
+
+    events = [json.loads(line) for line in open(trace)]
+    spans = [event for event in events if event['ph'] == 'X']
+    counters = [event for event in events if event['ph'] == 'C']
+    assert sorted(event['args']['name'] for event in spans) == [
+        'paper0', 'paper1', 'paper2', 'paper3']
+    assert all(event['dur'] >= 0 for event in spans)
+    assert max(event['args']['bytes.copied'] for event in counters) == 400
+    assert not profiling.enabled()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import sys
+
+import pytest
+
+from ..scheduler import Job, Scheduler
+
+
+def test_timeout():
+    sleepy = Job('sleepy', [sys.executable, '-c',
+                            'import time; time.sleep(30)'])
+    quick = Job('quick', [sys.executable, '-c', 'pass'])
+
+    jobs = Scheduler(jobs=2, timeout=0.5).run([sleepy, quick])
+
+    assert [job.status for job in jobs] == ['timeout', 'ok']
+    assert sleepy.elapsed < 10
+
+
+def test_missing_executable():
+    job = Job('missing', ['paperpal-this-does-not-exist'])
+
+    Scheduler(jobs=1).run([job])
+
+    assert job.status == 'failed'
+    assert job.returncode is None
+
+
+def test_unusable_arguments_fail_only_that_job():
+    jobs = [Job('nul', [sys.executable, '-c', 'pass\0']),
+            Job('ok', [sys.executable, '-c', 'pass'])]
+
+    Scheduler(jobs=1).run(jobs)
+
+    assert [job.status for job in jobs] == ['failed', 'ok']
+
+
+def test_unexpected_error_in_on_finish_is_raised():
+    jobs = [Job(str(n), [sys.executable, '-c', 'pass']) for n in range(20)]
+
+    def on_finish(job):
+        raise KeyError(job.name)
+
+    with pytest.raises(KeyError):
+        Scheduler(jobs=2).run(iter(jobs), on_finish=on_finish)
+    assert 'failed' in [job.status for job in jobs]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+
+import pytest
+
+from ..__main__ import to_ebook
+from ..split_conversion import page_count
+from .fixtures import make_fake_k2pdfopt, make_fake_qpdf, synthetic_library
+
+
+@pytest.fixture
+def tools(tmpdir, monkeypatch):
+    bin_directory = tmpdir.mkdir('bin')
+    make_fake_k2pdfopt(str(bin_directory))
+    make_fake_qpdf(str(bin_directory))
+    monkeypatch.setenv('PATH', str(bin_directory) + os.pathsep +
+                       os.environ['PATH'])
+
+
+@pytest.fixture
+def library():
+    return synthetic_library(2, collection='Thesis')
+
+
+def test_long_pdfs_are_converted_in_parts(tmpdir, tools, library, storage,
+                                          zotero):
+    storage.join(library['Thesis'][0]['pdf']).write('%PDF-1.4 pages=250')
+    storage.join(library['Thesis'][1]['pdf']).write('%PDF-1.4 pages=12')
+    output = tmpdir.mkdir('ebook')
+
+    assert to_ebook('Thesis', str(output), zotero=zotero, jobs=2,
+                    split_pages=100) == 0
+
+    assert output.join('paper0.pdf').read() == ''.join(
+        '%PDF-1.4 pages=250 [p {}]'.format(pages)
+        for pages in ['1-83', '84-166', '167-250'])
+    assert output.join('paper1.pdf').read() == '%PDF-1.4 pages=12'
+    assert sorted(path.basename for path in output.listdir()) == [
+        '.paperpal-manifest.json', 'paper0.pdf', 'paper1.pdf']
+
+
+def test_page_count_without_qpdf(tmpdir):
+    tmpdir.join('thesis.pdf').write('%PDF-1.4 pages=250')
+
+    assert page_count(str(tmpdir.join('thesis.pdf')),
+                      executable='paperpal-this-does-not-exist') is None
+
+
+def test_qpdf_is_looked_up_once_per_run(tmpdir, tools, monkeypatch,
+                                        storage, zotero):
+    from distutils import spawn
+    find_executable = spawn.find_executable
+    lookups = []
+
+    def find_and_count(executable):
+        lookups.append(executable)
+        return find_executable(executable)
+    monkeypatch.setattr(spawn, 'find_executable', find_and_count)
+    storage.join('Paper 0.pdf').write('%PDF-1.4 pages=250')
+    storage.join('Paper 1.pdf').write('%PDF-1.4 pages=120')
+
+    assert to_ebook('Thesis', str(tmpdir.mkdir('ebook')), zotero=zotero,
+                    jobs=2, split_pages=100) == 0
+    assert lookups == ['qpdf']
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Guards how much paperpal imports before running a subcommand, since build
+scripts may run it hundreds of times.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# What parsing the command line needs. Importing paperpal may add nothing
+# else (e.g., sqlite3, subprocess or tempfile): subsystems and the slower
+# standard modules are imported once a subcommand runs.
+STARTUP = """
+import json, sys
+before = set(sys.modules)
+import argparse, atexit, contextlib, io, threading, time, warnings
+needed = set(sys.modules)
+from paperpal.__main__ import parser
+parser.parse_args(sys.argv[1:])
+print(json.dumps(sorted(name for name, module in sys.modules.items()
+                        if name not in needed and module is not None and
+                        name.split('.')[0] != 'paperpal')))
+"""
+
+
+@pytest.mark.parametrize('args', [
+    ['export', 'Thesis'],
+    ['export', '--incremental', 'Thesis'],
+    ['export-batch', 'Thesis:bibtex:thesis.bib'],
+    ['copy', 'Thesis', 'pdfs'],
+    ['to-ebook', 'Thesis', 'ebook'],
+    ['collections'],
+    ['watch', '--copy', 'pdfs', 'Thesis'],
+    ['fix-bibliography', 'in.bib', 'out.bib'],
+])
+def test_parsing_arguments_imports_nothing_more(args):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    output = subprocess.check_output([sys.executable, '-c', STARTUP] + args,
+                                     cwd=root)
+
+    assert json.loads(output) == []
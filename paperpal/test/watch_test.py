@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+
+import pytest
+
+from ..watch import InotifyWatcher, PollingWatcher, wait_for_change, watch
+from .fixtures import synthetic_library
+
+
+def make_watcher(kind):
+    if kind == 'polling':
+        return PollingWatcher()
+    try:
+        return InotifyWatcher()
+    except OSError:
+        pytest.skip('inotify is not available')
+
+
+@pytest.fixture
+def library(tmpdir):
+    library = synthetic_library(4, collection='Thesis')
+    for item in library['Thesis']:
+        if item['pdf'] is not None:
+            tmpdir.mkdir(item['pdf'][:-len('.pdf')]).join(item['pdf']).write(
+                '%PDF-1.4')
+            item['pdf'] = os.path.join(item['pdf'][:-len('.pdf')],
+                                       item['pdf'])
+    return library
+
+
+@pytest.fixture
+def storage(tmpdir):
+    return tmpdir
+
+
+@pytest.mark.parametrize('kind', ['polling', 'inotify'])
+def test_changed_pdfs_are_reported_by_directory(kind, tmpdir, zotero):
+    watcher = make_watcher(kind)
+    version = zotero.collection_version('Thesis')
+    watcher.watch([str(tmpdir.join('Paper 0')),
+                   str(tmpdir.join('Paper 1'))])
+
+    tmpdir.join('Paper 1', 'Paper 1.pdf').write('%PDF-1.4 annotated')
+    tmpdir.join('Paper 0', 'notes.txt').write('read again')
+    tmpdir.join('Paper 2', 'Paper 2.pdf').write('%PDF-1.4 unwatched')
+
+    changed = wait_for_change('Thesis', version, zotero, watcher,
+                              interval=0.05, debounce=0.05)
+    assert changed == set([str(tmpdir.join('Paper 0')),
+                           str(tmpdir.join('Paper 1'))])
+    watcher.close()
+
+
+def test_changes_to_the_collection_run_every_task_again(library, zotero):
+    calls = []
+
+    def task(directories):
+        calls.append(directories)
+        if len(calls) == 1:
+            # Someone adds an item while the outputs are being made.
+            library['Thesis'].append(dict(library['Thesis'][0],
+                                          cite_key=u'new2016'))
+
+    watch('Thesis', [task], zotero, PollingWatcher(),
+          interval=0.05, debounce=0.05, syncs=2)
+
+    assert calls == [None, None]
+
+
+def test_a_failing_task_does_not_stop_the_watch(zotero):
+    calls = []
+
+    def flaky(directories):
+        calls.append(directories)
+        if len(calls) == 1:
+            raise IOError('disk full')
+
+    def steady(directories):
+        calls.append('steady')
+
+    watch('Thesis', [flaky, steady], zotero, PollingWatcher(),
+          interval=0.01, debounce=0.01, syncs=2)
+
+    # After the failure, every task runs again, for the whole collection.
+    assert calls == [None, 'steady', None, 'steady']
+
+
+def test_watches_the_directories_the_tasks_listed(tmpdir, server, zotero):
+    calls = []
+
+    def task(directories):
+        calls.append(directories)
+        return [str(tmpdir.join('Paper 1'))]
+
+    watcher = PollingWatcher()
+    watcher.watch([])
+    original_watch = watcher.watch
+
+    def watch_then_annotate(directories):
+        original_watch(directories)
+        tmpdir.join('Paper 1', 'Paper 1.pdf').write('%PDF-1.4 annotated')
+    watcher.watch = watch_then_annotate
+
+    watch('Thesis', [task], zotero, watcher,
+          interval=0.05, debounce=0.05, syncs=2)
+
+    assert calls == [None, set([str(tmpdir.join('Paper 1'))])]
+    # Nothing is listed but by the tasks themselves.
+    assert 'list' not in server.calls
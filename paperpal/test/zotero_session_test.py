@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+"""
+Tests the Python side of the bridge protocol against a fake REPL.
+"""
+
+import json
+
+from ..zotero import Zotero, ZoteroError, runtime_version
+
+
+class FakeRepl(object):
+    """
+    Pretends to be Zotero: remembers whether the runtime is installed, and
+    answers every call with a canned payload (or with the next of several).
+    """
+
+    def __init__(self, payload, *more_payloads):
+        self.payloads = [payload] + list(more_payloads)
+        self.installed_version = None
+        self.sent = []
+
+    def execute(self, code):
+        self.sent.append(code)
+        if 'Zotero.paperpalBridge = {' in code:
+            self.installed_version = runtime_version()
+            return runtime_version()
+        if self.installed_version != runtime_version():
+            return json.dumps(['not_installed', None])
+        if len(self.payloads) > 1:
+            return json.dumps(self.payloads.pop(0))
+        return json.dumps(self.payloads[0])
+
+
+def test_installs_runtime_once():
+    repl = FakeRepl(['ok', {'items': [], 'cursor': None, 'timings': {}}])
+    z = Zotero(repl=repl)
+
+    z.list_papers('PartyCrasher')
+    z.list_papers('PartyCrasher')
+
+    installs = [code for code in repl.sent if 'paperpalBridge = {' in code]
+    assert len(installs) == 1
+    # Only the short call is sent after installation.
+    assert all(len(code) < 1000 for code in repl.sent[2:])
+
+
+def test_reuses_existing_runtime():
+    repl = FakeRepl(['ok', {'items': [], 'cursor': None, 'timings': {}}])
+    repl.installed_version = runtime_version()
+
+    Zotero(repl=repl).list_papers('PartyCrasher')
+
+    assert len(repl.sent) == 1
+
+
+def test_iter_papers_pages():
+    def page(cite_keys, cursor):
+        return ['ok', {'items': [dict(authors=[], title=key, cite_key=key,
+                                      pdf_filename=None)
+                                 for key in cite_keys],
+                       'cursor': cursor,
+                       'timings': {'total': 2}}]
+
+    repl = FakeRepl(page(['a', 'b'], 'cursor-0'), page(['c'], None))
+    repl.installed_version = runtime_version()
+    z = Zotero(repl=repl)
+
+    papers = z.iter_papers('PartyCrasher', page_size=2)
+    assert next(papers)['cite_key'] == 'a'
+    # The second page is only requested once the first one is used up.
+    assert len(repl.sent) == 1
+
+    assert [paper['cite_key'] for paper in papers] == ['b', 'c']
+    assert '"cursor": "cursor-0"' in repl.sent[1]
+    assert z.last_timings == {'total': 4}
+
+
+def test_error():
+    repl = FakeRepl(['error', ['unknown_collection', 'Nope']])
+    repl.installed_version = runtime_version()
+
+    try:
+        Zotero(repl=repl).list_papers('Nope')
+    except ZoteroError as error:
+        assert error.reason == ['unknown_collection', 'Nope']
+    else:
+        assert False, 'Expected ZoteroError'
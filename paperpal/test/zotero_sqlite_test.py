@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+import os
+
+import pytest
+
+from ..zotero import ZoteroError
+from ..zotero_sqlite import ZoteroDatabase
+from .fixtures import make_zotero_database
+
+
+LIBRARY = {
+    u'PartyCrasher': [
+        dict(title=u'Finding Duplicates of Your Yet Unwritten Bug Report',
+             authors=[dict(first=u'J.', last=u'Lerch'),
+                      dict(first=u'M.', last=u'Mezini')],
+             cite_key=u'lerch2013',
+             pdf=u'Lerch y Mezini - 2013.pdf'),
+        dict(title=u'No PDF, no cite key', authors=[],
+             cite_key=None, pdf=None),
+    ],
+    u'Empty': [],
+    u'Thesis/Chapter 3/Related': [
+        dict(title=u'Nested', authors=[], cite_key=u'nested', pdf=None),
+    ],
+    u'Thesis/Chapter 4/Related': [],
+}
+
+
+@pytest.fixture
+def database(tmpdir):
+    filename = str(tmpdir.join('zotero.sqlite'))
+    make_zotero_database(filename, LIBRARY)
+    with ZoteroDatabase(filename) as database:
+        yield database
+
+
+def test_list_papers(database):
+    result = database.list_papers('PartyCrasher')
+
+    expected_item = dict(
+        authors=[{'first': 'J.', 'last': 'Lerch'},
+                 {'first': 'M.', 'last': 'Mezini'}],
+        title='Finding Duplicates of Your Yet Unwritten Bug Report',
+        cite_key='lerch2013',
+    )
+
+    assert len(result) == 2
+    item = dict(result[0])
+    pdf_filename = item.pop('pdf_filename')
+    assert item == expected_item
+    # Stored files live in storage/<attachment key>/
+    storage, key, filename = pdf_filename.rsplit(os.sep, 2)
+    assert storage == os.path.join(database.data_directory, 'storage')
+    assert key.startswith('ATCH')
+    assert filename == 'Lerch y Mezini - 2013.pdf'
+
+    assert result[1]['cite_key'] is None
+    assert result[1]['pdf_filename'] is None
+
+
+def test_empty_collection(database):
+    assert database.list_papers('Empty') == []
+
+
+def test_unknown_collection(database):
+    with pytest.raises(ZoteroError):
+        database.list_papers('Nope')
+
+
+def test_nested_collections(database):
+    [paper] = database.list_papers('Thesis/Chapter 3/Related')
+    assert paper['cite_key'] == 'nested'
+
+    with pytest.raises(ZoteroError) as error:
+        database.list_papers('Related')
+    assert error.value.reason[0] == 'ambiguous_collection'
+
+
+def test_list_collections(database):
+    collections = database.list_collections()
+
+    assert [c['path'] for c in collections] == [
+        ('Empty',), ('PartyCrasher',), ('Thesis',), ('Thesis', 'Chapter 3'),
+        ('Thesis', 'Chapter 3', 'Related'), ('Thesis', 'Chapter 4'),
+        ('Thesis', 'Chapter 4', 'Related'),
+    ]
+    assert collections[1]['items'] == 2
+
+
+def test_version_changes(tmpdir):
+    filename = str(tmpdir.join('zotero.sqlite'))
+    make_zotero_database(filename, LIBRARY)
+    with ZoteroDatabase(filename) as database:
+        before = database.collection_version('PartyCrasher')
+
+    bigger = dict(LIBRARY)
+    bigger[u'PartyCrasher'] = LIBRARY[u'PartyCrasher'] * 2
+    os.remove(filename)
+    make_zotero_database(filename, bigger)
+    with ZoteroDatabase(filename) as database:
+        assert database.collection_version('PartyCrasher') != before
+
+
+def test_trash_and_base_fields(tmpdir):
+    filename = str(tmpdir.join('zotero.sqlite'))
+    make_zotero_database(filename, {u'Law': [
+        dict(title=u'Roe v. Wade', authors=[], cite_key=u'roe1973',
+             pdf=u'Roe.pdf', trashed_pdf=u'Roe (old).pdf', case=True),
+        dict(title=u'In the trash', authors=[], cite_key=u'trashed',
+             pdf=None, trashed=True),
+    ]})
+    with ZoteroDatabase(filename) as database:
+        [paper] = database.list_papers('Law')
+
+    assert paper['title'] == u'Roe v. Wade'
+    assert paper['cite_key'] == u'roe1973'
+    assert os.path.basename(paper['pdf_filename']) == u'Roe.pdf'
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keeps outputs up to date with a collection: waits until the collection (or
+one of its PDFs) changes, then runs the tasks that make the outputs again.
+"""
+
+import errno
+import os
+import struct
+import sys
+import time
+import warnings
+
+__all__ = ['watch', 'wait_for_change', 'storage_watcher', 'InotifyWatcher',
+           'PollingWatcher']
+
+# Seconds between asking Zotero for the collection's version.
+DEFAULT_INTERVAL = 2.0
+
+# Seconds without further changes before running the tasks.
+DEFAULT_DEBOUNCE = 1.0
+
+# Seconds after the first change to run the tasks, even if changes keep
+# arriving.
+MAX_DELAY = 30.0
+
+# Longest pause, in seconds, before running the tasks again after failures.
+MAX_BACKOFF = 60.0
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Changes to the files in a directory, but not mere reads or touches.
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT = struct.Struct('iIII')
+
+
+def watch(collection, tasks, zotero, watcher, interval=DEFAULT_INTERVAL,
+          debounce=DEFAULT_DEBOUNCE, syncs=None):
+    """
+    Runs every task now, then again after each change to the collection,
+    forever (or for `syncs` runs in total).
+
+    Each task is called with the set of directories whose PDFs changed, or
+    None if anything in the collection may have changed (e.g., on the first
+    run, or when Zotero reports a new version of the collection). Without a
+    watcher, only the latter is noticed. A task may return the directories
+    of the PDFs it listed; after a successful run, the watcher watches those
+    of every task that did.
+
+    A run that fails (e.g., Zotero is restarting, or a task raises) is
+    reported, and every task is run again after a pause that doubles with
+    each failure in a row, up to MAX_BACKOFF seconds.
+    """
+    directories = None
+    count = 0
+    failures = 0
+    while True:
+        try:
+            # Taken before running the tasks, so that changes made while
+            # they run are noticed afterwards.
+            version = zotero.collection_version(collection)
+            succeeded, listed = run_tasks(tasks, directories)
+            if succeeded and watcher is not None and listed is not None:
+                watcher.watch(listed)
+        except Exception as error:
+            recover(zotero, 'sync', error)
+            succeeded = False
+
+        count += 1
+        if syncs is not None and count >= syncs:
+            return
+        if not succeeded:
+            failures += 1
+            delay = min(interval * 2 ** failures, MAX_BACKOFF)
+            sys.stderr.write('watch: trying again in {:.1f}s\n'.format(delay))
+            time.sleep(delay)
+            directories = None
+            continue
+
+        failures = 0
+        try:
+            directories = wait_for_change(collection, version, zotero,
+                                          watcher, interval=interval,
+                                          debounce=debounce)
+        except Exception as error:
+            recover(zotero, 'waiting for changes', error)
+            directories = None
+
+
+def run_tasks(tasks, directories):
+    """
+    Runs every task, even if one before it fails. Returns whether they all
+    succeeded, and every PDF directory the tasks returned (or None if none
+    returned any).
+    """
+    succeeded = True
+    listed = None
+    for task in tasks:
+        try:
+            directories_listed = task(directories)
+        except Exception as error:
+            sys.stderr.write('watch: {} failed: {}\n'.format(
+                getattr(task, '__name__', task), error))
+            succeeded = False
+            continue
+        if directories_listed is not None:
+            listed = (listed or set()) | set(directories_listed)
+    return succeeded, listed
+
+
+def recover(zotero, what, error):
+    """
+    Reports a failure, and reconnects to Zotero if the connection may have
+    broken.
+    """
+    sys.stderr.write('watch: {} failed: {}\n'.format(what, error))
+    if isinstance(error, EnvironmentError):
+        try:
+            zotero.reconnect()
+        except EnvironmentError:
+            # Zotero is still away; the next attempt tries again.
+            pass
+
+
+def wait_for_change(collection, version, zotero, watcher,
+                    interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+    """
+    Blocks until the collection differs from version, or PDFs in watched
+    directories change, and then until changes stop arriving for `debounce`
+    seconds. Returns the changed directories, or None if the collection
+    itself changed.
+    """
+    changed = set()
+    current = version
+    first_change = last_change = None
+    while True:
+        timeout = interval if first_change is None else debounce
+        if watcher is not None:
+            directories = watcher.wait(timeout)
+        else:
+            time.sleep(timeout)
+            directories = set()
+        latest = zotero.collection_version(collection)
+        now = time.time()
+
+        if directories or latest != current:
+            changed.update(directories)
+            current = latest
+            first_change = first_change or now
+            last_change = now
+        if first_change is not None and (now - last_change >= debounce or
+                                         now - first_change >= MAX_DELAY):
+            return None if current != version else changed
+
+
+class PollingWatcher(object):
+    """
+    Notices changes by listing and stat()ing every watched directory each
+    time it waits.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+
+    def watch(self, directories):
+        """
+        Watches exactly these directories from now on.
+        """
+        self._snapshots = dict((directory, self._snapshot(directory))
+                               for directory in directories)
+
+    def wait(self, timeout):
+        """
+        Returns the set of watched directories that changed, after timeout
+        seconds.
+        """
+        time.sleep(timeout)
+        changed = set()
+        for directory, before in self._snapshots.items():
+            after = self._snapshot(directory)
+            if after != before:
+                changed.add(directory)
+                self._snapshots[directory] = after
+        return changed
+
+    def close(self):
+        self._snapshots = {}
+
+    def _snapshot(self, directory):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        snapshot = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            snapshot[name] = (stat.st_size, stat.st_mtime, stat.st_ino)
+        return snapshot
+
+
+class InotifyWatcher(object):
+    """
+    Notices changes as Linux reports them, without touching the directories.
+    """
+
+    def __init__(self):
+        self._libc = _load_inotify()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise _os_error()
+        self._directories = {}
+        self._descriptors = {}
+        self._warned = False
+
+    def watch(self, directories):
+        """
+        Watches exactly these directories from now on.
+        """
+        directories = set(directories)
+        for directory in set(self._descriptors) - directories:
+            self._libc.inotify_rm_watch(self.fd, self._descriptors[directory])
+            self._forget(self._descriptors[directory])
+
+        for directory in directories - set(self._descriptors):
+            descriptor = self._libc.inotify_add_watch(
+                self.fd, _bytes(directory), WATCH_MASK)
+            if descriptor >= 0:
+                self._directories[descriptor] = directory
+                self._descriptors[directory] = descriptor
+                continue
+            error = _os_error()
+            if error.errno == errno.ENOSPC and not self._warned:
+                self._warned = True
+                warnings.warn('Too many directories to watch; raise '
+                              'fs.inotify.max_user_watches to notice changes '
+                              'to every PDF')
+
+    def wait(self, timeout):
+        """
+        Returns the set of watched directories that changed, waiting up to
+        timeout seconds for the first change.
+        """
+        import select
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        if not readable:
+            return changed
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as error:
+                if error.errno == errno.EAGAIN:
+                    return changed
+                raise
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self._descriptors)
+                elif descriptor in self._directories:
+                    changed.add(self._directories[descriptor])
+                if mask & IN_IGNORED:
+                    self._forget(descriptor)
+
+    def close(self):
+        os.close(self.fd)
+
+    def _forget(self, descriptor):
+        directory = self._directories.pop(descriptor, None)
+        self._descriptors.pop(directory, None)
+
+
+def storage_watcher():
+    """
+    Returns an InotifyWatcher, if possible, otherwise a PollingWatcher.
+    """
+    try:
+        return InotifyWatcher()
+    except OSError:
+        return PollingWatcher()
+
+
+def _load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _os_error():
+    import ctypes
+    code = ctypes.get_errno()
+    return OSError(code, os.strerror(code))
+
+
+def _bytes(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding() or 'UTF-8')
@@ -20,14 +20,29 @@
  * the following immediately-invoked function expression (IIFE) **MUST** be
  * the last expression in the file!
  *
- * The API has two actions:
+ * The API has seven actions:
+ *  - collections
+ *  - exportBibliographies
  *  - exportBibliography
+ *  - exportItems
+ *  - itemVersions
  *  - list
+ *  - version
  *
- * Python INTENTIONALLY injects code into this snippet, passing an "action" as
- * a string, and any additional arguments through a JSON called "options".
- * This script executes in Zotero's context. The goal of the following
- * function is to return to Python a JSON expression of:
+ * Collections are named either by their name alone, or by their full path
+ * from the root of the library, e.g., "Thesis/Chapter 3/Related".
+ *
+ * Python sends this script once per Zotero instance; it installs itself as
+ * `Zotero.paperpalBridge`, which outlives both the script and the REPL
+ * connection. Python INTENTIONALLY injects the runtime's version into this
+ * snippet, so that an outdated runtime is replaced by a newer one.
+ *
+ * Afterwards, Python only sends short snippets that call:
+ *
+ *      Zotero.paperpalBridge.call(actionName, options)
+ *
+ * where "options" holds any additional arguments. The goal of call() is to
+ * return to Python a JSON string of:
  *
  *      ['ok', result]
  *
@@ -38,14 +53,59 @@
  * Originally derived from Jason Friedman's work:
  * http://www.curiousjason.com/zoterotobibtex.html
  */
-(function (actionName, options) {
+(function (version) {
     var BIBTEX_ID = '9cb70025-a888-4a29-a210-93ec52da40d4';
 
     var Zotero = Components.classes['@zotero.org/Zotero;1']
         .getService(Components.interfaces.nsISupports)
         .wrappedJSObject;
 
+    /* State kept between calls, for as long as this runtime is installed. */
+    var state = {
+        collectionIndex: null,
+        cursors: {},
+        cursorOrder: [],
+        nextCursor: 0
+    };
+
+    /* Unfinished listings to remember before forgetting the oldest. */
+    var MAX_CURSORS = 16;
+
     var actions = {
+        /**
+         * Lists every collection in the library, parents before children:
+         *
+         * [{
+         *      path: [name, ...],
+         *      items: _
+         *  }]
+         *
+         * No option parameters.
+         */
+        collections: function () {
+            var index = getCollectionIndex();
+            var counts = {};
+            Zotero.DB.query(
+                'SELECT collectionID, COUNT(*) AS count ' +
+                'FROM collectionItems GROUP BY collectionID'
+            ).forEach(function (row) {
+                counts[row.collectionID] = row.count;
+            });
+
+            var results = index.paths
+                .map(function (path) {
+                    var id = index.byPath[path.join('/')];
+                    return {path: path, items: counts[id] || 0};
+                })
+                .sort(function (a, b) {
+                    var left = a.path.join('\u0000').toLowerCase();
+                    var right = b.path.join('\u0000').toLowerCase();
+                    return left < right ? -1 : left > right ? 1 : 0;
+                });
+
+            return ['ok', results];
+        },
+
         /**
          * Exports Bibliography in the requested format to the given filename.
          *
@@ -55,68 +115,423 @@
          *  filename:   filename of file to save
          *  translator: [optional] ID of translator; uses BibTex by default.
          */
-        exportBibliography: withNamedCollection(function (collection) {
-            var translator = new Zotero.Translate.Export();
-            translator.setTranslator(options.translator || BIBTEX_ID);
-            translator.setLocation(openFile(options.filename));
-            translator.setCollection(collection);
-
-            translator.translate();
+        exportBibliography: withNamedCollection(function (collection, options) {
+            exportCollection(collection, options.translator, options.filename);
 
-            return ['ok', JSON.stringify(options.filename)];
+            return ['ok', options.filename];
         }),
 
         /**
-         * Lists item in the bibliography in the following format:
+         * Exports several bibliographies in one call, each to its own file,
+         * looking up each collection only once. One export failing does not
+         * stop the others. Returns, in order:
          *
          * [{
-         *      title: _,
-         *      authors: _,
-         *      date: _,
-         *      cite_key: _,
-         *      pdf_filename: _
+         *      status: 'ok' or 'error',
+         *      reason: _,
+         *      milliseconds: _
          *  }]
          *
          * Option parameters:
          *
+         *  exports:    [{collection: _, filename: _, translator: _}], as
+         *              for exportBibliography.
+         */
+        exportBibliographies: function (options) {
+            var collections = {};
+            var results = options.exports.map(function (job) {
+                var start = Date.now();
+                if (!collections.hasOwnProperty(job.collection)) {
+                    collections[job.collection] =
+                        getNamedCollection(job.collection);
+                }
+
+                var result = collections[job.collection];
+                if (result[0] === 'ok') {
+                    try {
+                        exportCollection(result[1], job.translator,
+                                         job.filename);
+                    } catch (error) {
+                        result = ['error', ['export_failed', String(error)]];
+                    }
+                }
+                return {
+                    status: result[0],
+                    reason: result[0] === 'ok' ? null : result[1],
+                    milliseconds: Date.now() - start
+                };
+            });
+
+            return ['ok', results];
+        },
+
+        /**
+         * Exports items one at a time, each to its own file, so that only
+         * the items that changed need exporting again. An item that no
+         * longer exists does not stop the others. Returns, in order:
+         *
+         * [reason]
+         *
+         * where reason is null for each item that was exported.
+         *
+         * Option parameters:
+         *
+         *  exports:    [{item: _, filename: _}], where item is an item ID
+         *              from itemVersions.
+         *  translator: [optional] ID of translator; uses BibTex by default.
+         */
+        exportItems: function (options) {
+            var ids = options.exports.map(function (job) {
+                return job.item;
+            });
+            /* Items that cannot be found are left out, not left as holes. */
+            var byId = {};
+            (ids.length > 0 ? Zotero.Items.get(ids) : []).forEach(
+                function (item) {
+                    if (item) {
+                        byId[item.id] = item;
+                    }
+                }
+            );
+
+            var results = options.exports.map(function (job) {
+                if (!byId.hasOwnProperty(job.item)) {
+                    return ['unknown_item', job.item];
+                }
+                try {
+                    var translator = makeTranslator(options.translator,
+                                                    job.filename);
+                    translator.setItems([byId[job.item]]);
+                    translator.translate();
+                } catch (error) {
+                    return ['export_failed', String(error)];
+                }
+                return null;
+            });
+
+            return ['ok', results];
+        },
+
+        /**
+         * Lists the ID and version of every regular item in the collection,
+         * in order of ID (translators may export them in another order):
+         *
+         * [[id, version]]
+         *
+         * An item's version changes whenever it, or any of its attachments
+         * or notes, is modified, added, or removed.
+         *
+         * Option parameters:
+         *
+         *  collection: name of the collection
+         */
+        itemVersions: withNamedCollection(function (collection) {
+            /* Exports would include subcollections, which this cannot. */
+            if (Zotero.Prefs.get('recursiveCollections')) {
+                return ['error', ['unsupported', 'recursiveCollections']];
+            }
+
+            var rows = Zotero.DB.query(
+                'SELECT items.itemID AS id, items.dateModified AS modified, ' +
+                '       COUNT(children.itemID) AS children, ' +
+                '       MAX(children.dateModified) AS childModified ' +
+                'FROM collectionItems ' +
+                'JOIN items ON items.itemID = collectionItems.itemID ' +
+                'JOIN itemTypes ON itemTypes.itemTypeID = items.itemTypeID ' +
+                'LEFT JOIN (' +
+                '    SELECT itemAttachments.sourceItemID AS parentID, ' +
+                '           items.itemID, items.dateModified ' +
+                '    FROM itemAttachments ' +
+                '    JOIN items ON items.itemID = itemAttachments.itemID ' +
+                '    UNION ALL ' +
+                '    SELECT itemNotes.sourceItemID, items.itemID, ' +
+                '           items.dateModified ' +
+                '    FROM itemNotes ' +
+                '    JOIN items ON items.itemID = itemNotes.itemID' +
+                ') AS children ON children.parentID = items.itemID ' +
+                'WHERE collectionItems.collectionID = ?1 ' +
+                "  AND itemTypes.typeName NOT IN ('attachment', 'note') " +
+                'GROUP BY items.itemID ORDER BY items.itemID',
+                [collection.id]
+            ) || [];
+
+            return ['ok', rows.map(function (row) {
+                return [row.id, [row.modified, row.children,
+                                 row.childModified].join(':')];
+            })];
+        }),
+
+        /**
+         * Lists item in the bibliography, one page at a time, in the
+         * following format:
+         *
+         * {
+         *      items: [{
+         *          title: _,
+         *          authors: _,
+         *          cite_key: _,
+         *          pdf_filename: _
+         *      }],
+         *      cursor: _,
+         *      timings: {
+         *          items: _,
+         *          attachments: _,
+         *          assemble: _,
+         *          total: _
+         *      }
+         * }
+         *
+         * To get the next page, call list again with the returned cursor,
+         * until the cursor is null. Timings are in milliseconds.
+         *
+         * Option parameters:
+         *
          *  collection: name of the collection to list
+         *  limit:      [optional] how many items to consider per page;
+         *              lists the entire collection by default.
+         *  cursor:     [optional] where to continue from.
          */
-        list: withNamedCollection(function (collection) {
-            var items = collection.getChildItems();
+        list: withNamedCollection(function (collection, options) {
+            var start = Date.now();
+            var cursor = getCursor(collection, options.cursor);
+            if (cursor === null) {
+                return ['error', ['unknown_cursor', options.cursor]];
+            }
+
+            var limit = options.limit || cursor.itemIds.length;
+            var pageIds = cursor.itemIds.slice(cursor.position,
+                                               cursor.position + limit);
+            cursor.position += pageIds.length;
 
-            var results = items
+            var items = (pageIds.length > 0 ? Zotero.Items.get(pageIds) : [])
                 .filter(function (item) {
                     return item.isRegularItem();
-                })
-                .map(function (item) {
-                    return {
-                        authors: simplifyCreators(item.getCreators()),
-                        title: item.getDisplayTitle(),
-                        cite_key: getCitationKey(item),
-                        pdf_filename: getPdfFilename(item)
-                    };
                 });
+            var attachmentIds = items.map(function (item) {
+                return item.getAttachments();
+            });
+            var itemsDone = Date.now();
 
-            return ['ok', JSON.stringify(results)];
+            /* Resolve all attachments at once, instead of once per item. */
+            var pdfFilenames = getPdfFilenames(
+                Array.prototype.concat.apply([], attachmentIds)
+            );
+            var attachmentsDone = Date.now();
+
+            var results = items.map(function (item, index) {
+                return {
+                    authors: simplifyCreators(item.getCreators()),
+                    title: item.getDisplayTitle(),
+                    cite_key: getCitationKey(item),
+                    pdf_filename: firstPdfFilename(attachmentIds[index],
+                                                   pdfFilenames)
+                };
+            });
+            var end = Date.now();
+
+            return ['ok', {
+                items: results,
+                cursor: saveCursor(cursor, options.cursor),
+                timings: {
+                    items: itemsDone - start,
+                    attachments: attachmentsDone - itemsDone,
+                    assemble: end - attachmentsDone,
+                    total: end - start
+                }
+            }];
+        }),
+
+        /**
+         * Returns a token that changes whenever an item in the collection,
+         * or any of their attachments, is added, removed (or trashed), or
+         * modified. This is much cheaper than listing the collection.
+         *
+         * Option parameters:
+         *
+         *  collection: name of the collection
+         */
+        version: withNamedCollection(function (collection) {
+            var row = Zotero.DB.rowQuery(
+                'SELECT COUNT(*) AS count, SUM(itemID) AS checksum, ' +
+                '       MAX(dateModified) AS modified ' +
+                'FROM items WHERE itemID IN (' +
+                '    SELECT itemID FROM collectionItems ' +
+                '    WHERE collectionID = ?1 ' +
+                '    UNION ' +
+                '    SELECT itemAttachments.itemID FROM itemAttachments ' +
+                '    JOIN collectionItems ' +
+                '        ON itemAttachments.sourceItemID = collectionItems.itemID ' +
+                '    WHERE collectionItems.collectionID = ?1) ' +
+                'AND itemID NOT IN (SELECT itemID FROM deletedItems)',
+                [collection.id]
+            );
+
+            return ['ok', [row.count, row.checksum, row.modified].join(':')];
         })
     };
 
-    /* Find the action and execute it. */
-    if (!actions[actionName]) {
-        return ['error', JSON.stringify(['unknown_action', actionName])];
+    /* Let go of an older runtime before replacing it. */
+    if (Zotero.paperpalBridge && Zotero.paperpalBridge.uninstall) {
+        Zotero.paperpalBridge.uninstall();
     }
-    return actions[actionName]();
+
+    /* Rebuild the collection index whenever a collection changes. */
+    var observerId = Zotero.Notifier.registerObserver({
+        notify: function () {
+            state.collectionIndex = null;
+        }
+    }, ['collection']);
+
+    Zotero.paperpalBridge = {
+        version: version,
+
+        uninstall: function () {
+            Zotero.Notifier.unregisterObserver(observerId);
+        },
+
+        /* Find the action and execute it. */
+        call: function (actionName, options) {
+            if (!actions.hasOwnProperty(actionName)) {
+                return JSON.stringify(['error', ['unknown_action', actionName]]);
+            }
+            return JSON.stringify(actions[actionName](options));
+        }
+    };
+
+    return version;
 
     /* === Library === */
 
+    /**
+     * Returns ['ok', collection], or ['error', reason] if there is no such
+     * collection, or if the name is ambiguous.
+     */
     function getNamedCollection(name) {
-        var collections = Zotero.getCollections();
-        var collection = collections.filter(function (c) {
-            return c.name === name;
-        })[0];
+        var result = lookUpCollection(getCollectionIndex(), name);
 
-        /* Return null if collection does not exist. */
-        return !!collection ? collection : null;
+        /* The index may be stale if the notifier missed something. */
+        if (result[0] !== 'ok' || isStale(result[1])) {
+            state.collectionIndex = null;
+            result = lookUpCollection(getCollectionIndex(), name);
+        }
+        return result;
+    }
+
+    function lookUpCollection(index, name) {
+        /* A full path (or the name of a top-level collection) wins. */
+        var id = index.byPath[name];
+        if (id === undefined) {
+            var ids = index.byName[name] || [];
+            if (ids.length > 1) {
+                return ['error', ['ambiguous_collection', name,
+                                  ids.map(function (id) {
+                                      return index.pathOf[id].join('/');
+                                  })]];
+            }
+            id = ids[0];
+        }
+
+        var collection = id === undefined ? false : Zotero.Collections.get(id);
+        if (!collection) {
+            return ['error', ['unknown_collection', name]];
+        }
+        return ['ok', collection];
+    }
+
+    /**
+     * Returns the cached index of collections by full path and by name.
+     */
+    function getCollectionIndex() {
+        if (state.collectionIndex !== null) {
+            return state.collectionIndex;
+        }
+
+        var collections = Zotero.getCollections(null, true);
+        var byId = {};
+        collections.forEach(function (collection) {
+            byId[collection.id] = collection;
+        });
+
+        var index = {byPath: {}, byName: {}, pathOf: {}, paths: []};
+        collections.forEach(function (collection) {
+            var path = [];
+            for (var c = collection; c; c = byId[c.parentID || c.parent]) {
+                path.unshift(c.name);
+            }
+
+            index.byPath[path.join('/')] = collection.id;
+            index.pathOf[collection.id] = path;
+            index.paths.push(path);
+            if (!index.byName.hasOwnProperty(collection.name)) {
+                index.byName[collection.name] = [];
+            }
+            index.byName[collection.name].push(collection.id);
+        });
+
+        state.collectionIndex = index;
+        return index;
+    }
+
+    /**
+     * Returns the listing to continue, a new listing when no cursor is given,
+     * or null if the cursor is unknown.
+     */
+    function getCursor(collection, cursorId) {
+        if (cursorId) {
+            return state.cursors.hasOwnProperty(cursorId) ?
+                state.cursors[cursorId] : null;
+        }
+
+        /* Remember only IDs; items are loaded one page at a time. */
+        return {
+            itemIds: collection.getChildItems(true) || [],
+            position: 0
+        };
+    }
+
+    /**
+     * Returns the ID of the cursor to continue listing from, or null when
+     * the listing is complete.
+     */
+    function saveCursor(cursor, cursorId) {
+        if (cursor.position >= cursor.itemIds.length) {
+            if (cursorId) {
+                delete state.cursors[cursorId];
+                state.cursorOrder = state.cursorOrder.filter(function (id) {
+                    return id !== cursorId;
+                });
+            }
+            return null;
+        }
+
+        if (!cursorId) {
+            cursorId = 'cursor-' + (state.nextCursor++);
+            state.cursors[cursorId] = cursor;
+            state.cursorOrder.push(cursorId);
+            while (state.cursorOrder.length > MAX_CURSORS) {
+                delete state.cursors[state.cursorOrder.shift()];
+            }
+        }
+        return cursorId;
+    }
+
+    function isStale(collection) {
+        var path = state.collectionIndex.pathOf[collection.id];
+        return !path || path[path.length - 1] !== collection.name;
+    }
+
+    function exportCollection(collection, translatorId, filename) {
+        var translator = makeTranslator(translatorId, filename);
+        translator.setCollection(collection);
+
+        translator.translate();
+    }
+
+    function makeTranslator(translatorId, filename) {
+        var translator = new Zotero.Translate.Export();
+        translator.setTranslator(translatorId || BIBTEX_ID);
+        translator.setLocation(openFile(filename));
+        return translator;
     }
 
     function openFile(filename) {
@@ -138,38 +553,51 @@
         });
     }
 
-    function getPdfFilename(item) {
-        var attachmentIds = item.getAttachments();
-        var attachments = Zotero.Items.get(attachmentIds);
-        var paths = attachments
-            .filter(function (attachment) {
-                return attachment.getAttachmentMIMEType() == 'application/pdf';
-            })
-            .map(function (attachment) {
-                return attachment.getLocalFileURL();
-            });
+    /**
+     * Returns a map of attachment ID to the file URL of every PDF among the
+     * given attachments.
+     */
+    function getPdfFilenames(attachmentIds) {
+        var filenames = {};
+        if (attachmentIds.length === 0) {
+            return filenames;
+        }
 
-        return paths.length > 0 ? paths[0] : null;
+        Zotero.Items.get(attachmentIds).forEach(function (attachment) {
+            if (attachment.getAttachmentMIMEType() == 'application/pdf') {
+                filenames[attachment.id] = attachment.getLocalFileURL() || null;
+            }
+        });
+        return filenames;
+    }
+
+    function firstPdfFilename(attachmentIds, pdfFilenames) {
+        for (var i = 0; i < attachmentIds.length; i++) {
+            if (pdfFilenames.hasOwnProperty(attachmentIds[i])) {
+                return pdfFilenames[attachmentIds[i]];
+            }
+        }
+        return null;
     }
 
     function getCitationKey(item) {
         var string = item.getField('extra');
         if (string) {
-            return string.split('bibtex: ')[1];
+            return string.split('bibtex: ')[1] || null;
         }
         return null;
     }
 
     function withNamedCollection(callback) {
-        return function () {
-            var collection = getNamedCollection(options.collection);
-            if (collection === null) {
-                return ['error', JSON.stringify(['unknown_collection', options.collection])];
+        return function (options) {
+            var result = getNamedCollection(options.collection);
+            if (result[0] !== 'ok') {
+                return result;
             }
 
-            return callback(collection)
+            return callback(result[1], options);
         };
     }
-}(/* %(close_comment)s %(action)s, %(options)s %(open_comment)s */));
+}(/* %(close_comment)s %(version)s %(open_comment)s */));
 /*globals Components */
 /*eslint no-define-before-use: false*/
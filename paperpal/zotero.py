@@ -16,17 +16,28 @@
 # limitations under the License.
 
 import json
-import logging
-import tempfile
-import urllib
-
-import mozrepl
+import os
 
+from .paper import Paper, url_to_filename
+from .profiling import count, span
 from .resource_path import resource_path
 
+# zotero-bridge.js and its version, once read; see runtime().
+_runtime = None
+
+# Calls the installed runtime; see zotero-bridge.js for the protocol.
+CALL_TEMPLATE = '''(function (Zotero) {
+    var bridge = Zotero.paperpalBridge;
+    if (!bridge || bridge.version !== %(version)s) {
+        return JSON.stringify(['not_installed', null]);
+    }
+    return bridge.call(%(action)s, %(options)s);
+}(Components.classes['@zotero.org/Zotero;1']
+    .getService(Components.interfaces.nsISupports)
+    .wrappedJSObject));'''
 
-with open(resource_path('zotero-bridge.js')) as javascript_file:
-    JS_RUNTIME = javascript_file.read()
+# How many items the bridge lists per round trip.
+PAGE_SIZE = 500
 
 NAME_TO_TRANSLATOR_ID = {
     'bibtex':           '9cb70025-a888-4a29-a210-93ec52da40d4',
@@ -44,43 +55,218 @@ class ZoteroError(Exception):
 
 
 class Zotero(object):
-    def __init__(self):
-        self.repl = mozrepl.Mozrepl()
+    """
+    A session with a running Zotero instance.
 
-    def list_papers(self, collection):
-        result = self._send_to_repl('list', collection=collection)
-        return [fix_filename(item) for item in result]
+    The connection stays open for the lifetime of the object, and the
+    JavaScript runtime is only sent to Zotero when it is not already
+    installed there (e.g., by a previous paperpal process).
+    """
 
-    def export_bibliography(self, collection, translator=None):
-        if translator is not None:
-            translator = NAME_TO_TRANSLATOR_ID[translator]
+    def __init__(self, repl=None):
+        if repl is None:
+            # Only sessions with a real Zotero need mozrepl (and its
+            # dependencies), which take a while to import.
+            import mozrepl
+            repl = mozrepl.Mozrepl()
+        self.repl = repl
+        # Milliseconds spent in each phase of the most recent listing,
+        # summed over all of its pages.
+        self.last_timings = None
+
+    def close(self):
+        self.repl.disconnect()
+
+    def reconnect(self):
+        """
+        Opens a new connection to the same Zotero, e.g., after it restarted.
+        """
+        try:
+            self.repl.disconnect()
+        except EnvironmentError:
+            # Already broken.
+            pass
+        self.repl = type(self.repl)(port=self.repl.port, host=self.repl.host)
+
+    def list_papers(self, collection, cache=None):
+        """
+        Returns the regular items in the collection. If given a ListingCache,
+        the collection is only listed if it changed since it was cached.
+        """
+        return list(self.iter_papers(collection, cache=cache))
+
+    def iter_papers(self, collection, cache=None, page_size=PAGE_SIZE):
+        """
+        Like list_papers(), but yields items as soon as each page of the
+        listing arrives.
+        """
+        if cache is None:
+            return self._iter_papers(collection, page_size)
+
+        return cache.iter_fetch(collection,
+                                self.collection_version(collection),
+                                lambda: self._iter_papers(collection,
+                                                          page_size),
+                                backend='zotero')
+
+    def list_collections(self):
+        """
+        Returns every collection, parents first, as dicts of path (a tuple
+        of names from the root of the library) and number of items.
+        """
+        return [dict(path=tuple(collection['path']),
+                     items=collection['items'])
+                for collection in self._send_to_repl('collections')]
 
+    def collection_version(self, collection):
+        """
+        Returns an opaque token that changes whenever the collection does.
+        """
+        return self._send_to_repl('version', collection=collection)
+
+    def _iter_papers(self, collection, page_size):
+        self.last_timings = timings = {}
+        cursor = None
+        while True:
+            page = self._send_to_repl('list', collection=collection,
+                                      limit=page_size, cursor=cursor)
+            for phase, milliseconds in page['timings'].items():
+                timings[phase] = timings.get(phase, 0) + milliseconds
+
+            count('zotero.items', len(page['items']))
+            for item in page['items']:
+                yield Paper.from_zotero(item)
+
+            cursor = page['cursor']
+            if cursor is None:
+                return
+
+    def export_bibliography(self, collection, translator=None):
+        import tempfile
         with tempfile.NamedTemporaryFile() as temporary:
-            self._send_to_repl('exportBibliography',
-                               filename=temporary.name,
-                               collection=collection,
-                               translator=translator)
+            self.export_bibliography_to(collection, temporary.name,
+                                        translator=translator)
             # Return the contents.
             temporary.seek(0)
             return temporary.read()
 
+    def export_bibliography_to(self, collection, filename, translator=None):
+        """
+        Has Zotero write the bibliography straight to filename.
+        """
+        if translator is not None:
+            translator = NAME_TO_TRANSLATOR_ID[translator]
+
+        self._send_to_repl('exportBibliography',
+                           filename=os.path.abspath(filename),
+                           collection=collection,
+                           translator=translator)
+
+    def export_bibliographies_to(self, exports):
+        """
+        Has Zotero write several bibliographies in one call, given
+        (collection, filename, translator) triples. Returns, for each in
+        order, the reason it failed (or None), and how many seconds it took.
+        """
+        results = self._send_to_repl('exportBibliographies', exports=[
+            dict(collection=collection, filename=os.path.abspath(filename),
+                 translator=(NAME_TO_TRANSLATOR_ID[translator]
+                             if translator is not None else None))
+            for collection, filename, translator in exports
+        ])
+        return [(None if result['status'] == 'ok' else result['reason'],
+                 result['milliseconds'] / 1000.0)
+                for result in results]
+
+    def item_versions(self, collection):
+        """
+        Returns the (id, version) of every regular item in the collection,
+        in order of ID, which need not be the order Zotero exports them. An
+        item's version changes whenever the item, or any of its attachments
+        or notes, does.
+        """
+        return [tuple(pair) for pair in
+                self._send_to_repl('itemVersions', collection=collection)]
+
+    def export_items_to(self, exports, translator=None):
+        """
+        Has Zotero write each item alone to its own file, given (id,
+        filename) pairs. Returns, for each in order, the reason it failed
+        (e.g., the item was deleted), or None.
+        """
+        if translator is not None:
+            translator = NAME_TO_TRANSLATOR_ID[translator]
+
+        exports = [dict(item=item, filename=os.path.abspath(filename))
+                   for item, filename in exports]
+        return self._send_to_repl('exportItems', translator=translator,
+                                  exports=exports)
+
     def _send_to_repl(self, action, **options):
-        # INTENTIONALLY inject code into the code snippet.
-        code = JS_RUNTIME % {
+        status, payload = self._call(action, options)
+        if status == 'not_installed':
+            self._install_runtime()
+            status, payload = self._call(action, options)
+
+        if status == 'error':
+            raise ZoteroError(payload)
+
+        return payload
+
+    def _call(self, action, options):
+        # The result is a single JSON string, which arrives in one round
+        # trip (unlike an array, which is fetched element by element).
+        code = CALL_TEMPLATE % {
+            'version': json.dumps(runtime_version()),
             'action': json.dumps(action),
-            'options': json.dumps(options),
+            'options': json.dumps(options)
+        }
+        with span('zotero.repl', action=action):
+            response = self.repl.execute(code)
+        with span('zotero.json', action=action):
+            return tuple(json.loads(response))
+
+    def _install_runtime(self):
+        # INTENTIONALLY inject code into the code snippet.
+        code = runtime()[0] % {
+            'version': json.dumps(runtime_version()),
             'open_comment': '/*',
             'close_comment': '*/'
         }
+        self.repl.execute(code)
 
-        result = self.repl.execute(code)
-        status, json_payload = tuple(result)
-        payload = json.loads(json_payload)
 
-        if status == 'error':
-            raise ZoteroError(payload)
+def runtime():
+    """
+    Returns the JavaScript runtime (zotero-bridge.js) and its version, read
+    the first time either is needed.
+    """
+    global _runtime
+    if _runtime is None:
+        import hashlib
+        with open(resource_path('zotero-bridge.js')) as javascript_file:
+            code = javascript_file.read()
+        # Changes whenever zotero-bridge.js changes, so that an old runtime
+        # lingering in Zotero is replaced.
+        _runtime = (code, hashlib.sha1(code).hexdigest())
+    return _runtime
+
+
+def runtime_version():
+    return runtime()[1]
 
-        return payload
+
+_session = None
+
+
+def session():
+    """
+    Returns a Zotero session shared by the entire process.
+    """
+    global _session
+    if _session is None:
+        _session = Zotero()
+    return _session
 
 
 def fix_filename(item):
@@ -92,10 +278,5 @@ def fix_filename(item):
     if item['pdf_filename'] is None:
         return item
 
-    original = item['pdf_filename']
-    if original.startswith('file://'):
-        original = original[len('file://'):]
-    filename = urllib.unquote(original)
-    item.update(pdf_filename=filename)
-
+    item.update(pdf_filename=url_to_filename(item['pdf_filename']))
     return item
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- encoding: UTF-8 -*-
+
+# Copyright 2016 Eddie Antonio Santos <easantos@ualberta.ca>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reads Zotero's database directly, without a running Zotero.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from .paper import Paper
+from .zotero import ZoteroError
+
+__all__ = ['ZoteroDatabase', 'resolve_attachment_path']
+
+PDF_MIME_TYPE = 'application/pdf'
+
+
+class ZoteroDatabase(object):
+    """
+    A read-only snapshot of zotero.sqlite, answering the same queries as a
+    Zotero session.
+
+    Zotero keeps its database locked while running, so the database (and its
+    write-ahead log, if any) is copied first; the copy is deleted on close().
+    """
+
+    def __init__(self, filename):
+        if not os.path.isfile(filename):
+            raise ZoteroError(['unknown_database', filename])
+
+        self.data_directory = os.path.dirname(os.path.abspath(filename))
+        self._snapshot_directory = tempfile.mkdtemp(prefix='paperpal-')
+        snapshot = os.path.join(self._snapshot_directory, 'zotero.sqlite')
+        for suffix in ('', '-wal'):
+            if os.path.exists(filename + suffix):
+                shutil.copyfile(filename + suffix, snapshot + suffix)
+
+        # Listed by whichever thread lists the collection (see
+        # pipeline.background), one thread at a time.
+        self.connection = sqlite3.connect(snapshot, check_same_thread=False)
+        self.connection.execute('PRAGMA query_only = ON')
+        self._detect_schema()
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+        shutil.rmtree(self._snapshot_directory, ignore_errors=True)
+
+    def list_papers(self, collection, cache=None):
+        """
+        Returns the regular items in the collection, in the same format as
+        Zotero.list_papers().
+        """
+        return list(self.iter_papers(collection, cache=cache))
+
+    def iter_papers(self, collection, cache=None):
+        """
+        Like list_papers(), but returns an iterator, as Zotero.iter_papers()
+        does.
+        """
+        if cache is None:
+            return iter(self._list_papers(collection))
+
+        return cache.iter_fetch(collection,
+                                self.collection_version(collection),
+                                lambda: iter(self._list_papers(collection)),
+                                backend='sqlite')
+
+    def collection_version(self, collection):
+        """
+        Returns the same kind of token as Zotero.collection_version().
+        """
+        row = self.connection.execute("""
+            SELECT COUNT(*), SUM(itemID), MAX(dateModified)
+            FROM items WHERE itemID IN (
+                SELECT itemID FROM collectionItems WHERE collectionID = :id
+                UNION
+                SELECT attachments.itemID
+                FROM itemAttachments AS attachments
+                JOIN collectionItems
+                    ON attachments.{parent} = collectionItems.itemID
+                WHERE collectionItems.collectionID = :id)
+              AND itemID NOT IN (SELECT itemID FROM deletedItems)
+        """.format(parent=self._parent_column),
+            {'id': self._collection_id(collection)}
+        ).fetchone()
+        return ':'.join(u'' if value is None else unicode(value)
+                        for value in row)
+
+    def _list_papers(self, collection):
+        collection_id = self._collection_id(collection)
+
+        papers = []
+        by_id = {}
+        for item_id, in self.connection.execute("""
+            SELECT items.itemID
+            FROM collectionItems
+            JOIN items USING (itemID)
+            JOIN itemTypes USING (itemTypeID)
+            WHERE collectionItems.collectionID = ?
+              AND itemTypes.typeName NOT IN ('attachment', 'note')
+              AND itemID NOT IN (SELECT itemID FROM deletedItems)
+            ORDER BY collectionItems.orderIndex, items.itemID
+        """, (collection_id,)):
+            paper = by_id[item_id] = dict(authors=[], title=u'',
+                                          cite_key=None, pdf_filename=None)
+            papers.append(paper)
+
+        # Some item types name their title differently (e.g., a case has a
+        # caseName); baseFieldsMap says which field stands for the title.
+        for item_id, field, value in self.connection.execute("""
+            SELECT itemData.itemID,
+                   COALESCE(baseFields.fieldName, fields.fieldName),
+                   itemDataValues.value
+            FROM collectionItems
+            JOIN items USING (itemID)
+            JOIN itemData USING (itemID)
+            JOIN fields USING (fieldID)
+            JOIN itemDataValues USING (valueID)
+            LEFT JOIN baseFieldsMap
+                ON baseFieldsMap.itemTypeID = items.itemTypeID
+               AND baseFieldsMap.fieldID = itemData.fieldID
+            LEFT JOIN fields AS baseFields
+                ON baseFields.fieldID = baseFieldsMap.baseFieldID
+            WHERE collectionItems.collectionID = ?
+              AND COALESCE(baseFields.fieldName, fields.fieldName)
+                  IN ('title', 'extra')
+        """, (collection_id,)):
+            if item_id not in by_id:
+                continue
+            if field == 'title':
+                by_id[item_id]['title'] = value
+            else:
+                by_id[item_id]['cite_key'] = citation_key(value)
+
+        for item_id, first, last in self.connection.execute("""
+            SELECT itemCreators.itemID, {names}
+            FROM collectionItems
+            JOIN itemCreators USING (itemID)
+            {join_names}
+            WHERE collectionItems.collectionID = ?
+            ORDER BY itemCreators.itemID, itemCreators.orderIndex
+        """.format(**self._creator_sql), (collection_id,)):
+            if item_id in by_id:
+                by_id[item_id]['authors'].append({'first': first,
+                                                  'last': last})
+
+        for item_id, key, path in self.connection.execute("""
+            SELECT attachments.{parent}, items.key, attachments.path
+            FROM collectionItems
+            JOIN itemAttachments AS attachments
+                ON attachments.{parent} = collectionItems.itemID
+            JOIN items ON items.itemID = attachments.itemID
+            WHERE collectionItems.collectionID = ?
+              AND attachments.{mime_type} = ?
+              AND attachments.itemID NOT IN (SELECT itemID FROM deletedItems)
+            ORDER BY attachments.itemID
+        """.format(parent=self._parent_column, mime_type=self._mime_column),
+                (collection_id, PDF_MIME_TYPE)):
+            paper = by_id.get(item_id)
+            if paper is None or paper['pdf_filename'] is not None:
+                continue
+            paper['pdf_filename'] = resolve_attachment_path(
+                path, key, self.data_directory
+            )
+
+        return [Paper(**paper) for paper in papers]
+
+    def list_collections(self):
+        """
+        Returns every collection, like Zotero.list_collections().
+        """
+        counts = dict(self.connection.execute(
+            'SELECT collectionID, COUNT(*) FROM collectionItems '
+            'GROUP BY collectionID'
+        ))
+        paths = self._collection_index()['path_of']
+        return sorted((dict(path=path, items=counts.get(collection_id, 0))
+                       for collection_id, path in paths.items()),
+                      key=lambda collection: [name.lower() for name
+                                              in collection['path']])
+
+    def _collection_id(self, name):
+        """
+        Finds a collection by its full path, or failing that, by its name.
+        """
+        index = self._collection_index()
+        if name in index['by_path']:
+            return index['by_path'][name]
+
+        ids = index['by_name'].get(name, [])
+        if len(ids) > 1:
+            raise ZoteroError(['ambiguous_collection', name,
+                               sorted(u'/'.join(index['path_of'][id])
+                                      for id in ids)])
+        if not ids:
+            raise ZoteroError(['unknown_collection', name])
+        return ids[0]
+
+    def _collection_index(self):
+        # The snapshot never changes, so the index is built only once.
+        if self._index is not None:
+            return self._index
+
+        rows = self.connection.execute(
+            'SELECT collectionID, collectionName, parentCollectionID '
+            'FROM collections'
+        ).fetchall()
+        parents = dict((id, parent) for id, _, parent in rows)
+        names = dict((id, name) for id, name, _ in rows)
+
+        self._index = index = dict(by_path={}, by_name={}, path_of={})
+        for collection_id, name, _ in rows:
+            path = []
+            ancestor = collection_id
+            while ancestor is not None and ancestor in names:
+                path.insert(0, names[ancestor])
+                ancestor = parents[ancestor]
+            path = tuple(path)
+
+            index['path_of'][collection_id] = path
+            index['by_path'][u'/'.join(path)] = collection_id
+            index['by_name'].setdefault(name, []).append(collection_id)
+        return index
+
+    def _detect_schema(self):
+        """
+        Zotero 4 and Zotero 5 name a few columns differently.
+        """
+        columns = set(row[1] for row in self.connection.execute(
+            'PRAGMA table_info(itemAttachments)'
+        ))
+        if not columns:
+            raise ZoteroError(['unknown_schema', 'itemAttachments'])
+
+        if 'sourceItemID' in columns:
+            self._parent_column = 'sourceItemID'
+            self._mime_column = 'mimeType'
+        else:
+            self._parent_column = 'parentItemID'
+            self._mime_column = 'contentType'
+
+        tables = set(row[0] for row in self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ))
+        if 'creatorData' in tables:
+            self._creator_sql = dict(
+                names='creatorData.firstName, creatorData.lastName',
+                join_names='JOIN creators USING (creatorID) '
+                           'JOIN creatorData USING (creatorDataID)'
+            )
+        else:
+            self._creator_sql = dict(
+                names='creators.firstName, creators.lastName',
+                join_names='JOIN creators USING (creatorID)'
+            )
+
+
+def citation_key(extra):
+    """
+    Finds the citation key in an item's "extra" field, like the bridge does.
+
+    >>> citation_key(u'bibtex: lerch2013')
+    u'lerch2013'
+    >>> citation_key(u'Some notes') is None
+    True
+    """
+    if not extra:
+        return None
+    parts = extra.split(u'bibtex: ')
+    return parts[1] if len(parts) > 1 else None
+
+
+def resolve_attachment_path(path, key, data_directory):
+    """
+    Returns the filesystem path of an attachment, as fix_filename() would
+    for the file:// URL Zotero returns. Stored files are kept in the storage
+    directory, under the attachment's key.
+
+    >>> resolve_attachment_path('storage:Lerch - 2013.pdf', 'IIVHABU8',
+    ...                         '/zotero')
+    '/zotero/storage/IIVHABU8/Lerch - 2013.pdf'
+    >>> resolve_attachment_path('/Users/Foo Bar/herp.pdf', 'ABCD1234',
+    ...                         '/zotero')
+    '/Users/Foo Bar/herp.pdf'
+    """
+    if path is None:
+        return None
+    if path.startswith('storage:'):
+        return os.path.join(data_directory, 'storage', key,
+                            path[len('storage:'):])
+    # Linked files relative to the (unknown) base directory cannot be found.
+    if path.startswith('attachments:'):
+        return None
+    return path